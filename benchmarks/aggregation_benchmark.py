@@ -0,0 +1,100 @@
+"""
+Benchmark the per-account aggregation at the end of engineer_subscription.
+
+Usage:
+    python -m benchmarks.aggregation_benchmark --n-accounts 1000 10000 100000
+"""
+import argparse
+import time
+import numpy as np
+import pandas as pd
+import sys
+sys.path.append(".")
+from datasets.aggregation import aggregate_subscription_info
+
+
+def make_subscriptions(n_accounts, rows_per_account=4, seed=42):
+    """
+    Generate cleaned subscription rows with the columns used by the per-account aggregation.
+    Categories are skewed like the competition data, where one package/section dominates most accounts.
+
+    Parameters:
+        n_accounts (int): Number of distinct accounts.
+        rows_per_account (int): Average number of rows per account.
+        seed (int): Random seed.
+
+    Returns:
+        pd.DataFrame: Synthetic subscriptions data.
+    """
+    rng = np.random.default_rng(seed)
+    n_rows = n_accounts * rows_per_account
+    cities = rng.choice(8, n_rows, p=[0.6, 0.15, 0.1, 0.05, 0.04, 0.03, 0.02, 0.01])
+    return pd.DataFrame({
+        "account.id": np.char.add("acc", rng.integers(0, n_accounts, n_rows).astype(str)).astype(object),
+        "season": rng.choice(["2010-2011", "2011-2012", "2012-2013", "2013-2014"], n_rows).astype(object),
+        "package": rng.choice(["Full", "Quartet", "Trio", "None"], n_rows, p=[0.7, 0.15, 0.1, 0.05]).astype(object),
+        "no.seats": rng.integers(1, 6, n_rows).astype(np.float64),
+        "section": rng.choice(["Orchestra", "Balcony", "Box", "None"], n_rows, p=[0.7, 0.15, 0.1, 0.05]).astype(object),
+        "multiple.subs": rng.choice(["yes", "no"], n_rows, p=[0.1, 0.9]).astype(object),
+        "price.level": rng.integers(1, 5, n_rows).astype(np.float64),
+        "subscription_tier": rng.integers(1, 4, n_rows).astype(np.float64),
+        "Lat": 37.0 + cities / 10,
+        "Long": -122.0 + cities / 10,
+        "music_taste": rng.integers(0, 12, n_rows).astype(np.float64),
+    })
+
+
+def aggregate_subscription_info_legacy(subscriptions_data):
+    """
+    Previous implementation: ten groupby passes with Python lambda modes, chained with merges.
+    """
+    sub_info_per_account = [
+            subscriptions_data.groupby("account.id")['season'].count().reset_index(),
+            subscriptions_data.groupby("account.id")['package'].agg(lambda x: x.value_counts().index[0]).reset_index(),
+            subscriptions_data.groupby("account.id")['no.seats'].mean().reset_index(),
+            subscriptions_data.groupby("account.id")['section'].agg(lambda x: x.value_counts().index[0]).reset_index(),
+            subscriptions_data.groupby("account.id")['multiple.subs'].agg(lambda x: x.value_counts().index[0]).reset_index(),
+            subscriptions_data.groupby("account.id")['price.level'].mean().reset_index(),
+            subscriptions_data.groupby("account.id")['subscription_tier'].mean().reset_index(),
+            subscriptions_data.groupby("account.id")['Lat'].agg(lambda x:x.value_counts().index[0]).reset_index(),
+            subscriptions_data.groupby("account.id")['Long'].agg(lambda x:x.value_counts().index[0]).reset_index(),
+            subscriptions_data.groupby("account.id")['music_taste'].sum().reset_index()
+    ]
+    for i in range(len(sub_info_per_account)):
+        if i==0:
+            sub_info = sub_info_per_account[i]
+        else:
+            sub_info = sub_info.merge(sub_info_per_account[i], how = "inner", on = "account.id")
+    return sub_info
+
+
+def time_call(func, *args, repeat=3):
+    """
+    Return the best wall-clock time of several calls and the output of the last one.
+    """
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, output
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the per-account subscription aggregation")
+    parser.add_argument("--n-accounts", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print("{:>10} {:>10} {:>12} {:>12} {:>8}".format("accounts", "rows", "legacy (s)", "single (s)", "speedup"))
+    for n_accounts in args.n_accounts:
+        subscriptions_data = make_subscriptions(n_accounts)
+        legacy_time, expected = time_call(aggregate_subscription_info_legacy, subscriptions_data, repeat=args.repeat)
+        single_time, result = time_call(aggregate_subscription_info, subscriptions_data, repeat=args.repeat)
+        pd.testing.assert_frame_equal(result, expected, check_exact=True)
+        print("{:>10} {:>10} {:>12.4f} {:>12.4f} {:>7.1f}x".format(
+            n_accounts, len(subscriptions_data), legacy_time, single_time, legacy_time / single_time))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Check the chunked subscription pipeline against engineer_subscription on the whole tables, and compare their time and peak memory.
+The subscriptions and tickets csv files are repeated with distinct account ids, to simulate a longer history.
+Each mode runs in a fresh process, so that its peak RSS is its own.
+
+Usage:
+    python -m benchmarks.chunked_benchmark --data-path data --scale 1 10 --chunk-size 100000
+"""
+import argparse
+import multiprocessing
+import resource
+import tempfile
+import time
+import warnings
+from pathlib import Path
+import pandas as pd
+import sys
+sys.path.append(".")
+from datasets import RAW_TABLES, STREAMED_TABLES, load_data, load_table_chunks, get_city_centroids, engineer_subscription, engineer_subscription_chunked
+
+warnings.filterwarnings("ignore")
+
+
+def write_scaled_tables(data_path, output_path, scale):
+    """
+    Write the streamed tables repeated scale times with distinct account ids, one copy at a time.
+    """
+    raw_data = load_data(data_path, tables=STREAMED_TABLES)
+    for name in STREAMED_TABLES:
+        csv_file = output_path / RAW_TABLES[name][0]
+        for i in range(scale):
+            copy = raw_data[name].copy()
+            copy["account.id"] = copy["account.id"] + ("" if i == 0 else "_%d" % i)
+            copy.to_csv(csv_file, index=False, mode="w" if i == 0 else "a", header=i == 0)
+
+
+def run_mode(mode, data_path, scaled_path, chunk_size, result_file):
+    """
+    Engineer the subscription table of the scaled tables in one mode, save it and return its time and peak RSS in MB.
+    """
+    lookups = load_data(data_path, tables=["zipcodes", "concerts", "concerts1415"])
+    lookups = [get_city_centroids(lookups["zipcodes"]), lookups["concerts"], lookups["concerts1415"]]
+    start = time.perf_counter()
+    if mode == "full":
+        tables = [pd.read_csv(scaled_path / RAW_TABLES[name][0], **RAW_TABLES[name][1]) for name in STREAMED_TABLES]
+        sub_info = engineer_subscription(*tables, *lookups)
+    else:
+        chunks = [load_table_chunks(scaled_path / RAW_TABLES[name][0], chunk_size, **RAW_TABLES[name][1]) for name in STREAMED_TABLES]
+        sub_info = engineer_subscription_chunked(*chunks, *lookups)
+    elapsed = time.perf_counter() - start
+    sub_info.to_pickle(result_file)
+    # ru_maxrss is in kilobytes on Linux
+    return elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check and benchmark the chunked subscription pipeline")
+    parser.add_argument("--data-path", type=Path, default=Path("data"))
+    parser.add_argument("--scale", type=int, nargs="+", default=[1, 10])
+    parser.add_argument("--chunk-size", type=int, default=100000)
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    print("{:>6} {:>10} {:>8} {:>10} {:>14}".format("scale", "rows", "mode", "time (s)", "peak RSS (MB)"))
+    for scale in args.scale:
+        scaled_path = Path(tempfile.mkdtemp())
+        write_scaled_tables(args.data_path, scaled_path, scale)
+        n_rows = sum(sum(1 for _ in open(scaled_path / RAW_TABLES[name][0])) - 1 for name in STREAMED_TABLES)
+
+        results = {}
+        for mode in ["full", "chunked"]:
+            result_file = scaled_path / (mode + ".pkl")
+            with context.Pool(1) as pool:
+                elapsed, peak_rss = pool.apply(run_mode, (mode, args.data_path, scaled_path, args.chunk_size, result_file))
+            results[mode] = pd.read_pickle(result_file)
+            print("{:>6} {:>10} {:>8} {:>10.2f} {:>14.0f}".format(scale, n_rows, mode, elapsed, peak_rss))
+
+        pd.testing.assert_frame_equal(results["chunked"], results["full"])
+
+
+if __name__ == "__main__":
+    main()
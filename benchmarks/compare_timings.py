@@ -0,0 +1,40 @@
+"""
+Compare the stage and timer times of two runs from their timings.json, e.g. before and after a commit.
+
+Usage:
+    python -m benchmarks.compare_timings results/<base run>/timings.json results/<new run>/timings.json
+"""
+import argparse
+import json
+
+
+def load_times(timings_file):
+    """
+    Wall time of every stage and total time of every timer of a timings.json, with the commit of the run.
+    """
+    with open(timings_file) as f:
+        timings = json.load(f)
+    times = {stage["name"]: stage["wall_time"] for stage in timings["stages"]}
+    times.update({name: timer["total_time"] for name, timer in timings["timers"].items()})
+    return timings["git_commit"], times
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the timings of two runs")
+    parser.add_argument("base", help="timings.json of the base run")
+    parser.add_argument("new", help="timings.json of the new run")
+    args = parser.parse_args()
+
+    base_commit, base_times = load_times(args.base)
+    new_commit, new_times = load_times(args.new)
+    print("base: {}\nnew:  {}".format(base_commit, new_commit))
+    print("{:<45} {:>10} {:>10} {:>8}".format("stage", "base (s)", "new (s)", "ratio"))
+    for name in list(base_times) + [name for name in new_times if name not in base_times]:
+        base_time, new_time = base_times.get(name), new_times.get(name)
+        ratio = new_time / base_time if base_time and new_time is not None else float("nan")
+        print("{:<45} {:>10} {:>10} {:>8.2f}".format(name, "-" if base_time is None else "%.2f" % base_time,
+                                                      "-" if new_time is None else "%.2f" % new_time, ratio))
+
+
+if __name__ == "__main__":
+    main()
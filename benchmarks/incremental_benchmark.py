@@ -0,0 +1,72 @@
+"""
+Check the incremental feature pipeline against a full rebuild of engineer_subscription and time both.
+The subscriptions and tickets tables are replayed in batches, as if new rows were appended every day.
+
+Usage:
+    python -m benchmarks.incremental_benchmark --data-path data --n-batches 5 --scale 1 10
+"""
+import argparse
+import tempfile
+import time
+import warnings
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import sys
+sys.path.append(".")
+from datasets import load_data, get_city_centroids, engineer_subscription, engineer_subscription_incremental
+
+warnings.filterwarnings("ignore")
+
+
+def scale_table(df, scale):
+    """
+    Repeat a table with distinct account ids, to simulate a longer history.
+    """
+    copies = []
+    for i in range(scale):
+        copy = df.copy()
+        copy["account.id"] = copy["account.id"] + ("" if i == 0 else "_%d" % i)
+        copies.append(copy)
+    return pd.concat(copies, ignore_index=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check and benchmark the incremental feature pipeline")
+    parser.add_argument("--data-path", type=Path, default=Path("data"))
+    parser.add_argument("--n-batches", type=int, default=5, help="number of daily batches appended after the initial history")
+    parser.add_argument("--history", type=float, default=0.9, help="fraction of the rows already in the state before the batches")
+    parser.add_argument("--scale", type=int, nargs="+", default=[1])
+    args = parser.parse_args()
+
+    raw_data = load_data(args.data_path, cache_path=args.data_path / ".cache")
+    lookups = get_city_centroids(raw_data["zipcodes"]), raw_data["concerts"], raw_data["concerts1415"]
+
+    print("{:>6} {:>10} {:>6} {:>12} {:>10} {:>12}".format("scale", "rows", "batch", "incremental", "full", "max diff"))
+    for scale in args.scale:
+        subscriptions_df = scale_table(raw_data["subscriptions"], scale)
+        tickets_df = scale_table(raw_data["tickets"], scale)
+        state_path = Path(tempfile.mkdtemp()) / "subscription_state.pkl"
+
+        fractions = np.linspace(args.history, 1, args.n_batches + 1)
+        for batch, fraction in enumerate(fractions):
+            subscriptions = subscriptions_df.iloc[:int(round(len(subscriptions_df) * fraction))]
+            tickets = tickets_df.iloc[:int(round(len(tickets_df) * fraction))]
+
+            start = time.perf_counter()
+            result = engineer_subscription_incremental(state_path, subscriptions, tickets, *lookups)
+            incremental_time = time.perf_counter() - start
+            start = time.perf_counter()
+            expected = engineer_subscription(subscriptions.copy(), tickets.copy(), *lookups)
+            full_time = time.perf_counter() - start
+
+            # means are summed in another order than groupby's, they agree up to the rounding of their float32 columns
+            pd.testing.assert_frame_equal(result, expected, check_exact=False, rtol=1e-6)
+            float_columns = expected.select_dtypes("floating").columns
+            max_diff = np.abs(result[float_columns] - expected[float_columns]).max().max()
+            print("{:>6} {:>10} {:>6} {:>11.3f}s {:>9.3f}s {:>12.2e}".format(
+                scale, len(subscriptions) + len(tickets), "init" if batch == 0 else batch, incremental_time, full_time, max_diff))
+
+
+if __name__ == "__main__":
+    main()
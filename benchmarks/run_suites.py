@@ -0,0 +1,73 @@
+"""
+Run the benchmark suites of benchmarks/suites.py and optionally compare them to the results of a previous run.
+Every time_* method is run repeat times after its setup, its minimum and median times are reported.
+
+Usage:
+    python -m benchmarks.run_suites --scale 1 10 --output base.json
+    python -m benchmarks.run_suites --scale 1 10 --compare base.json --bench engineer_subscription
+"""
+import argparse
+import json
+import time
+import numpy as np
+import sys
+sys.path.append(".")
+from benchmarks.suites import SUITES
+from utils import get_git_commit
+
+
+def run_benchmark(suite, method_name, scale, repeat):
+    """
+    Times of repeat calls of a time_* method after the setup of its suite.
+    """
+    instance = suite()
+    instance.setup(scale)
+    method = getattr(instance, method_name)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        method(scale)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the benchmark suites")
+    parser.add_argument("--scale", type=int, nargs="+", default=[1, 10])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--bench", nargs="*", default=None, help="run only the benchmarks containing one of these strings")
+    parser.add_argument("--output", help="save the results as json")
+    parser.add_argument("--compare", help="results json of a previous run to compare to")
+    parser.add_argument("--threshold", type=float, default=1.2, help="median time ratio reported as a regression")
+    args = parser.parse_args()
+
+    base = {}
+    if args.compare:
+        with open(args.compare) as f:
+            base = json.load(f)["results"]
+
+    results = {}
+    print("{:<55} {:>6} {:>10} {:>10} {:>8}".format("benchmark", "scale", "min (s)", "median (s)", "ratio"))
+    # scale first, so that the setups cached per scale are shared by the suites
+    for scale in args.scale:
+        for suite in SUITES:
+            if scale not in suite.params:
+                continue
+            for method_name in sorted(name for name in dir(suite) if name.startswith("time_")):
+                name = "{}.{}".format(suite.__name__, method_name)
+                if args.bench and not any(bench in name for bench in args.bench):
+                    continue
+                times = run_benchmark(suite, method_name, scale, args.repeat)
+                key = "{}[{}]".format(name, scale)
+                results[key] = {"min": min(times), "median": float(np.median(times)), "times": times}
+                ratio = results[key]["median"] / base[key]["median"] if key in base else float("nan")
+                flag = "  REGRESSION" if ratio > args.threshold else ""
+                print("{:<55} {:>6} {:>10.3f} {:>10.3f} {:>8.2f}{}".format(name, scale, min(times), results[key]["median"], ratio, flag))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"git_commit": get_git_commit("."), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
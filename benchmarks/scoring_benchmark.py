@@ -0,0 +1,86 @@
+"""
+Benchmark the throughput (rows/sec) and peak memory of the chunked scorer on synthetic accounts.
+Synthetic accounts copy the engineered rows of random real accounts under new ids, so their features look real.
+
+Usage:
+    python -m benchmarks.scoring_benchmark --data-path data --n-accounts 1000000 --chunk-size 10000 100000
+"""
+import argparse
+import resource
+import tempfile
+import time
+import warnings
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import sys
+sys.path.append(".")
+from datasets import load_data, get_feature_tables, get_engineered_data, save_category_encoders
+from models import get_engine, save_model
+from utils.test import score_stream
+
+warnings.filterwarnings("ignore")
+
+
+def make_synthetic_tables(feature_tables, n_accounts, seed=42):
+    """
+    Build engineered tables of n_accounts synthetic accounts from the real ones.
+
+    Parameters:
+        feature_tables (tuple): (accounts_data, zipcode_index, subscriptions_data) of the real data.
+        n_accounts (int): Number of synthetic accounts.
+        seed (int): Random seed.
+
+    Returns:
+        tuple: Synthetic (accounts_data, zipcode_index, subscriptions_data) and the synthetic account ids.
+    """
+    accounts_data, zipcode_index, subscriptions_data = feature_tables
+    rng = np.random.default_rng(seed)
+    account_ids = pd.Series(["synthetic%08d" % i for i in range(n_accounts)], dtype=object)
+
+    synthetic_accounts = accounts_data.iloc[rng.integers(0, len(accounts_data), n_accounts)].reset_index(drop=True)
+    # same share of accounts with subscriptions as in the real data
+    source_ids = synthetic_accounts["account.id"]
+    synthetic_accounts["account.id"] = account_ids
+    subscribed = source_ids.isin(subscriptions_data["account.id"]).values
+    synthetic_subscriptions = subscriptions_data.set_index("account.id").loc[source_ids[subscribed]].reset_index(drop=True)
+    synthetic_subscriptions.insert(0, "account.id", account_ids[subscribed].values)
+    return (synthetic_accounts, zipcode_index, synthetic_subscriptions), account_ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the chunked scorer")
+    parser.add_argument("--data-path", type=Path, default=Path("data"))
+    parser.add_argument("--n-accounts", type=int, default=1000000)
+    parser.add_argument("--chunk-size", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--model", default="lightgbm")
+    args = parser.parse_args()
+
+    raw_data = load_data(args.data_path, cache_path=args.data_path / ".cache")
+    feature_tables = get_feature_tables(raw_data, cache_path=args.data_path / ".cache")
+
+    # a model with default parameters is enough to time scoring
+    encoders = {}
+    X_train, y_train = get_engineered_data(raw_data["train"], "train", feature_tables[2], feature_tables[1], feature_tables[0], encoders)
+    engine = get_engine(args.model)
+    model_path = Path(tempfile.mkdtemp()) / "model"
+    save_model(engine.fit(engine.get_params({}), X_train, y_train), args.model, X_train.columns, model_path)
+    save_category_encoders(encoders, model_path / "encoders.json")
+
+    synthetic_tables, account_ids = make_synthetic_tables(feature_tables, args.n_accounts)
+    input_file = model_path.parent / "account_ids.csv"
+    output_file = model_path.parent / "predictions.csv"
+    pd.DataFrame({"ID": account_ids}).to_csv(input_file, index=False)
+
+    print("{:>10} {:>10} {:>10} {:>12} {:>14}".format("accounts", "chunk", "time (s)", "rows/sec", "peak RSS (MB)"))
+    for chunk_size in args.chunk_size:
+        start = time.perf_counter()
+        n_scored = score_stream(model_path, synthetic_tables, input_file, output_file, chunk_size=chunk_size)
+        elapsed = time.perf_counter() - start
+        # ru_maxrss is in kilobytes on Linux, it includes the synthetic tables and is a high-water mark over the runs
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        print("{:>10} {:>10} {:>10.2f} {:>12.0f} {:>14.0f}".format(n_scored, chunk_size, elapsed, n_scored / elapsed, peak_rss))
+
+
+if __name__ == "__main__":
+    main()
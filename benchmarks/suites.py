@@ -0,0 +1,111 @@
+"""
+Benchmark suites of the hot paths of the pipeline on synthetic data at 1x, 10x and 100x the competition data.
+Suites follow the asv layout: a class per suite with params, a setup method and time_* methods, run by benchmarks/run_suites.py.
+Setups are cached per scale, only the time_* methods are timed.
+"""
+import functools
+import warnings
+import optuna
+import sys
+sys.path.append(".")
+from benchmarks.synthetic import SCALES, make_synthetic_data
+from datasets import (engineer_tickets, engineer_subscription, get_city_centroids, get_music_taste_from_tickets_subs, get_feature_tables,
+                      get_engineered_data)
+from models import get_engine
+from utils import objective, get_folds, index_feature_tables, score_accounts
+
+warnings.filterwarnings("ignore")
+optuna.logging.set_verbosity(optuna.logging.WARNING)
+
+MODEL_NAME = "lightgbm"
+
+
+@functools.lru_cache(maxsize=1)
+def get_feature_data(scale):
+    """
+    Engineered tables and train/test features of the synthetic data at a scale.
+    """
+    raw_data = make_synthetic_data(scale)
+    feature_tables = get_feature_tables(raw_data)
+    X_train, y_train = get_engineered_data(raw_data["train"], "train", feature_tables[2], feature_tables[1], feature_tables[0], {})
+    X_test, _ = get_engineered_data(raw_data["test"], "test", feature_tables[2], feature_tables[1], feature_tables[0], {})
+    return feature_tables, X_train, y_train, X_test
+
+
+@functools.lru_cache(maxsize=1)
+def get_trial_params(seed=0):
+    """
+    Parameters of the first trial of a seeded study, so that every run times the same trial.
+    """
+    study = optuna.create_study(direction="maximize", sampler=optuna.samplers.RandomSampler(seed=seed))
+    trial = study.ask()
+    get_engine(MODEL_NAME).suggest_params(trial)
+    return trial.params
+
+
+class SubscriptionSuite:
+    params = list(SCALES)
+    param_names = ["scale"]
+
+    def setup(self, scale):
+        self.raw_data = make_synthetic_data(scale)
+        self.subscriptions_data = self.raw_data["subscriptions"]
+        self.tickets_data = engineer_tickets(self.raw_data["tickets"])
+        self.city_centroids = get_city_centroids(self.raw_data["zipcodes"])
+
+    def time_engineer_subscription(self, scale):
+        engineer_subscription(self.raw_data["subscriptions"], self.raw_data["tickets"], self.city_centroids,
+                              self.raw_data["concerts"], self.raw_data["concerts1415"])
+
+    def time_get_music_taste_from_tickets_subs(self, scale):
+        get_music_taste_from_tickets_subs(self.subscriptions_data, self.tickets_data, self.raw_data["concerts"], self.raw_data["concerts1415"])
+
+
+class FeatureSuite:
+    params = list(SCALES)
+    param_names = ["scale"]
+
+    def setup(self, scale):
+        self.raw_data = make_synthetic_data(scale)
+        self.feature_tables = get_feature_data(scale)[0]
+
+    def time_get_engineered_data(self, scale):
+        accounts_data, zipcode_index, subscriptions_data = self.feature_tables
+        get_engineered_data(self.raw_data["train"], "train", subscriptions_data, zipcode_index, accounts_data, {})
+
+
+class ObjectiveSuite:
+    params = list(SCALES)
+    param_names = ["scale"]
+
+    def setup(self, scale):
+        _, self.X_train, self.y_train, _ = get_feature_data(scale)
+        self.folds = get_folds(self.y_train.values)
+        self.trial_params = get_trial_params()
+
+    def time_objective(self, scale):
+        # sequential folds and no dataset cache, a single cold trial
+        objective(optuna.trial.FixedTrial(self.trial_params), self.X_train, self.y_train, self.folds, model_name=MODEL_NAME)
+
+
+class PredictionSuite:
+    params = list(SCALES)
+    param_names = ["scale"]
+
+    def setup(self, scale):
+        feature_tables, X_train, y_train, self.X_test = get_feature_data(scale)
+        self.engine = get_engine(MODEL_NAME)
+        trial = optuna.trial.FixedTrial(get_trial_params())
+        self.model = self.engine.fit(self.engine.get_params(self.engine.suggest_params(trial)), X_train, y_train)
+        self.feature_names = list(X_train.columns)
+        self.indexed_tables = index_feature_tables(*feature_tables)
+        self.account_ids = make_synthetic_data(scale)["test"]["ID"]
+
+    def time_predict(self, scale):
+        self.engine.predict(self.model, self.X_test)
+
+    def time_score_accounts(self, scale):
+        score_accounts(self.account_ids, self.engine, self.model, self.feature_names, self.indexed_tables)
+
+
+SUITES = [SubscriptionSuite, FeatureSuite, ObjectiveSuite, PredictionSuite]
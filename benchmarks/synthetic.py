@@ -0,0 +1,240 @@
+"""
+Synthetic competition data with the schemas of the csv files in data/, for benchmarks at any scale.
+Accounts, subscriptions, tickets and the train/test split grow with the scale (1x is the size of the competition data);
+zipcodes and concerts are lookup tables and keep their size. Value distributions roughly follow the competition data.
+
+Usage:
+    python -m benchmarks.synthetic --output-path /tmp/synthetic --scale 10
+    python main.py --root-path /tmp/synthetic
+"""
+import argparse
+import functools
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import sys
+sys.path.append(".")
+from datasets import RAW_TABLES
+
+SCALES = (1, 10, 100)
+# rows at scale 1, as in the competition data
+BASE_SIZES = {"accounts": 19833, "subscriptions": 28627, "tickets": 2808, "train": 6941, "test": 2975}
+N_ZIPCODES = 42522
+SUBSCRIBER_SHARE = 0.32 # share of accounts with subscriptions
+TICKET_BUYER_SHARE = 0.1 # share of accounts with tickets
+POSITIVE_RATE = 0.1 # share of training accounts with a 2014-15 subscription
+
+SEASONS = ["%d-%d" % (year, year + 1) for year in range(1993, 2014)]
+CONCERT_SEASONS = SEASONS[-4:]
+PACKAGES = {"Full": 0.73, "Quartet": 0.13, "Quartet CC": 0.05, "Trio": 0.045, "Trio B": 0.015, "Trio A": 0.013,
+            "Quartet B": 0.006, "Quartet A": 0.005, "CYO": 0.003, "Full upgrade": 0.003}
+SUBSCRIPTION_LOCATIONS = {"San Francisco": 0.233, "Berkeley Sunday": 0.211, "Berkeley Saturday": 0.198, "Peninsula": 0.192,
+                          "Contra Costa": 0.106, "Santa Rosa": 0.039, "Orange County": 0.02, "Los Angeles": 0.001}
+CONCERT_LOCATIONS = {"San Francisco": 0.34, "Berkeley Saturday": 0.28, "Berkeley Sunday": 0.21, "Peninsula": 0.14,
+                     "Family concert": 0.02, "Contra Costa": 0.01}
+SECTIONS = {"Orchestra": 0.55, "Balcony Front": 0.11, "Premium Orchestra": 0.1, "Balcony": 0.08, "Dress Circle": 0.05,
+            "Balcony Rear": 0.04, "Orchestra Front": 0.027, "Box": 0.018, "Orchestra Rear": 0.007, "Santa Rosa": 0.004,
+            "Gallery": 0.002, "Boxes House Right": 0.0006, "Boxes House Left": 0.0004}
+TICKET_PRICE_LEVELS = {"4": 0.4, "3": 0.22, "2": 0.19, "1": 0.17, "0": 0.013, "Adult": 0.003, "Youth": 0.003, "4.0": 0.001}
+MARKETING_SOURCES = ["Philharmonia website", "Other", "Postcard or brochure", "Word of mouth", "KDFC Radio", "Web search"]
+FIRST_NAMES = ["Nicholas", "Anna", "Robert", "Maria", "Julian", "Steven", "Dominique", "Thomas", "Elizabeth", "Andreas",
+               "Christopher", "Rachel", "Jonathan", "Susan", "Richard", "Monica", "Lars", "Catherine", "David", "Hanna"]
+LAST_NAMES = ["McGegan", "Levin", "Keohane", "Wachner", "Isserlis", "Labelle", "Cooley", "Blumberg", "Scholl", "Mortensen",
+              "Ainslie", "Burton", "Podger", "Huggett", "Bezuidenhout", "Kirkby", "Manze", "Egarr", "Lamott", "Hill"]
+INSTRUMENTS = ["conductor", "violin", "soprano", "fortepiano", "harpsichord", "violoncello", "tenor", "oboe"]
+# cities the subscription locations are mapped to, so that they get coordinates
+LOCATION_CITY_NAMES = ["SAN FRANCISCO", "BERKELEY", "ORANGE", "SANTA ROSA", "LOS ANGELES", "PALO ALTO", "WALNUT CREEK"]
+
+
+def choice(rng, values, n, missing_rate=0.0):
+    """
+    Draw n values from a list, or from a dict of values and weights, with a share of missing values.
+    """
+    if isinstance(values, dict):
+        weights = np.array(list(values.values()), dtype=np.float64)
+        drawn = rng.choice(np.array(list(values), dtype=object), n, p=weights / weights.sum())
+    else:
+        drawn = rng.choice(np.array(values, dtype=object), n)
+    if missing_rate:
+        drawn[rng.random(n) < missing_rate] = np.nan
+    return drawn
+
+
+def make_ids(prefix, n):
+    """
+    Distinct account ids of the same shape as the competition ones.
+    """
+    return (prefix + pd.Series(np.arange(n)).astype(str).str.zfill(12)).to_numpy(dtype=object)
+
+
+def make_lineup(rng):
+    """
+    Line-up of a concert in the format of the "who" column: a conductor and soloists, one per line.
+    """
+    names = ["%s %s" % (rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)) for _ in range(rng.integers(2, 5))]
+    return "\r".join("%s, %s" % (name, "conductor" if i == 0 else rng.choice(INSTRUMENTS[1:])) for i, name in enumerate(names))
+
+
+def make_zipcodes(rng, n_zipcodes=N_ZIPCODES):
+    """
+    Zipcode lookup table of zipcodes.csv.
+    """
+    zipcodes = np.sort(rng.choice(np.arange(501, 99951), n_zipcodes, replace=False))
+    cities = np.array(LOCATION_CITY_NAMES + ["CITY %d" % i for i in range(n_zipcodes // 2)], dtype=object)
+    return pd.DataFrame({
+        "Zipcode": zipcodes,
+        "ZipCodeType": choice(rng, {"STANDARD": 0.7, "PO BOX": 0.25, "UNIQUE": 0.04, "MILITARY": 0.01}, n_zipcodes),
+        "City": cities[rng.integers(0, len(cities), n_zipcodes)],
+        "State": choice(rng, ["CA", "NY", "TX", "WA", "PR"], n_zipcodes),
+        "LocationType": "PRIMARY",
+        "Lat": np.where(rng.random(n_zipcodes) < 0.015, np.nan, np.round(rng.uniform(18, 65, n_zipcodes), 2)),
+        "Long": np.where(rng.random(n_zipcodes) < 0.015, np.nan, np.round(rng.uniform(-160, -65, n_zipcodes), 2)),
+        "Location": ["NA-US-%d" % zipcode for zipcode in zipcodes],
+        "Decommisioned": rng.random(n_zipcodes) < 0.02,
+        "TaxReturnsFiled": np.where(rng.random(n_zipcodes) < 0.32, np.nan, rng.integers(100, 40000, n_zipcodes)),
+        "EstimatedPopulation": np.where(rng.random(n_zipcodes) < 0.32, np.nan, rng.integers(100, 70000, n_zipcodes)),
+        "TotalWages": np.where(rng.random(n_zipcodes) < 0.32, np.nan, rng.integers(10 ** 6, 10 ** 9, n_zipcodes)),
+    })
+
+
+def make_concerts(rng):
+    """
+    Concerts of the four seasons before 2014-15 (concerts.csv) and the six concerts of 2014-15 (concerts_2014-15.csv).
+    """
+    rows = []
+    for season in CONCERT_SEASONS:
+        for concert_set in range(1, 8):
+            lineup = make_lineup(rng)
+            for location in choice(rng, CONCERT_LOCATIONS, rng.integers(2, 5), missing_rate=0.03):
+                rows.append({"season": season, "concert.name": "Concert %s %d" % (season, concert_set), "set": concert_set,
+                             "who": lineup, "what": "Program of set %d" % concert_set, "location": location})
+    concerts = pd.DataFrame(rows)
+    concerts1415 = pd.DataFrame({"season": "2014-2015", "concert.name": ["Concert 2014-2015 %d" % i for i in range(1, 7)],
+                                 "set": np.arange(1, 7), "who": [make_lineup(rng).replace("\r", ", ") for _ in range(6)],
+                                 "what": ["Program of set %d" % i for i in range(1, 7)]})
+    return concerts, concerts1415
+
+
+def make_accounts(rng, account_ids, zipcodes):
+    """
+    Accounts of account.csv, billing zip codes are mostly known zipcodes, some with a "-" suffix, foreign or missing.
+    """
+    n_accounts = len(account_ids)
+    billing_zip_code = pd.Series(zipcodes[rng.integers(0, len(zipcodes), n_accounts)]).astype(str).str.zfill(5).to_numpy(dtype=object)
+    kind = rng.random(n_accounts)
+    billing_zip_code[kind < 0.01] = billing_zip_code[kind < 0.01] + "-1234"
+    billing_zip_code[(kind >= 0.01) & (kind < 0.015)] = "T8N 3Z9"
+    billing_zip_code[kind >= 0.85] = np.nan
+    donated = rng.random(n_accounts) < 0.3
+    years = rng.integers(1980, 2014, n_accounts)
+    first_donated = np.where(donated, pd.Series(years).astype(str) + "/7/4 00:00", np.nan)
+    return pd.DataFrame({
+        "account.id": account_ids,
+        "shipping.zip.code": np.where(rng.random(n_accounts) < 0.987, np.nan, billing_zip_code),
+        "billing.zip.code": billing_zip_code,
+        "shipping.city": np.where(rng.random(n_accounts) < 0.986, np.nan, "San Francisco"),
+        "billing.city": choice(rng, ["San Francisco", "Berkeley", "Palo Alto", "Walnut Creek", "Oakland"], n_accounts, missing_rate=0.11),
+        "relationship": choice(rng, ["Board", "Staff", "Musician"], n_accounts, missing_rate=0.967),
+        "amount.donated.2013": np.where(rng.random(n_accounts) < 0.9, 0.0, np.round(rng.exponential(300, n_accounts), 0)),
+        "amount.donated.lifetime": np.where(donated, np.round(rng.exponential(2000, n_accounts), 0), 0.0),
+        "no.donations.lifetime": np.where(donated, rng.integers(1, 57, n_accounts), 0),
+        "first.donated": first_donated,
+    })
+
+
+def make_subscriptions(rng, subscriber_ids, n_subscriptions):
+    """
+    Subscriptions of subscriptions.csv, subscribers hold one to many subscriptions.
+    """
+    account_ids = subscriber_ids[np.minimum(rng.geometric(0.25, n_subscriptions) - 1 + rng.integers(0, len(subscriber_ids), n_subscriptions),
+                                            len(subscriber_ids) - 1)]
+    return pd.DataFrame({
+        "account.id": account_ids,
+        "season": choice(rng, SEASONS, n_subscriptions),
+        "package": choice(rng, PACKAGES, n_subscriptions, missing_rate=0.0002),
+        "no.seats": choice(rng, {2: 0.62, 1: 0.33, 3: 0.02, 4: 0.02, 5: 0.01}, n_subscriptions).astype(np.int64),
+        "location": choice(rng, SUBSCRIPTION_LOCATIONS, n_subscriptions, missing_rate=0.0002),
+        "section": choice(rng, SECTIONS, n_subscriptions, missing_rate=0.16),
+        "price.level": choice(rng, {2.0: 0.47, 1.0: 0.19, 3.0: 0.15, 4.0: 0.14, 0.0: 0.05}, n_subscriptions, missing_rate=0.12).astype(np.float64),
+        "subscription_tier": choice(rng, {2.0: 0.47, 1.0: 0.4, 0.5: 0.1, 4.0: 0.02, 3.0: 0.01}, n_subscriptions).astype(np.float64),
+        "multiple.subs": choice(rng, {"no": 0.997, "yes": 0.003}, n_subscriptions),
+    })
+
+
+def make_tickets(rng, buyer_ids, n_tickets):
+    """
+    Tickets of tickets_all.csv, for concerts of the four seasons before 2014-15.
+    """
+    return pd.DataFrame({
+        "account.id": buyer_ids[rng.integers(0, len(buyer_ids), n_tickets)],
+        "price.level": choice(rng, TICKET_PRICE_LEVELS, n_tickets, missing_rate=0.074),
+        "no.seats": choice(rng, {1: 0.3, 2: 0.55, 3: 0.08, 4: 0.07}, n_tickets).astype(np.int64),
+        "marketing.source": choice(rng, MARKETING_SOURCES, n_tickets, missing_rate=0.79),
+        "season": choice(rng, CONCERT_SEASONS, n_tickets),
+        "location": choice(rng, CONCERT_LOCATIONS, n_tickets, missing_rate=0.016),
+        "set": np.where(rng.random(n_tickets) < 0.008, np.nan, rng.integers(1, 9, n_tickets)).astype(np.float64),
+        "multiple.tickets": choice(rng, {"no": 0.99, "yes": 0.01}, n_tickets),
+    })
+
+
+@functools.lru_cache(maxsize=2)
+def make_synthetic_data(scale=1, seed=0):
+    """
+    Generate every raw table of the competition at a scale, see RAW_TABLES. Results are cached, treat them as read-only.
+
+    Parameters:
+        scale (int): Number of times the accounts, subscriptions, tickets and train/test accounts of the competition data.
+        seed (int): Random seed.
+
+    Returns:
+        dict: Mapping from table name to pd.DataFrame, as returned by datasets.load_data.
+    """
+    rng = np.random.default_rng(seed)
+    sizes = {name: size * scale for name, size in BASE_SIZES.items()}
+    zipcodes = make_zipcodes(rng)
+    concerts, concerts1415 = make_concerts(rng)
+
+    account_ids = make_ids("syn", sizes["accounts"])
+    shuffled = rng.permutation(account_ids)
+    subscriber_ids = shuffled[:int(len(shuffled) * SUBSCRIBER_SHARE)]
+    buyer_ids = shuffled[-int(len(shuffled) * TICKET_BUYER_SHARE):]
+    labelled = rng.permutation(account_ids)[:sizes["train"] + sizes["test"]]
+    train_ids, test_ids = labelled[:sizes["train"]], labelled[sizes["train"]:]
+    # subscribers are more likely to subscribe again
+    label = (rng.random(len(train_ids)) < np.where(np.isin(train_ids, subscriber_ids), 2.5, 0.3) * POSITIVE_RATE).astype(np.int64)
+
+    return {
+        "accounts": make_accounts(rng, account_ids, zipcodes["Zipcode"].to_numpy()),
+        "zipcodes": zipcodes,
+        "tickets": make_tickets(rng, buyer_ids, sizes["tickets"]),
+        "subscriptions": make_subscriptions(rng, subscriber_ids, sizes["subscriptions"]),
+        "concerts": concerts,
+        "concerts1415": concerts1415,
+        "train": pd.DataFrame({"account.id": train_ids, "label": label}),
+        "test": pd.DataFrame({"ID": test_ids}),
+        "submission": pd.DataFrame({"ID": test_ids, "Predicted": 0.5}),
+    }
+
+
+def write_synthetic_data(data_path, scale=1, seed=0):
+    """
+    Write the synthetic tables as the csv files of data/, so that main.py and score.py can run on them.
+    """
+    data_path = Path(data_path)
+    data_path.mkdir(parents=True, exist_ok=True)
+    for name, data in make_synthetic_data(scale, seed).items():
+        file_name, read_kwargs = RAW_TABLES[name]
+        data.to_csv(data_path / file_name, index=False, encoding=read_kwargs.get("encoding"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic competition data")
+    parser.add_argument("--output-path", type=Path, required=True, help="root path, the csv files are written to its data/ directory")
+    parser.add_argument("--scale", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    write_synthetic_data(args.output_path / "data", args.scale, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,2 +1,8 @@
 from .engineer_data import *
-from .dataset import *
\ No newline at end of file
+from .aggregation import *
+from .dataset import *
+from .stage_cache import *
+from .incremental import *
+from .encoders import *
+from .schema import *
+from .zipcode_index import *
\ No newline at end of file
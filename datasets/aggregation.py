@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+
+
+def get_group_mode(group_ids, values, n_groups):
+    """
+    Compute the most frequent value of every group without running Python code per group.
+    Values are factorized into integer codes, (group, code) pairs are sorted once and their run lengths give the counts.
+    Groups whose top count is tied are resolved with x.value_counts().index[0] itself: its tie order comes from
+    numpy's unstable sort, so delegating those few groups keeps the result identical to the per-group lambda.
+
+    Parameters:
+        group_ids (np.ndarray): Group index in [0, n_groups) of each row, negative for rows without a group.
+        values (pd.Series or np.ndarray): Values to take the mode of.
+        n_groups (int): Number of groups.
+
+    Returns:
+        np.ndarray: Most frequent value of each group, NaN for groups without any value.
+    """
+    codes, uniques = pd.factorize(values)
+    group_ids = np.asarray(group_ids, dtype=np.int64)
+
+    # drop missing values and rows without a group, as value_counts does
+    valid = (codes >= 0) & (group_ids >= 0)
+    n_codes = max(len(uniques), 1)
+    keys = group_ids[valid] * n_codes + codes[valid]
+
+    # sort (group, code) pairs, run lengths are the counts and the first index is the first occurrence
+    pair_keys, first_rows, counts = np.unique(keys, return_index=True, return_counts=True)
+    pair_groups = pair_keys // n_codes
+
+    # per group: highest count first
+    order = np.lexsort((first_rows, -counts, pair_groups))
+    is_first = np.ones(len(order), dtype=bool)
+    is_first[1:] = pair_groups[order][1:] != pair_groups[order][:-1]
+    best = order[is_first]
+
+    mode_codes = np.full(n_groups, -1, dtype=np.int64)
+    mode_codes[pair_groups[best]] = pair_keys[best] % n_codes
+    mode = pd.Index(uniques).take(mode_codes, allow_fill=True, fill_value=np.nan).values
+
+    # groups where several values share the highest count
+    group_max = np.zeros(n_groups, dtype=counts.dtype)
+    group_max[pair_groups[best]] = counts[best]
+    n_at_max = np.bincount(pair_groups[counts == group_max[pair_groups]], minlength=n_groups)
+    tied = np.flatnonzero(n_at_max > 1)
+    if len(tied):
+        tied_rows = valid & np.isin(group_ids, tied)
+        tied_values = pd.Series(np.asarray(values)[tied_rows])
+        tied_mode = tied_values.groupby(group_ids[tied_rows]).agg(lambda x: x.value_counts().index[0])
+        mode[tied_mode.index.values] = tied_mode.values
+    return mode
+
+
+def aggregate_subscription_info(subscriptions_data):
+    """
+    Get representative subscription information for each account in a single groupby pass.
+    a. Count of subscribed seasons.
+    b. Mean of no.seats, price.level and subscription_tier.
+    c. Most frequent package, section, multiple.subs, Lat and Long.
+    d. Sum of music taste.
+
+    Parameters:
+        subscriptions_data (pd.DataFrame): Cleaned subscriptions data combined with tickets data.
+
+    Returns:
+        sub_info (pd.DataFrame): Representative subscription information for each account, sorted by account.id.
+    """
+    grouped = subscriptions_data.groupby("account.id")
+    sub_info = grouped.agg(**{
+        "season": ("season", "count"),
+        "no.seats": ("no.seats", "mean"),
+        "price.level": ("price.level", "mean"),
+        "subscription_tier": ("subscription_tier", "mean"),
+        "music_taste": ("music_taste", "sum"),
+    })
+
+    # modes share the group index of the groupby above
+    group_ids = grouped.ngroup().values
+    for column in ["package", "section", "multiple.subs", "Lat", "Long"]:
+        sub_info[column] = get_group_mode(group_ids, subscriptions_data[column], len(sub_info))
+
+    columns = ["season", "package", "no.seats", "section", "multiple.subs", "price.level", "subscription_tier", "Lat", "Long", "music_taste"]
+    return sub_info[columns].reset_index()
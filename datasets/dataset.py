@@ -1,48 +1,58 @@
 from .engineer_data import *
-from copy import deepcopy
-from sklearn.preprocessing import LabelEncoder
+from .stage_cache import run_cached_stage, write_atomic
+from .incremental import engineer_subscription_incremental, engineer_subscription_chunked
+from .zipcode_index import build_zipcode_index, get_zipcode_features
+from .encoders import fit_category_encoders, encode_categories
+from .schema import compact_dtypes, log_memory, FEATURE_SCHEMA
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.csv as csv
+import pyarrow.feather as feather
 
-def get_engineered_data(data_df, stage, subscriptions_data, zipcodes_data, accounts_data):
+
+def get_engineered_data(data_df, stage, subscriptions_data, zipcode_index, accounts_data, encoders=None):
     """
     Prepare training and testing data by incorporating subscriptions, zipcodes, and accounts information.
     Fill missing data caused by merging the above dataframes.
-    Encode categorical features into digits.
+    Encode categorical features into digits, with categories fitted once on training data.
 
     Parameters:
         data_df (pd.DataFrame): Original data.
         stage (str): Indicates whether the function is preparing training or testing data.
         subscriptions_data (pd.DataFrame): DataFrame containing music taste information.
-        zipcodes_data (pd.DataFrame): DataFrame containing zipcode information.
+        zipcode_index (dict): Zipcode information indexed by zipcode, see build_zipcode_index.
         accounts_data (pd.DataFrame): DataFrame containing accounts information.
+        encoders (dict, optional): Categories of the object columns fitted on training data, see fit_category_encoders.
+            Columns missing from it are fitted on this data and added to it, so passing the same dict
+            to the training and testing calls encodes both with the training categories.
 
     Returns:
         X (pd.DataFrame): Features dataframe.
         y (pd.Series): Target variable.
     """
     
-    df = deepcopy(data_df)
-    
-    # change column name to facilitate merging process
-    if stage == "test":
-        df.rename(columns = {"ID":"account.id"}, inplace = True)
+    # change column name to facilitate merging process, the merges below never modify data_df
+    df = data_df.rename(columns = {"ID":"account.id"}) if stage == "test" else data_df
 
     # incorporate accounts information
     df = pd.merge(df, accounts_data, how = "left", on= "account.id")
     
-    # incorporate zipcode information
-    # convert billingzipcode column to float column
-    df["billing.zip.code"] = df["billing.zip.code"].apply(lambda x: 0 if type(x) == str else x)
-    df = pd.merge( df, 
-                    zipcodes_data[["Zipcode", "City", "Lat", "Long", "Decommisioned", "TaxReturnsFiled", "EstimatedPopulation", "TotalWages"]], 
-                    how = "left", left_on = "billing.zip.code", right_on = "Zipcode"
-                    )
+    # incorporate zipcode information, gathered from the zipcode index by billing zip code
+    df = pd.concat([df, get_zipcode_features(zipcode_index, df["billing.zip.code"])], axis = 1)
     # incorporate music taste information
     df = pd.merge(df, subscriptions_data, how = "left", on = "account.id")
 
 
 
     # drop and rename duplicate columns
-    drop_columns = ['billing.zip.code', "billing.city", "Zipcode", "City"]
+    drop_columns = ['billing.zip.code', "billing.city"]
     df.drop(columns = drop_columns, inplace = True)
     df.rename(columns = {
                         "Lat_x": "Lat_account", "Long_x": "Long_account",
@@ -50,7 +60,10 @@ def get_engineered_data(data_df, stage, subscriptions_data, zipcodes_data, accou
                         }, inplace = True)
 
 
-    # fill missing data
+    # fill missing data, category columns need the fill value among their categories
+    for column in df.columns[df.dtypes == "category"]:
+        if "None" not in df[column].cat.categories:
+            df[column] = df[column].cat.add_categories("None")
     df["amount.donated.2013"].fillna(0, inplace = True)
     df["amount.donated.lifetime"].fillna(0, inplace = True)
     df["no.donations.lifetime"].fillna(0, inplace = True)
@@ -74,20 +87,15 @@ def get_engineered_data(data_df, stage, subscriptions_data, zipcodes_data, accou
     df["music_taste"].fillna(0, inplace = True)
 
     
-    # find object type columns
+    # find object and category type columns
     category_columns = []
     for column in df.columns[1:]:
-        if df[column].dtype == "object":
+        if df[column].dtype == "object" or isinstance(df[column].dtype, pd.CategoricalDtype):
             category_columns.append(column)
 
-    # create individusal label encoder for each column
-    label_encoders = [LabelEncoder() for i in range(len(category_columns))]
-    le_dict = dict(zip(category_columns, label_encoders))
-    
-    # encode category columns
-    for column in category_columns:
-        le_dict[column].fit(df[column])
-        df[column] = le_dict[column].transform(df[column])
+    # fit categories of new columns, then encode category columns with a lookup
+    encoders = fit_category_encoders(df, category_columns, encoders)
+    df = encode_categories(df, {column: encoders[column] for column in category_columns})
     
     # return final data 
     if stage == "test":
@@ -98,4 +106,284 @@ def get_engineered_data(data_df, stage, subscriptions_data, zipcodes_data, accou
         X = df.iloc[:, 2:]
         y = df.iloc[:, 1]
 
-    return X, y
+    return compact_dtypes(X, FEATURE_SCHEMA), y
+
+
+# raw tables used by the pipeline: table name -> (csv file, pd.read_csv keyword arguments)
+# string and float columns of the tables that can be streamed are declared, so that every chunk parses like the whole file
+# only the columns the pipeline uses are parsed, in file order, e.g. shipping.zip.code, relationship and marketing.source are skipped
+# keyword arguments are saved to the cache manifest, they must stay json serializable (lists, not tuples)
+RAW_TABLES = {
+    "accounts": ("account.csv", {"encoding": "ISO-8859-1", "usecols": ["account.id", "billing.zip.code", "billing.city", "amount.donated.2013",
+                                                                       "amount.donated.lifetime", "no.donations.lifetime", "first.donated"]}),
+    "zipcodes": ("zipcodes.csv", {"usecols": ["Zipcode", "City", "Lat", "Long", "Decommisioned", "TaxReturnsFiled", "EstimatedPopulation", "TotalWages"]}),
+    "tickets": ("tickets_all.csv", {"usecols": ["account.id", "price.level", "no.seats", "season", "location", "set", "multiple.tickets"],
+                                    "dtype": {"account.id": "str", "price.level": "str", "season": "str",
+                                              "location": "str", "set": "float64", "multiple.tickets": "str"}}),
+    "subscriptions": ("subscriptions.csv", {"dtype": {"account.id": "str", "season": "str", "package": "str", "location": "str", "section": "str",
+                                                      "price.level": "float64", "subscription_tier": "float64", "multiple.subs": "str"}}),
+    "concerts": ("concerts.csv", {"usecols": ["season", "set", "who", "location"]}),
+    "concerts1415": ("concerts_2014-15.csv", {"usecols": ["season", "who"]}),
+    "train": ("train.csv", {}),
+    "test": ("test.csv", {}),
+    "submission": ("sample_submission.csv", {}),
+}
+# tables engineer_subscription_chunked can read in chunks instead of whole
+STREAMED_TABLES = ["subscriptions", "tickets"]
+# tables loaded at a time, parsing runs in arrow threads and feather reads are memory maps, both release the GIL
+MAX_LOAD_JOBS = 4
+# missing values of the default parser of pd.read_csv, given to the arrow parser so that both parse the same table
+NA_VALUES = ["", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN", "<NA>",
+             "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null"]
+# pd.read_csv keyword arguments the arrow parser supports, tables read with others are parsed by pd.read_csv
+ARROW_READ_KWARGS = {"usecols", "dtype", "encoding"}
+
+
+def parse_csv(csv_file, **read_kwargs):
+    """
+    Parse a csv file with the multithreaded arrow csv reader, into the same table as pd.read_csv.
+    Missing values are detected by arrow, also in columns declared as strings.
+
+    Parameters:
+        csv_file (pathlib.Path): Path of the raw csv file.
+        **read_kwargs: Keyword arguments of pd.read_csv, see ARROW_READ_KWARGS.
+
+    Returns:
+        pd.DataFrame: Parsed table.
+    """
+    if not set(read_kwargs) <= ARROW_READ_KWARGS:
+        return pd.read_csv(csv_file, **read_kwargs)
+    column_types = {column: pa.string() if dtype == "str" else pa.from_numpy_dtype(np.dtype(dtype))
+                    for column, dtype in read_kwargs.get("dtype", {}).items()}
+    table = csv.read_csv(csv_file, read_options = csv.ReadOptions(encoding = read_kwargs.get("encoding", "utf8")),
+                         # line-ups of the concerts span several lines within quotes
+                         parse_options = csv.ParseOptions(newlines_in_values = True),
+                         convert_options = csv.ConvertOptions(include_columns = read_kwargs.get("usecols"), column_types = column_types,
+                                                              null_values = NA_VALUES, strings_can_be_null = True))
+    return fill_missing_strings(table.to_pandas())
+
+
+def fill_missing_strings(df):
+    """
+    Replace the None of missing strings restored by arrow by NaN, like pd.read_csv.
+    """
+    for column in df.columns[df.dtypes == "object"]:
+        values = df[column].to_numpy(copy = True)
+        values[pd.isna(values)] = np.nan
+        df[column] = values
+    return df
+
+
+def get_file_hash(file_path, chunk_size=1 << 20):
+    """
+    Compute the sha256 digest of a file's content.
+
+    Parameters:
+        file_path (pathlib.Path): Path of the file to hash.
+        chunk_size (int): Number of bytes read at a time.
+
+    Returns:
+        str: Hex digest of the file content.
+    """
+    sha = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def is_cache_valid(csv_file, manifest, read_kwargs):
+    """
+    Check whether a cached table is still in sync with its csv file.
+    The cheap size/mtime check is tried first, the content hash is only computed when the file was touched.
+
+    Parameters:
+        csv_file (pathlib.Path): Path of the raw csv file.
+        manifest (dict): Manifest saved next to the cached table.
+        read_kwargs (dict): Keyword arguments used to parse the csv file.
+
+    Returns:
+        bool: Whether the cached table can be used.
+    """
+    if manifest.get("read_kwargs") != read_kwargs or manifest.get("pandas") != pd.__version__:
+        return False
+
+    stat = os.stat(csv_file)
+    if stat.st_size != manifest.get("size"):
+        return False
+    if stat.st_mtime_ns == manifest.get("mtime_ns"):
+        return True
+
+    # file was touched, fall back to the content hash
+    return get_file_hash(csv_file) == manifest.get("sha256")
+
+
+def load_table(csv_file, cache_path=None, **read_kwargs):
+    """
+    Load a csv file through a columnar Feather cache.
+    The csv file is parsed once and saved uncompressed, later calls memory-map the cached table.
+
+    Parameters:
+        csv_file (pathlib.Path): Path of the raw csv file.
+        cache_path (pathlib.Path, optional): Directory of the cached tables. If not provided, the csv file is parsed directly.
+        **read_kwargs: Keyword arguments passed to pd.read_csv.
+
+    Returns:
+        pd.DataFrame: Loaded table.
+    """
+    csv_file = Path(csv_file)
+    if cache_path is None:
+        return parse_csv(csv_file, **read_kwargs)
+
+    cache_path = Path(cache_path)
+    table_file = cache_path / (csv_file.stem + ".feather")
+    manifest_file = cache_path / (csv_file.stem + ".json")
+
+    if table_file.exists() and manifest_file.exists():
+        with open(manifest_file) as f:
+            manifest = json.load(f)
+        if is_cache_valid(csv_file, manifest, read_kwargs):
+            # refresh mtime so that the next run takes the cheap path again
+            stat = os.stat(csv_file)
+            if stat.st_mtime_ns != manifest["mtime_ns"]:
+                manifest["mtime_ns"] = stat.st_mtime_ns
+                write_atomic(manifest_file, lambda path: path.write_text(json.dumps(manifest)))
+            # split_blocks keeps numeric columns zero-copy on top of the memory map
+            return fill_missing_strings(feather.read_table(table_file, memory_map=True).to_pandas(split_blocks=True))
+
+    df = parse_csv(csv_file, **read_kwargs)
+
+    # cache the parsed table, tables arrow cannot represent (e.g. mixed object columns) are simply not cached
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return df
+
+    cache_path.mkdir(parents=True, exist_ok=True)
+    stat = os.stat(csv_file)
+    manifest = {
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha256": get_file_hash(csv_file),
+        "read_kwargs": read_kwargs,
+        "pandas": pd.__version__,
+    }
+    # write through temporary files so that an interrupted run, or another run sharing the cache, never leaves a broken cache
+    write_atomic(table_file, lambda path: feather.write_feather(table, str(path), compression="uncompressed"))
+    write_atomic(manifest_file, lambda path: path.write_text(json.dumps(manifest)))
+
+    return df
+
+
+def load_table_chunks(csv_file, chunk_size, **read_kwargs):
+    """
+    Read a csv file in chunks, only one chunk is in memory at a time.
+
+    Parameters:
+        csv_file (pathlib.Path): Path of the raw csv file.
+        chunk_size (int): Number of rows per chunk.
+        **read_kwargs: Keyword arguments passed to pd.read_csv.
+
+    Yields:
+        pd.DataFrame: Chunk of the table.
+    """
+    with pd.read_csv(csv_file, chunksize = chunk_size, **read_kwargs) as reader:
+        yield from reader
+
+
+def load_data(data_path, cache_path=None, tables=None, n_jobs=None, logger=None):
+    """
+    Load the raw tables of the competition concurrently, at most n_jobs tables at a time.
+    The largest files are started first, so that the small tables load while they are parsed.
+
+    Parameters:
+        data_path (pathlib.Path): Directory containing the raw csv files.
+        cache_path (pathlib.Path, optional): Directory of the columnar cache. If not provided, csv files are parsed directly.
+        tables (list, optional): Names of the tables to load, all tables of RAW_TABLES if not provided.
+        n_jobs (int, optional): Number of tables loaded at a time, MAX_LOAD_JOBS if not provided.
+        logger (logging.Logger, optional): Logger reporting the load time of every table.
+
+    Returns:
+        dict: Mapping from table name (see RAW_TABLES) to the loaded pd.DataFrame.
+    """
+    data_path = Path(data_path)
+    names = [name for name in RAW_TABLES if tables is None or name in tables]
+
+    def load(name):
+        file_name, read_kwargs = RAW_TABLES[name]
+        start = time.perf_counter()
+        df = load_table(data_path / file_name, cache_path, **read_kwargs)
+        if logger is not None:
+            logger.info(f'Loaded {name} ({file_name}): {df.shape[0]} x {df.shape[1]} in {time.perf_counter() - start:.3f}s')
+        return df
+
+    by_size = sorted(names, key = lambda name: os.path.getsize(data_path / RAW_TABLES[name][0]), reverse = True)
+    with ThreadPoolExecutor(max_workers = max(1, min(len(names), n_jobs or MAX_LOAD_JOBS))) as executor:
+        futures = {name: executor.submit(load, name) for name in by_size}
+        return {name: futures[name].result() for name in names}
+
+
+def get_accounts_data(raw_data, cache_path=None, logger=None):
+    """
+    Engineer the accounts table, see get_feature_tables.
+    """
+    stage_cache_path = None if cache_path is None else Path(cache_path) / "stages"
+    accounts_data = run_cached_stage(engineer_account, raw_data["accounts"], cache_path = stage_cache_path, logger = logger)
+    log_memory(logger, "engineer_account", accounts_data)
+    return accounts_data
+
+
+def get_zipcode_index(raw_data, cache_path=None, logger=None):
+    """
+    Build the zipcode index, see get_feature_tables.
+    """
+    stage_cache_path = None if cache_path is None else Path(cache_path) / "stages"
+    # the zipcode index is built once and kept in the stage cache
+    zipcode_index = run_cached_stage(build_zipcode_index, raw_data["zipcodes"], cache_path = stage_cache_path, logger = logger)
+    log_memory(logger, "build_zipcode_index", zipcode_index["features"])
+    return zipcode_index
+
+
+def get_subscriptions_data(raw_data, zipcode_index, cache_path=None, incremental=False, logger=None, data_path=None, chunk_size=None):
+    """
+    Engineer the subscription table, see get_feature_tables. Subscribed locations take the city centroids of the zipcode index.
+    """
+    stage_cache_path = None if cache_path is None else Path(cache_path) / "stages"
+    subscription_lookups = [zipcode_index["city_centroids"], raw_data["concerts"], raw_data["concerts1415"]]
+    if chunk_size is not None:
+        # streamed tables are not hashed for the stage cache, that would read them once more
+        subscription_chunks, ticket_chunks = [load_table_chunks(Path(data_path) / RAW_TABLES[name][0], chunk_size, **RAW_TABLES[name][1])
+                                              for name in STREAMED_TABLES]
+        subscriptions_data = engineer_subscription_chunked(subscription_chunks, ticket_chunks, *subscription_lookups, logger = logger)
+    elif incremental and cache_path is not None:
+        # only accounts of new subscription and ticket rows are recomputed
+        subscriptions_data = engineer_subscription_incremental(Path(cache_path) / "subscription_state.pkl",
+                                                               raw_data["subscriptions"], raw_data["tickets"], *subscription_lookups, logger = logger)
+    else:
+        subscriptions_data = run_cached_stage(engineer_subscription, raw_data["subscriptions"], raw_data["tickets"], *subscription_lookups,
+                                              cache_path = stage_cache_path, logger = logger)
+    log_memory(logger, "engineer_subscription", subscriptions_data)
+    return subscriptions_data
+
+
+def get_feature_tables(raw_data, cache_path=None, incremental=False, logger=None, data_path=None, chunk_size=None):
+    """
+    Engineer the account, zipcode and subscription tables that get_engineered_data joins to account ids.
+    The account table and the zipcode index are independent, main.py engineers them concurrently with get_accounts_data
+    and get_zipcode_index, then the subscription table with get_subscriptions_data, which takes the city centroids of the index.
+
+    Parameters:
+        raw_data (dict): Raw tables returned by load_data, without the STREAMED_TABLES if chunk_size is given.
+        cache_path (pathlib.Path, optional): Cache directory, stages are cached in its "stages" subdirectory.
+        incremental (bool): Whether to update the persisted subscription state with new rows instead of rebuilding it.
+        logger (logging.Logger, optional): Logger reporting cache hits and state updates.
+        data_path (pathlib.Path, optional): Directory containing the raw csv files, required with chunk_size.
+        chunk_size (int, optional): Stream the subscriptions and tickets csv files from data_path in chunks of this
+            many rows instead of taking them from raw_data, for histories that do not fit in memory.
+
+    Returns:
+        tuple: (accounts_data, zipcode_index, subscriptions_data).
+    """
+    zipcode_index = get_zipcode_index(raw_data, cache_path, logger)
+    return (get_accounts_data(raw_data, cache_path, logger), zipcode_index,
+            get_subscriptions_data(raw_data, zipcode_index, cache_path, incremental, logger, data_path, chunk_size))
@@ -0,0 +1,65 @@
+import json
+from pathlib import Path
+import pandas as pd
+import numpy as np
+
+
+# code of values not seen when the encoders were fitted
+UNSEEN_CODE = -1
+
+
+def fit_category_encoders(df, columns, encoders=None):
+    """
+    Fit the categories of object columns, sorted like the classes of a LabelEncoder so that codes match it.
+
+    Parameters:
+        df (pd.DataFrame): Training data.
+        columns (list): Object columns to encode.
+        encoders (dict, optional): Registry the categories are added to, columns already in it are not refitted.
+
+    Returns:
+        dict: Mapping from column to its list of categories.
+    """
+    encoders = {} if encoders is None else encoders
+    for column in columns:
+        if column not in encoders:
+            encoders[column] = sorted(set(df[column].tolist()))
+    return encoders
+
+
+def encode_categories(df, encoders):
+    """
+    Encode object columns with fitted categories, as a hash lookup instead of a sort of every column.
+    Values outside the fitted categories get UNSEEN_CODE.
+
+    Parameters:
+        df (pd.DataFrame): Data to encode, modified in place.
+        encoders (dict): Mapping from column to its list of categories, see fit_category_encoders.
+
+    Returns:
+        pd.DataFrame: Encoded data.
+    """
+    for column, categories in encoders.items():
+        # pd.Categorical marks values outside its categories with -1
+        codes = pd.Categorical(df[column], categories = categories).codes.astype(np.int64)
+        df[column] = np.where(codes < 0, UNSEEN_CODE, codes)
+    return df
+
+
+def save_category_encoders(encoders, encoders_file):
+    """
+    Save fitted categories as json, next to the model they were fitted with.
+    """
+    with open(encoders_file, "w") as f:
+        # object columns may hold numpy scalars
+        json.dump(encoders, f, default = lambda value: value.item())
+
+
+def load_category_encoders(encoders_file):
+    """
+    Load categories saved by save_category_encoders, None if the file does not exist.
+    """
+    if not Path(encoders_file).exists():
+        return None
+    with open(encoders_file) as f:
+        return json.load(f)
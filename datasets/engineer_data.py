@@ -1,47 +1,73 @@
 from copy import copy
+import re
 import pandas as pd
 import numpy as np
-from copy import deepcopy
+import pyarrow as pa
+import pyarrow.compute as pc
+from .aggregation import aggregate_subscription_info
+from .schema import compact_dtypes, ACCOUNT_SCHEMA, ZIPCODE_SCHEMA, SUBSCRIPTION_SCHEMA
 
 
-def get_name(string):
-    """
-    Extract names from a string.
+# regex matching musician names such as "Nicholas McGegan" or "Dr. Anna S. Smith"
+TITLE = r"(?:[A-Z][a-z]*\.\s*)?"
+NAME1 = r"[A-Z][a-z]+,?\s+"
+MIDDLE_I = r"(?:[A-Z][a-z]*\.?\s*)?"
+NAME2 = r"[A-Z][a-z]+"
+NAME_PATTERN = re.compile(TITLE + NAME1 + MIDDLE_I + NAME2)
 
-    Parameters:
-        string (str): Input string containing names.
+# concert locations named after the city they are held in
+LOCATION_CITIES = {
+    "Berkeley Saturday":"Berkeley", 
+    "Berkeley Sunday":"Berkeley", 
+    'Orange County': "Orange",
+    'Contra Costa':'Costa'
+}
 
-    Returns:
-        list: List of extracted names.
-    """  
-    
-    import re
-    TITLE = r"(?:[A-Z][a-z]*\.\s*)?"
-    NAME1 = r"[A-Z][a-z]+,?\s+"
-    MIDDLE_I = r"(?:[A-Z][a-z]*\.?\s*)?"
-    NAME2 = r"[A-Z][a-z]+"
-    return re.findall(TITLE + NAME1 + MIDDLE_I + NAME2, string)
-
-def get_musical_taste(musician):
+
+def get_concert_music_taste(concerts_data, concerts1415_data):
     """
-    Calculate musical taste of a person based on the number of musicians they like from 2014-2015 concerts.
+    Compute the music taste carried by every concert, i.e. how many distinct musicians of its line-up perform in 2014-2015.
+    a. Extract musician names once per distinct line-up ("who") instead of once per ticket or subscription row.
+    b. Intern names as integer ids and keep the 2014-2015 roster as a boolean bitmap over the ids.
+    c. Count the distinct roster musicians of every line-up with a bincount.
 
     Parameters:
-        musician (list): List of musicians liked by the person.
+        concerts_data (pd.DataFrame): Concerts data.
+        concerts1415_data (pd.DataFrame): Concerts 2014-2015 data.
 
     Returns:
-        int: Number of musicians liked by the person from 2014-2015 concerts.
+        concert_music_taste (pd.DataFrame): season, location, set and music_taste for every row of concerts_data.
     """
+    
+    # line-ups may span several lines
+    who = concerts_data["who"].fillna("").str.replace("\r", ", ", regex = False)
+    who_codes, distinct_who = pd.factorize(who)
+    
+    # extract names once per distinct line-up
+    lineup_names = pd.Series(distinct_who).str.findall(NAME_PATTERN).explode().dropna()
+    roster_names = concerts1415_data["who"].str.findall(NAME_PATTERN).explode().dropna()
+    
+    # intern names as integer ids
+    name_ids, names = pd.factorize(pd.concat([roster_names, lineup_names], ignore_index = True))
+    roster = np.zeros(len(names), dtype = bool)
+    roster[name_ids[:len(roster_names)]] = True
+    
+    # count distinct roster musicians for each line-up
+    lineup_pairs = pd.DataFrame({"lineup": lineup_names.index.values, "name": name_ids[len(roster_names):]}).drop_duplicates()
+    lineup_pairs = lineup_pairs[roster[lineup_pairs["name"].values]]
+    lineup_taste = np.bincount(lineup_pairs["lineup"].values, minlength = len(distinct_who))
 
-    return len( list(set(musician) & set(concert_201415_musical_name)) )
+    concert_music_taste = concerts_data[["season", "location", "set"]].copy()
+    concert_music_taste["music_taste"] = lineup_taste[who_codes].astype(np.int64)
+    return concert_music_taste
 
 def get_music_taste_from_tickets_subs(subscriptions_data, tickets_data, concerts_data, concerts1415_data):
     """
     Music taste is engineered by calculating how many musicians in concert 2014-2015 
     are supported by accounts in the form of buying tickets or subscriptions in the previous concerts.
-    a. Extract musician names with concerts_data and concerts1415_data.
-    b. Compute music taste for tickets_data.
-    c. Compute music taste for subscriptions_data.
+    a. Compute music taste for every concert with concerts_data and concerts1415_data.
+    b. Join music taste to tickets_data.
+    c. Join music taste to subscriptions_data.
     d. Combine music taste information by concatenating subscriptions_data and tickets_data.
 
     Parameters:
@@ -54,18 +80,16 @@ def get_music_taste_from_tickets_subs(subscriptions_data, tickets_data, concerts
         combined_music_taste (pd.DataFrame): Combined music taste information from subscriptions and tickets data.
     """
 
-    # get musician names in concerts 201415
-    global concert_201415_musical_name 
-    concert_201415_musical_name  = np.unique(concerts1415_data["who"].apply(get_name).sum())
+    # get music taste of every concert
+    concert_music_taste = get_concert_music_taste(concerts_data, concerts1415_data)
 
     # extract music taste from tickets information
-    tickets = pd.merge(tickets_data, concerts_data[["season", "location", "who", "set"]], how = "inner", on = ["season", "set", "location"])
-    tickets["music_taste"] = tickets["who"].str.split("\r").apply(lambda x: ", ".join(x)).apply(get_name)
-    tickets["music_taste"] = tickets["music_taste"].apply(get_musical_taste)
+    tickets = pd.merge(tickets_data, concert_music_taste, how = "inner", on = ["season", "set", "location"])
 
     # prepare tickets_data to be combined with subsriptions_df
-    drop_columns = ["marketing.source", "set", "who"]
-    tickets.drop(columns = drop_columns, inplace = True)
+    # marketing.source is not loaded from the csv file, tables built otherwise may still have it
+    drop_columns = ["marketing.source", "set"]
+    tickets.drop(columns = drop_columns, inplace = True, errors = "ignore")
     tickets["package"] = "None"
     tickets["section"] = "None"
     tickets["subscription_tier"] = 0
@@ -73,10 +97,8 @@ def get_music_taste_from_tickets_subs(subscriptions_data, tickets_data, concerts
   
     # extract music taste from subsciptions information
     # one season and one location may include multiple set of concerts
-    subscriptions = pd.merge(subscriptions_data, concerts_data[["season", "location", "who"]], how = "left", on = ["season", "location"])
-    subscriptions["who"].fillna("None", inplace = True)
-    subscriptions["music_taste"] = subscriptions["who"].str.split("\r").apply(lambda x: ", ".join(x)).apply(get_name)
-    subscriptions["music_taste"] = subscriptions["music_taste"].apply(get_musical_taste)
+    subscriptions = pd.merge(subscriptions_data, concert_music_taste[["season", "location", "music_taste"]], how = "left", on = ["season", "location"])
+    subscriptions["music_taste"] = subscriptions["music_taste"].fillna(0).astype(np.int64)
     
     # add up music taste for one season and one location subscription
     sub_music_taste = subscriptions.groupby(["account.id", "season", "location"])["music_taste"].sum().reset_index()
@@ -85,6 +107,55 @@ def get_music_taste_from_tickets_subs(subscriptions_data, tickets_data, concerts
     # combine music taste information from both subscription and tickets df
     return pd.concat([subscriptions, tickets], axis = 0)
 
+def parse_zipcodes(zip_codes):
+    """
+    Parse raw zip codes into integers with arrow string kernels instead of per-row python string methods.
+    The part before the first "-" is kept if it is only digits, other and missing zip codes become 0.
+
+    Parameters:
+        zip_codes (pd.Series): Raw zip code strings, e.g. the billing.zip.code column of the accounts dataframe.
+
+    Returns:
+        np.ndarray: int64 zip codes.
+    """
+    zip_codes = pa.array(zip_codes, type = pa.string(), from_pandas = True)
+    first_part = pc.list_element(pc.split_pattern(zip_codes, "-", max_splits = 1), 0)
+    is_digit = pc.fill_null(pc.utf8_is_digit(first_part), False)
+    return pc.cast(pc.if_else(is_digit, first_part, "0"), pa.int64()).to_numpy()
+
+
+def get_city_centroids(zipcodes_df):
+    """
+    Mean latitude and longitude of the zipcodes of every city, cities are title-cased like in engineer_zipcode.
+
+    Parameters:
+        zipcodes_df (pd.DataFrame): Zipcodes dataframe.
+
+    Returns:
+        pd.DataFrame: Lat and Long of every city, indexed by City.
+    """
+    return zipcodes_df.groupby(zipcodes_df["City"].str.title())[["Lat", "Long"]].mean()
+
+
+def get_city_coordinates(city_centroids, locations):
+    """
+    Gather the Lat and Long of the city of every location, NaN for unknown cities and missing locations.
+    Locations are factorized so that every distinct location is looked up once, then the coordinates are taken by position.
+
+    Parameters:
+        city_centroids (pd.DataFrame): Lat and Long of every city, see get_city_centroids.
+        locations (pd.Series): Location of every row.
+
+    Returns:
+        dict: Lat and Long arrays, in the order of locations.
+    """
+    codes, cities = pd.factorize(locations)
+    # unknown cities and missing locations (code -1) take the trailing row of NaN
+    positions = np.append(city_centroids.index.get_indexer(cities), -1)[codes]
+    positions[positions < 0] = len(city_centroids)
+    return {column: np.append(city_centroids[column].to_numpy(dtype = np.float64), np.nan)[positions] for column in ["Lat", "Long"]}
+
+
 def engineer_account(accounts_df):
     
     """
@@ -99,26 +170,18 @@ def engineer_account(accounts_df):
     Returns:
         accounts_data (pd.DataFrame): Cleaned accounts dataframe.
     """
-    #load data
-    accounts_data = deepcopy(accounts_df)
-    
-    # drop columns without sufficient information
+    # drop columns without sufficient information, columns are then replaced instead of modified in place
+    # these columns are not loaded from the csv file, tables built otherwise may still have them
     drop_columns = ["shipping.zip.code", "shipping.city", "relationship"]    
-    accounts_data.drop(columns = drop_columns, inplace = True)
-    
-    # fillna for billing zip code
-    accounts_data['billing.zip.code'].fillna("0", inplace = True)
+    accounts_data = accounts_df.drop(columns = drop_columns, errors = "ignore")
     
-    # split zipcode with "-"
-    accounts_data['billing.zip.code'] = accounts_data['billing.zip.code'].str.split("-").str[0]
-    
-    # turn digit zipcode to int
-    accounts_data.update(accounts_data["billing.zip.code"].loc[accounts_data["billing.zip.code"].str.isdigit()].astype(np.int64))
+    # turn zipcode to int, foreign and missing zipcodes become 0
+    accounts_data['billing.zip.code'] = parse_zipcodes(accounts_data['billing.zip.code'])
     
     # extract year for donate year
-    accounts_data.update(accounts_data["first.donated"][accounts_data["first.donated"].notnull()].str.split("/").str[0].astype(np.int64))
+    accounts_data["first.donated"] = pd.to_numeric(accounts_data["first.donated"].str.split("/").str[0])
 
-    return accounts_data
+    return compact_dtypes(accounts_data, ACCOUNT_SCHEMA)
 
 def engineer_zipcode(zipcodes_df):
     
@@ -133,17 +196,29 @@ def engineer_zipcode(zipcodes_df):
     Returns:
         zipcodes_data (pd.DataFrame): Cleaned zipcodes dataframe.
     """  
-    # load data
-    
-    zipcodes_data = deepcopy(zipcodes_df)
+    # columns are replaced, never modified in place, so a shallow copy leaves zipcodes_df untouched
+    zipcodes_data = zipcodes_df.copy(deep = False)
     # uninfy city format
-    zipcodes_data.City = zipcodes_data.City.str.title()
+    zipcodes_data["City"] = zipcodes_data.City.str.title()
     
     # turn bool column to int
-    zipcodes_data.Decommisioned.fillna(-1, inplace = True)
-    zipcodes_data.update(zipcodes_data.Decommisioned.astype(np.int64))
+    zipcodes_data["Decommisioned"] = zipcodes_data.Decommisioned.fillna(-1).astype(np.int64)
     
-    return zipcodes_data
+    return compact_dtypes(zipcodes_data, ZIPCODE_SCHEMA)
+
+def get_ticket_price_level(price_level):
+    """
+    Convert the raw tickets price.level column to float, strings not in ["0", "1", "2", "3", "4"] become NaN.
+
+    Parameters:
+        price_level (pd.Series): Raw price.level column of the tickets dataframe.
+
+    Returns:
+        pd.Series: Float price level.
+    """
+    price_level = price_level.copy()
+    price_level[~price_level.str.contains("|".join(list("01234")), na=False)] = np.nan
+    return price_level.astype(np.float64)
 
 def engineer_tickets(tickets_df):
     """
@@ -158,82 +233,49 @@ def engineer_tickets(tickets_df):
         tickets_data (pd.DataFrame): Cleaned tickets dataframe.
     """
     
-    tickets_data = deepcopy(tickets_df)
-    
-    # turn price.level not in ["0", "1", "2", "3", "4"] into Nan 
-    tickets_data["price.level"][~tickets_data["price.level"].str.contains("|".join(list("01234")), na=False)] = np.nan
+    # price.level is replaced, never modified in place, so a shallow copy leaves tickets_df untouched
+    tickets_data = tickets_df.copy(deep = False)
     
     # convert price.level into float and fill Nan with mean value
-    tickets_data["price.level"] = tickets_data["price.level"].astype(np.float64)
-    tickets_data["price.level"].fillna(tickets_data["price.level"].mean(), inplace = True)   
+    price_level = get_ticket_price_level(tickets_data["price.level"])
+    tickets_data["price.level"] = price_level.fillna(price_level.mean())
     
     return tickets_data
 
-def engineer_subscription(subscriptions_df, tickets_df, zipcodes_df, concerts_df, concerts1415_df):
+def engineer_subscription(subscriptions_df, tickets_df, city_centroids, concerts_df, concerts1415_df):
     """
     Clean subscription data 
     a. Combine music taste information from tickets
-    b. Clean location, package, section feature
-    c. Get latitude and longitude information for subscribed concerts' places from zipcodes df. 
+    b. Clean location feature
+    c. Get latitude and longitude information for subscribed concerts' places from the city centroids of the zipcode index.
     d. Fill missing data and get representative subscription information for each account.
 
     Parameters:
         subscriptions_df (pd.DataFrame): Subscriptions data.
         tickets_df (pd.DataFrame): Tickets data.
-        zipcodes_df (pd.DataFrame): Zipcodes data.
+        city_centroids (pd.DataFrame): Lat and Long of every city, built once with the zipcode index.
         concerts_df (pd.DataFrame): Concerts data.
         concerts1415_df (pd.DataFrame): Concerts 2014-2015 data.
 
     Returns:
         sub_info (pd.DataFrame): Engineered subscription data with representative information for each account.
     """
-    # deepcoy data
-    concerts_data = deepcopy(concerts_df)
-    concerts1415_data = deepcopy(concerts1415_df)
-    subscriptions_data = deepcopy(subscriptions_df)
+    # inputs are only read, every step below works on new frames
     tickets_data = engineer_tickets(tickets_df)
-    zipcodes_data = engineer_zipcode(zipcodes_df)
     
     # combine music taste information into subsrciption data
-    subscriptions_data = get_music_taste_from_tickets_subs(subscriptions_data, tickets_data, concerts_data, concerts1415_data)
+    subscriptions_data = get_music_taste_from_tickets_subs(subscriptions_df, tickets_data, concerts_df, concerts1415_df)
     
     
     # clean location information in the subscriptions_data
-    subscriptions_data.location.replace({
-                                    "Berkeley Saturday":"Berkeley", 
-                                    "Berkeley Sunday":"Berkeley", 
-                                    'Orange County': "Orange",
-                                    'Contra Costa':'Costa'
-                                    }, inplace=True)
-    
-    # clean package information in the subscriptions_data
-    subscriptions_df.package.replace({
-                                "Quartet CC": "Quartet", 
-                                "Quartet B": "Quartet", 
-                                "Quartet A": "Quartet",
-                                "Trio A": "Trio",
-                                "Trio B": "Trio",
-                                }, inplace = True)
-    
+    subscriptions_data.location.replace(LOCATION_CITIES, inplace=True)
     
-    # clean section information in the subscriptions_data
-    subscriptions_df.section.replace({
-                                "Premium Orchestra": "Orchestra", 
-                                "Orchestra Rear": "Orchestra", 
-                                "Orchestra Front": "Orchestra",
-                                "Balcony Front": "Balcony",
-                                "Balcony Rear": "Balcony",
-                                "Boxes House Right":"Box",
-                                "Boxes House left":"Box",
-                                }, inplace = True)
+    # package and section are kept as they are: the cleaning of these columns used to be applied to
+    # subscriptions_df after the music taste was combined, so it never reached the features and only modified the input
     
     # add lat and long information of the subscribed concerts'place 
-    subscriptions_data = pd.merge(
-                        subscriptions_data, 
-                        zipcodes_data.groupby("City")[["Lat", "Long"]].mean().reset_index(), 
-                        how = "left", left_on = "location", right_on="City"
-                        )
-    # print(zipcodes_df.groupby("City")[["Lat", "Long"]].mean().reset_index())
+    for column, values in get_city_coordinates(city_centroids, subscriptions_data["location"]).items():
+        subscriptions_data[column] = values
     
     # fill missing data with "None", mean value or the value with the max value counts
     subscriptions_data["season"].fillna("None", inplace = True)
@@ -253,21 +295,4 @@ def engineer_subscription(subscriptions_df, tickets_df, zipcodes_df, concerts_df
     
     
     # get representative subsription information for each account by computing mean value, max value or max value counts
-    sub_info_per_account = [
-            subscriptions_data.groupby("account.id")['season'].count().reset_index(),
-            subscriptions_data.groupby("account.id")['package'].agg(lambda x: x.value_counts().index[0]).reset_index(),
-            subscriptions_data.groupby("account.id")['no.seats'].mean().reset_index(),
-            subscriptions_data.groupby("account.id")['section'].agg(lambda x: x.value_counts().index[0]).reset_index(),
-            subscriptions_data.groupby("account.id")['multiple.subs'].agg(lambda x: x.value_counts().index[0]).reset_index(),
-            subscriptions_data.groupby("account.id")['price.level'].mean().reset_index(),
-            subscriptions_data.groupby("account.id")['subscription_tier'].mean().reset_index(),
-            subscriptions_data.groupby("account.id")['Lat'].agg(lambda x:x.value_counts().index[0]).reset_index(),
-            subscriptions_data.groupby("account.id")['Long'].agg(lambda x:x.value_counts().index[0]).reset_index(),
-            subscriptions_data.groupby("account.id")['music_taste'].sum().reset_index()
-    ]
-    for i in range(len(sub_info_per_account)):
-        if i==0:
-            sub_info = sub_info_per_account[i]
-        else:
-            sub_info = sub_info.merge(sub_info_per_account[i], how = "inner", on = "account.id")
-    return sub_info
\ No newline at end of file
+    return compact_dtypes(aggregate_subscription_info(subscriptions_data), SUBSCRIPTION_SCHEMA)
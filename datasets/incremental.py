@@ -0,0 +1,515 @@
+from .engineer_data import *
+from .stage_cache import get_data_fingerprint, write_atomic
+from .schema import compact_dtypes, SUBSCRIPTION_SCHEMA
+import pickle
+from pathlib import Path
+import pandas as pd
+import numpy as np
+
+
+STATE_VERSION = 2
+# ticket rows follow every subscription row in the combined data, whatever batch they arrived in
+TICKET_POSITION_OFFSET = 1 << 62
+TICKET_KEY_STRIDE = 1 << 32
+# pandas < 2.2 orders the rows of an inner merge by key, in order of first appearance, instead of by left row
+# the positions of ticket rows, which break ties between modes, follow the same order as in a full rebuild
+INNER_MERGE_GROUPS_KEYS = pd.merge(pd.DataFrame({"key": [0, 1, 0]}), pd.DataFrame({"key": [1, 0]}), how = "inner")["key"].tolist() == [0, 0, 1]
+# per-account sums and counts, missing values are only filled when the subscription information is computed
+ACCOUNT_STATE_COLUMNS = ["n_rows", "no.seats_sum", "no.seats_count", "price.level_sum", "price.level_count",
+                         "price.level_ticket_missing", "subscription_tier_sum", "subscription_tier_count", "music_taste"]
+MODE_COLUMNS = ["package", "section", "multiple.subs", "location"]
+SUB_INFO_COLUMNS = ["season", "package", "no.seats", "section", "multiple.subs", "price.level", "subscription_tier", "Lat", "Long", "music_taste"]
+
+
+def create_feature_state(city_centroids, concerts_df, concerts1415_df):
+    """
+    Create an empty incremental state of engineer_subscription.
+    The state keeps per-account aggregates instead of rows:
+    a. Row counts, and sums and counts of no.seats, price.level and subscription_tier for the means.
+    b. Frequency tables (count and first row) of package, section, multiple.subs and location for the modes.
+    c. Music taste sums, with the subscription count of every (account, season, location) they depend on.
+    d. Totals over all rows for the global means and modes filling missing values.
+
+    Parameters:
+        city_centroids (pd.DataFrame): Lat and Long of every city, see build_zipcode_index.
+        concerts_df (pd.DataFrame): Concerts data.
+        concerts1415_df (pd.DataFrame): Concerts 2014-2015 data.
+
+    Returns:
+        dict: Empty feature state.
+    """
+    concert_music_taste = get_concert_music_taste(concerts_df, concerts1415_df)
+    concert_music_taste["concert_key"] = concert_music_taste.groupby(["season", "set", "location"], dropna = False, sort = False).ngroup()
+    return {
+        "version": STATE_VERSION,
+        "lookups_fingerprint": get_lookups_fingerprint(city_centroids, concerts_df, concerts1415_df),
+        "concert_music_taste": concert_music_taste,
+        # rank of every concert key by first appearance in the tickets, -1 for keys without tickets yet
+        "ticket_key_ranks": np.full(concert_music_taste["concert_key"].max() + 1 if len(concert_music_taste) else 0, -1, dtype = np.int64),
+        # subscriptions get the music taste of every concert of their season and location
+        "location_music_taste": concert_music_taste.groupby(["season", "location"])["music_taste"].sum(),
+        "city_coordinates": city_centroids,
+        "n_subscriptions": 0,
+        "n_tickets": 0,
+        "subscriptions_fingerprint": None,
+        "tickets_fingerprint": None,
+        "accounts": pd.DataFrame(columns = ACCOUNT_STATE_COLUMNS, dtype = np.int64).rename_axis("account.id"),
+        "totals": pd.Series(0, index = ACCOUNT_STATE_COLUMNS + ["ticket_price_sum", "ticket_price_count"], dtype = np.float64),
+        "value_counts": {column: pd.DataFrame(columns = ["account.id", column, "count", "first"]) for column in MODE_COLUMNS},
+        "location_counts": pd.DataFrame(columns = ["location", "count", "first"]),
+        "subscription_keys": pd.Series(dtype = np.int64, index = pd.MultiIndex.from_arrays([[], [], []], names = ["account.id", "season", "location"])),
+        "music_taste_has_nan": False,
+        "sub_info": pd.DataFrame(columns = SUB_INFO_COLUMNS).rename_axis("account.id"),
+        "fill_values": None,
+        "dirty_accounts": set(),
+    }
+
+
+def get_lookups_fingerprint(city_centroids, concerts_df, concerts1415_df):
+    """
+    Fingerprint of the lookup tables a feature state was built with, the state is rebuilt when they change.
+    """
+    return "".join(get_data_fingerprint(data) for data in [city_centroids, concerts_df, concerts1415_df])
+
+
+def add_value_counts(value_counts, rows, column):
+    """
+    Merge the frequency table of a batch of rows into an existing frequency table.
+
+    Parameters:
+        value_counts (pd.DataFrame): Existing count and first row of every (account, value), or of every value.
+        rows (pd.DataFrame): Batch rows with the key columns and their position in the combined data.
+        column (str): Column the frequencies are counted for.
+
+    Returns:
+        pd.DataFrame: Updated frequency table.
+    """
+    keys = [key for key in ["account.id", column] if key in value_counts.columns]
+    batch_counts = rows.groupby(keys, dropna = False, sort = False)["position"].agg(["count", "min"]).rename(columns = {"min": "first"})
+    batch_counts = batch_counts.reset_index().astype({"count": np.int64, "first": np.int64})
+    if not len(value_counts):
+        return batch_counts
+    value_counts = pd.concat([value_counts, batch_counts], ignore_index = True)
+    return value_counts.groupby(keys, dropna = False, sort = False).agg({"count": "sum", "first": "min"}).reset_index()
+
+
+def get_modes(value_counts, column):
+    """
+    Most frequent value of every account from its frequency table.
+    Ties are broken like x.value_counts().index[0]: values in order of first appearance, sorted by count with sort_values.
+    Its tie order comes from numpy's unstable sort, so tied accounts replay that same sort on their counts.
+
+    Parameters:
+        value_counts (pd.DataFrame): Count and first row of every (account, value).
+        column (str): Column of the values.
+
+    Returns:
+        pd.Series: Mode of every account, indexed by account.id.
+    """
+    value_counts = value_counts.sort_values(["account.id", "count", "first"], ascending = [True, False, True])
+    modes = value_counts.drop_duplicates("account.id").set_index("account.id")
+    n_at_max = value_counts[value_counts["count"].values == modes["count"].reindex(value_counts["account.id"]).values].groupby("account.id").size()
+    tied = n_at_max.index[n_at_max > 1]
+    if len(tied):
+        tied_counts = value_counts[value_counts["account.id"].isin(tied)].sort_values(["account.id", "first"])
+        starts = np.flatnonzero(tied_counts["account.id"].values[1:] != tied_counts["account.id"].values[:-1]) + 1
+        tied_modes = []
+        for counts, values in zip(np.split(tied_counts["count"].values, starts), np.split(tied_counts[column].values, starts)):
+            # descending sort_values, as in pandas.core.sorting.nargsort
+            tied_modes.append(values[::-1][counts[::-1].argsort(kind = "quicksort")][-1])
+        modes.loc[tied_counts["account.id"].values[np.r_[0, starts]], column] = tied_modes
+    return modes[column]
+
+
+def get_filled_mean(value_sum, value_count, n_missing, fill_value):
+    """
+    Mean of values whose missing entries are filled with fill_value, missing entries are skipped when fill_value is NaN.
+    Works on scalars and on pd.Series of per-account sums and counts, the mean of no value is NaN.
+    """
+    if not np.isnan(fill_value):
+        value_sum, value_count = value_sum + n_missing * fill_value, value_count + n_missing
+    if np.ndim(value_count) == 0:
+        return value_sum / value_count if value_count else np.nan
+    return value_sum / value_count.where(value_count > 0)
+
+
+def get_fill_values(state):
+    """
+    Global values engineer_subscription fills missing data with, computed from the state totals.
+    a. Mean of the ticket price levels, filling the unparsable ticket prices.
+    b. Means of no.seats, price.level and subscription_tier over tickets and subscriptions.
+    c. Most frequent Lat and Long, filling the locations without coordinates.
+
+    Parameters:
+        state (dict): Feature state.
+
+    Returns:
+        dict: Fill value of every column.
+    """
+    totals = state["totals"]
+    fill_values = {"ticket_price": get_filled_mean(totals["ticket_price_sum"], totals["ticket_price_count"], 0, np.nan)}
+    for column in ["no.seats", "subscription_tier"]:
+        fill_values[column] = get_filled_mean(totals[column + "_sum"], totals[column + "_count"], 0, np.nan)
+    fill_values["price.level"] = get_filled_mean(totals["price.level_sum"], totals["price.level_count"],
+                                                 totals["price.level_ticket_missing"], fill_values["ticket_price"])
+
+    # value_counts of Lat and Long over all rows, NaN coordinates are not counted
+    coordinates = get_location_coordinates(state, state["location_counts"])
+    for column in ["Lat", "Long"]:
+        counts = coordinates.groupby(column, sort = False).agg({"count": "sum", "first": "min"})
+        counts = counts.sort_values("first")["count"].sort_values(ascending = False)
+        fill_values[column] = counts.index[0] if len(counts) else np.nan
+    return fill_values
+
+
+def get_location_coordinates(state, location_counts):
+    """
+    Join the Lat and Long of the city of every location in a frequency table, NaN for unknown cities.
+    """
+    return location_counts.assign(**get_city_coordinates(state["city_coordinates"], location_counts["location"]))
+
+
+def get_batch_rows(state, subscriptions_df, tickets_df):
+    """
+    Clean a batch of new subscription and ticket rows like engineer_subscription.
+    Unparsable ticket prices and missing numeric values are kept missing, they are filled with the global means later.
+
+    Parameters:
+        state (dict): Feature state, only read.
+        subscriptions_df (pd.DataFrame, optional): New subscription rows.
+        tickets_df (pd.DataFrame, optional): New ticket rows.
+
+    Returns:
+        tuple: (combined rows of the batch, ticket price levels of the batch before joining the concerts).
+    """
+    columns = ["account.id", "position", "ticket", "no.seats", "price.level", "subscription_tier", "package", "section", "multiple.subs", "location"]
+    batches = [pd.DataFrame(columns = columns)]
+    ticket_price_level = pd.Series(dtype = np.float64)
+
+    if subscriptions_df is not None and len(subscriptions_df):
+        subscriptions = subscriptions_df.copy()
+        subscriptions["position"] = state["n_subscriptions"] + np.arange(len(subscriptions), dtype = np.int64)
+        subscriptions["ticket"] = False
+        batches.append(subscriptions[columns])
+
+    if tickets_df is not None and len(tickets_df):
+        tickets = tickets_df.copy()
+        tickets["price.level"] = get_ticket_price_level(tickets["price.level"])
+        tickets["position"] = state["n_tickets"] + np.arange(len(tickets), dtype = np.int64)
+        ticket_price_level = tickets["price.level"]
+
+        # only tickets of known concerts are kept, like in get_music_taste_from_tickets_subs
+        tickets = pd.merge(tickets, state["concert_music_taste"], how = "inner", on = ["season", "set", "location"])
+        if INNER_MERGE_GROUPS_KEYS:
+            key_ranks = state["ticket_key_ranks"]
+            new_keys = [key for key in pd.unique(tickets["concert_key"]) if key_ranks[key] < 0]
+            key_ranks[new_keys] = key_ranks.max(initial = -1) + 1 + np.arange(len(new_keys))
+            tickets["position"] += key_ranks[tickets["concert_key"].values] * TICKET_KEY_STRIDE
+        tickets["position"] += TICKET_POSITION_OFFSET
+        tickets["package"] = "None"
+        tickets["section"] = "None"
+        tickets["subscription_tier"] = 0
+        tickets["ticket"] = True
+        tickets.rename(columns = {"multiple.tickets":"multiple.subs"}, inplace = True)
+        batches.append(tickets[columns + ["music_taste"]])
+
+    rows = pd.concat(batches, ignore_index = True).reindex(columns = columns + ["music_taste"])
+    rows["position"] = rows["position"].astype(np.int64)
+    rows["ticket"] = rows["ticket"].astype(bool)
+    rows["music_taste"] = rows["music_taste"].fillna(0).astype(np.int64)
+    rows["location"] = rows["location"].replace(LOCATION_CITIES)
+    for column in ["package", "section", "multiple.subs"]:
+        rows[column] = rows[column].fillna("None")
+    return rows, ticket_price_level
+
+
+def update_feature_state(state, subscriptions_df = None, tickets_df = None):
+    """
+    Fold new subscription and ticket rows into the feature state.
+    Only the accounts of the new rows are updated; accounts with filled missing values are also marked
+    for recomputation when the global fill values change.
+
+    Parameters:
+        state (dict): Feature state, updated in place.
+        subscriptions_df (pd.DataFrame, optional): New subscription rows, appended after the ones already in the state.
+        tickets_df (pd.DataFrame, optional): New ticket rows, appended after the ones already in the state.
+
+    Returns:
+        set: account.id of the updated accounts.
+    """
+    rows, ticket_price_level = get_batch_rows(state, subscriptions_df, tickets_df)
+
+    # sums and counts of the means, ticket prices are filled with the ticket mean before the overall mean
+    rows["n_rows"] = 1
+    for column in ["no.seats", "price.level", "subscription_tier"]:
+        rows[column] = rows[column].astype(np.float64)
+        rows[column + "_sum"] = rows[column].fillna(0)
+        rows[column + "_count"] = rows[column].notna().astype(np.int64)
+    rows["price.level_ticket_missing"] = (rows["ticket"] & rows["price.level"].isna()).astype(np.int64)
+
+    # music taste of subscriptions is the taste of their (season, location) times the number of subscriptions to it
+    if subscriptions_df is None:
+        subscriptions_df = pd.DataFrame(columns = ["account.id", "season", "location"])
+    subscriptions = subscriptions_df[["account.id", "season", "location"]]
+    subscription_keys = subscriptions.dropna().value_counts().rename("count")
+    subscription_keys = subscription_keys[subscription_keys.index.droplevel(0).isin(state["location_music_taste"].index)]
+    old_keys = state["subscription_keys"].reindex(subscription_keys.index, fill_value = 0)
+    new_keys = old_keys + subscription_keys
+    location_taste = state["location_music_taste"].reindex(subscription_keys.index.droplevel(0)).values
+    taste_change = pd.Series((new_keys.values ** 2 - old_keys.values ** 2) * location_taste, index = subscription_keys.index)
+    taste_change = taste_change.groupby(level = "account.id").sum()
+    state["subscription_keys"] = new_keys.combine_first(state["subscription_keys"]).astype(np.int64)
+    state["music_taste_has_nan"] |= bool(subscriptions.isna().any(axis = None))
+
+    # per-account aggregates
+    batch_accounts = rows.groupby("account.id")[ACCOUNT_STATE_COLUMNS].sum()
+    batch_accounts["music_taste"] = batch_accounts["music_taste"].add(taste_change, fill_value = 0)
+    accounts = state["accounts"].add(batch_accounts, fill_value = 0)
+    state["accounts"] = accounts.astype({column: np.float64 if column.endswith("_sum") else np.int64 for column in ACCOUNT_STATE_COLUMNS})
+
+    # totals over all rows, including rows without account
+    totals = rows[ACCOUNT_STATE_COLUMNS].sum()
+    totals["ticket_price_sum"] = ticket_price_level.sum()
+    totals["ticket_price_count"] = ticket_price_level.notna().sum()
+    state["totals"] = state["totals"] + totals.reindex(state["totals"].index, fill_value = 0)
+
+    # frequency tables of the modes
+    for column in MODE_COLUMNS:
+        state["value_counts"][column] = add_value_counts(state["value_counts"][column], rows.dropna(subset = ["account.id"]), column)
+    state["location_counts"] = add_value_counts(state["location_counts"], rows, "location")
+
+    state["n_subscriptions"] += len(subscriptions_df)
+    state["n_tickets"] += 0 if tickets_df is None else len(tickets_df)
+    updated_accounts = set(batch_accounts.index)
+    state["dirty_accounts"] |= updated_accounts
+    return updated_accounts
+
+
+def get_fill_dependent_accounts(state, columns):
+    """
+    Accounts whose subscription information in some columns depends on the global fill values.
+
+    Parameters:
+        state (dict): Feature state.
+        columns (list): Columns whose fill value changed, among no.seats, price.level, subscription_tier, Lat and Long.
+
+    Returns:
+        pd.Index: account.id of the accounts.
+    """
+    accounts = state["accounts"]
+    depends = np.zeros(len(accounts), dtype = bool)
+    for column in ["no.seats", "price.level", "subscription_tier"]:
+        if column in columns:
+            depends |= (accounts[column + "_count"] < accounts["n_rows"]).values
+    account_ids = accounts.index[depends]
+
+    if "Lat" in columns or "Long" in columns:
+        location_counts = state["value_counts"]["location"]
+        no_coordinates = ~location_counts["location"].isin(state["city_coordinates"].index)
+        account_ids = account_ids.union(pd.Index(location_counts.loc[no_coordinates, "account.id"].unique()))
+    return account_ids
+
+
+def get_state_means(state, account_ids, fill_values):
+    """
+    Means of no.seats, price.level and subscription_tier of some accounts, with missing values filled like engineer_subscription.
+    """
+    accounts = state["accounts"].loc[account_ids]
+    means = pd.DataFrame(index = accounts.index)
+    for column in ["no.seats", "subscription_tier"]:
+        n_missing = accounts["n_rows"] - accounts[column + "_count"]
+        means[column] = get_filled_mean(accounts[column + "_sum"], accounts[column + "_count"], n_missing, fill_values[column])
+
+    # missing ticket prices take the ticket mean, missing subscription prices the overall mean
+    price_sum, price_count = accounts["price.level_sum"], accounts["price.level_count"]
+    ticket_missing = accounts["price.level_ticket_missing"]
+    subscription_missing = accounts["n_rows"] - price_count - ticket_missing
+    if not np.isnan(fill_values["ticket_price"]):
+        price_sum, price_count = price_sum + ticket_missing * fill_values["ticket_price"], price_count + ticket_missing
+    means["price.level"] = get_filled_mean(price_sum, price_count, subscription_missing, fill_values["price.level"])
+    return means
+
+
+def get_state_coordinates(state, account_ids, fill_values):
+    """
+    Most frequent Lat and Long of the subscribed locations of some accounts, unknown cities take the most frequent coordinates.
+    """
+    location_counts = state["value_counts"]["location"]
+    coordinates = get_location_coordinates(state, location_counts[location_counts["account.id"].isin(account_ids)])
+    modes = pd.DataFrame(index = pd.Index(account_ids, name = "account.id"))
+    for column in ["Lat", "Long"]:
+        coordinates[column] = coordinates[column].fillna(fill_values[column])
+        value_counts = coordinates.groupby(["account.id", column], sort = False).agg({"count": "sum", "first": "min"}).reset_index()
+        modes[column] = get_modes(value_counts, column)
+    return modes
+
+
+def compute_sub_info(state, account_ids, fill_values):
+    """
+    Compute the representative subscription information of some accounts from the feature state.
+
+    Parameters:
+        state (dict): Feature state.
+        account_ids (list): account.id of the accounts to compute.
+        fill_values (dict): Global fill values, see get_fill_values.
+
+    Returns:
+        pd.DataFrame: Subscription information of the accounts, indexed by account.id.
+    """
+    accounts = state["accounts"].loc[account_ids]
+    sub_info = pd.DataFrame(index = accounts.index)
+    sub_info["season"] = accounts["n_rows"]
+    sub_info = sub_info.join(get_state_means(state, account_ids, fill_values))
+
+    for column in ["package", "section", "multiple.subs"]:
+        value_counts = state["value_counts"][column]
+        sub_info[column] = get_modes(value_counts[value_counts["account.id"].isin(account_ids)], column)
+
+    sub_info = sub_info.join(get_state_coordinates(state, account_ids, fill_values))
+    sub_info["music_taste"] = accounts["music_taste"].astype(np.float64 if state["music_taste_has_nan"] else np.int64)
+    return sub_info[SUB_INFO_COLUMNS]
+
+
+def get_state_sub_info(state):
+    """
+    Get the representative subscription information of every account, as engineer_subscription returns it.
+    Accounts updated since the last call are recomputed; of the other accounts, only the means or coordinates
+    depending on a fill value that changed are.
+
+    Parameters:
+        state (dict): Feature state, its cached subscription information is updated in place.
+
+    Returns:
+        sub_info (pd.DataFrame): Representative subscription information for each account, sorted by account.id.
+    """
+    fill_values = get_fill_values(state)
+    sub_info = state["sub_info"]
+
+    dirty_accounts = sorted(state["dirty_accounts"])
+    if dirty_accounts:
+        sub_info = pd.concat([sub_info.drop(index = dirty_accounts, errors = "ignore"), compute_sub_info(state, dirty_accounts, fill_values)])
+        sub_info = sub_info.sort_index()
+
+    previous_fill_values = state["fill_values"]
+    if previous_fill_values is not None:
+        changed = [key for key, value in fill_values.items()
+                   if not (np.isnan(value) and np.isnan(previous_fill_values[key])) and value != previous_fill_values[key]]
+        if "ticket_price" in changed:
+            changed.append("price.level")
+        account_ids = get_fill_dependent_accounts(state, changed).difference(dirty_accounts)
+        if len(account_ids) and {"no.seats", "price.level", "subscription_tier"} & set(changed):
+            means = get_state_means(state, account_ids, fill_values)
+            sub_info.loc[account_ids, means.columns] = means
+        if len(account_ids) and {"Lat", "Long"} & set(changed):
+            coordinates = get_state_coordinates(state, account_ids, fill_values)
+            sub_info.loc[account_ids, coordinates.columns] = coordinates
+
+    state["sub_info"] = sub_info
+    state["fill_values"] = fill_values
+    state["dirty_accounts"] = set()
+
+    sub_info = sub_info.astype({"season": np.int64, "music_taste": np.float64 if state["music_taste_has_nan"] else np.int64})
+    return compact_dtypes(sub_info.reset_index(), SUBSCRIPTION_SCHEMA)
+
+
+def save_feature_state(state, state_path):
+    """
+    Save a feature state, through a unique temporary file so that an interrupted run, or another run saving the same
+    state, never leaves a broken state.
+    """
+    state_path = Path(state_path)
+    state_path.parent.mkdir(parents = True, exist_ok = True)
+
+    def write(path):
+        with open(path, "wb") as f:
+            pickle.dump(state, f, protocol = pickle.HIGHEST_PROTOCOL)
+    write_atomic(state_path, write)
+
+
+def load_feature_state(state_path):
+    """
+    Load a saved feature state, None if there is none or it was saved by another version.
+    """
+    if not Path(state_path).exists():
+        return None
+    with open(state_path, "rb") as f:
+        state = pickle.load(f)
+    return state if state.get("version") == STATE_VERSION else None
+
+
+def engineer_subscription_incremental(state_path, subscriptions_df, tickets_df, city_centroids, concerts_df, concerts1415_df, logger = None):
+    """
+    Incremental engineer_subscription for append-only subscriptions and tickets tables.
+    The persisted state remembers how many rows of each table it has seen; only the rows appended since then are folded in.
+    The state is rebuilt from scratch when rows it has seen changed or when the lookup tables changed.
+
+    Parameters:
+        state_path (pathlib.Path): File of the persisted feature state.
+        subscriptions_df (pd.DataFrame): Subscriptions data.
+        tickets_df (pd.DataFrame): Tickets data.
+        city_centroids (pd.DataFrame): Lat and Long of every city, see build_zipcode_index.
+        concerts_df (pd.DataFrame): Concerts data.
+        concerts1415_df (pd.DataFrame): Concerts 2014-2015 data.
+        logger (logging.Logger, optional): Logger reporting the number of new rows and updated accounts.
+
+    Returns:
+        sub_info (pd.DataFrame): Engineered subscription data with representative information for each account.
+    """
+    state = load_feature_state(state_path)
+    if state is not None:
+        seen_subscriptions = subscriptions_df.iloc[:state["n_subscriptions"]]
+        seen_tickets = tickets_df.iloc[:state["n_tickets"]]
+        if (state["lookups_fingerprint"] != get_lookups_fingerprint(city_centroids, concerts_df, concerts1415_df)
+                or len(seen_subscriptions) < state["n_subscriptions"] or len(seen_tickets) < state["n_tickets"]
+                or state["subscriptions_fingerprint"] != get_data_fingerprint(seen_subscriptions)
+                or state["tickets_fingerprint"] != get_data_fingerprint(seen_tickets)):
+            state = None
+    if state is None:
+        if logger is not None:
+            logger.info(f'Feature state rebuilt from scratch')
+        state = create_feature_state(city_centroids, concerts_df, concerts1415_df)
+
+    new_subscriptions = subscriptions_df.iloc[state["n_subscriptions"]:]
+    new_tickets = tickets_df.iloc[state["n_tickets"]:]
+    updated_accounts = update_feature_state(state, new_subscriptions, new_tickets)
+    if logger is not None:
+        logger.info(f'Feature state: {len(new_subscriptions)} new subscriptions, {len(new_tickets)} new tickets, '
+                    f'{len(updated_accounts)} accounts updated')
+
+    sub_info = get_state_sub_info(state)
+    state["subscriptions_fingerprint"] = get_data_fingerprint(subscriptions_df)
+    state["tickets_fingerprint"] = get_data_fingerprint(tickets_df)
+    save_feature_state(state, state_path)
+    return sub_info
+
+
+def engineer_subscription_chunked(subscription_chunks, ticket_chunks, city_centroids, concerts_df, concerts1415_df, logger = None):
+    """
+    Out-of-core engineer_subscription for subscriptions and tickets tables streamed in chunks.
+    Each chunk is joined to the concerts and zipcodes lookups and folded into the per-account aggregates of a
+    feature state, so that memory grows with the number of accounts instead of the number of rows.
+
+    Parameters:
+        subscription_chunks (iterable): pd.DataFrame chunks of the subscriptions data, in file order.
+        ticket_chunks (iterable): pd.DataFrame chunks of the tickets data, in file order.
+        city_centroids (pd.DataFrame): Lat and Long of every city, see build_zipcode_index.
+        concerts_df (pd.DataFrame): Concerts data.
+        concerts1415_df (pd.DataFrame): Concerts 2014-2015 data.
+        logger (logging.Logger, optional): Logger reporting the number of streamed rows.
+
+    Returns:
+        sub_info (pd.DataFrame): Engineered subscription data with representative information for each account,
+            the same as engineer_subscription on the whole tables.
+    """
+    state = create_feature_state(city_centroids, concerts_df, concerts1415_df)
+    # positions of the rows, which break ties between modes, only depend on the order of the rows
+    # so subscriptions and tickets can be folded one table after the other
+    for subscriptions_chunk in subscription_chunks:
+        update_feature_state(state, subscriptions_df = subscriptions_chunk)
+    for tickets_chunk in ticket_chunks:
+        update_feature_state(state, tickets_df = tickets_chunk)
+
+    if logger is not None:
+        logger.info(f'Streamed {state["n_subscriptions"]} subscriptions and {state["n_tickets"]} tickets '
+                    f'into {len(state["accounts"])} accounts')
+    return get_state_sub_info(state)
@@ -0,0 +1,118 @@
+import numpy as np
+import pandas as pd
+
+
+# declared dtypes of the engineered tables: "float" (float32), "category", or the (min, max) range of an integer column
+# ranges are semantic bounds that do not grow with the number of accounts
+ACCOUNT_SCHEMA = {
+    "billing.zip.code": (0, 99999),
+    "billing.city": "category",
+    "amount.donated.2013": "float",
+    "amount.donated.lifetime": "float",
+    "no.donations.lifetime": (0, 10000),
+    "first.donated": "float",
+}
+
+ZIPCODE_SCHEMA = {
+    "Zipcode": (0, 99999),
+    "Lat": "float",
+    "Long": "float",
+    "Decommisioned": (-1, 1),
+    "TaxReturnsFiled": "float",
+    "EstimatedPopulation": "float",
+    "TotalWages": "float",
+}
+
+SUBSCRIPTION_SCHEMA = {
+    "season": (0, 30000),
+    "package": "category",
+    "no.seats": "float",
+    "section": "category",
+    "multiple.subs": "category",
+    "price.level": "float",
+    "subscription_tier": "float",
+    "Lat": "float",
+    "Long": "float",
+    "music_taste": "float",
+}
+
+# encoded categories take codes in [-1, number of categories)
+FEATURE_SCHEMA = {
+    "amount.donated.2013": "float",
+    "amount.donated.lifetime": "float",
+    "no.donations.lifetime": (0, 10000),
+    "first.donated": "float",
+    "Lat_account": "float",
+    "Long_account": "float",
+    "Decommisioned": (-1, 1),
+    "TaxReturnsFiled": "float",
+    "EstimatedPopulation": "float",
+    "TotalWages": "float",
+    "season": (0, 30000),
+    "package": (-1, 100),
+    "no.seats": "float",
+    "section": (-1, 100),
+    "multiple.subs": (-1, 100),
+    "price.level": "float",
+    "subscription_tier": "float",
+    "Lat_sub": "float",
+    "Long_sub": "float",
+    "music_taste": "float",
+}
+
+
+def get_int_dtype(low, high):
+    """
+    Smallest signed integer dtype holding every value in [low, high].
+    """
+    for dtype in [np.int8, np.int16, np.int32]:
+        if np.iinfo(dtype).min <= low and high <= np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+def compact_dtypes(df, schema):
+    """
+    Downcast the columns of a dataframe to the dtypes declared in a schema.
+    Integer columns take the smallest dtype of their declared range, widened if the data goes beyond it,
+    and stay float32 if they hold missing values. Columns missing from the schema are kept as they are.
+
+    Parameters:
+        df (pd.DataFrame): Data to downcast, its columns are replaced in place.
+        schema (dict): Declared dtype of each column, see ACCOUNT_SCHEMA.
+
+    Returns:
+        pd.DataFrame: Downcast data.
+    """
+    for column, declared in schema.items():
+        if column not in df.columns:
+            continue
+        values = df[column]
+        if declared == "category":
+            df[column] = values.astype("category")
+        elif declared == "float" or values.isna().any():
+            df[column] = pd.to_numeric(values).astype(np.float32)
+        else:
+            values = pd.to_numeric(values)
+            low, high = declared
+            if len(values):
+                low, high = min(low, values.min()), max(high, values.max())
+            df[column] = values.astype(get_int_dtype(low, high))
+    return df
+
+
+def get_memory_usage(df):
+    """
+    Memory used by a dataframe in megabytes, including the content of object columns.
+    """
+    return df.memory_usage(deep = True).sum() / (1 << 20)
+
+
+def log_memory(logger, stage, df):
+    """
+    Log the shape, memory and dtypes of the output of a stage.
+    """
+    if logger is None:
+        return
+    dtypes = ", ".join(f"{dtype}: {count}" for dtype, count in df.dtypes.astype(str).value_counts().items())
+    logger.info(f'Memory of {stage}: {df.shape[0]} x {df.shape[1]}, {get_memory_usage(df):.2f} MB ({dtypes})')
@@ -0,0 +1,172 @@
+import hashlib
+import os
+import pickle
+from pathlib import Path
+import inspect
+import threading
+import uuid
+import numpy as np
+import pandas as pd
+
+# stages may run concurrently, eviction removes entries of other stages
+_eviction_lock = threading.Lock()
+
+
+def get_data_fingerprint(data):
+    """
+    Compute a content fingerprint of a stage input.
+
+    Parameters:
+        data: pd.DataFrame, pd.Series or any picklable object.
+
+    Returns:
+        str: Hex digest of the content.
+    """
+    sha = hashlib.sha256()
+    if isinstance(data, (pd.DataFrame, pd.Series)):
+        # column names and dtypes are part of the content, values are hashed row by row
+        sha.update(repr(list(data.columns) if isinstance(data, pd.DataFrame) else data.name).encode())
+        sha.update(repr(data.dtypes.tolist() if isinstance(data, pd.DataFrame) else data.dtype).encode())
+        sha.update(pd.util.hash_pandas_object(data, index=True).values.tobytes())
+    else:
+        sha.update(pickle.dumps(data))
+    return sha.hexdigest()
+
+
+def get_source_fingerprint(stage_func):
+    """
+    Compute a fingerprint of the source code a stage depends on.
+    Stages call helpers across their package, so every module of the package is hashed.
+
+    Parameters:
+        stage_func (callable): Stage function.
+
+    Returns:
+        str: Hex digest of the package source.
+    """
+    sha = hashlib.sha256()
+    package_path = Path(inspect.getfile(stage_func)).parent
+    for source_file in sorted(package_path.glob("*.py")):
+        sha.update(source_file.name.encode())
+        sha.update(source_file.read_bytes())
+    return sha.hexdigest()
+
+
+def write_atomic(file_path, write):
+    """
+    Write a file through a temporary file in the same directory, so that a reader never sees a partial file.
+    The temporary file is unique to the call, so that threads and processes writing the same file never share it.
+
+    Parameters:
+        file_path (pathlib.Path): Final path of the file.
+        write (callable): Function writing the file to the path it is given.
+    """
+    file_path = Path(file_path)
+    tmp_path = file_path.with_name("%s.%d.%s.tmp" % (file_path.name, os.getpid(), uuid.uuid4().hex))
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+
+def evict_stage_cache(cache_path, max_cache_size, pattern="*.pkl"):
+    """
+    Remove least recently used cache entries until the cache fits into its size budget.
+    Entries are touched on every hit, so the modification time orders them by last use.
+    Entries removed meanwhile by another process are skipped.
+
+    Parameters:
+        cache_path (pathlib.Path): Directory of the stage cache.
+        max_cache_size (int): Size budget of the cache in bytes.
+        pattern (str): Glob pattern of the entries.
+
+    Returns:
+        list: Names of the evicted entries.
+    """
+    entries = []
+    for entry in Path(cache_path).glob(pattern):
+        try:
+            entries.append((entry.stat(), entry))
+        except FileNotFoundError:
+            pass
+    entries.sort(key=lambda entry: entry[0].st_mtime_ns)
+    cache_size = sum(stat.st_size for stat, _ in entries)
+
+    evicted = []
+    for stat, entry in entries:
+        if cache_size <= max_cache_size:
+            break
+        cache_size -= stat.st_size
+        entry.unlink(missing_ok=True)
+        evicted.append(entry.name)
+    return evicted
+
+
+def run_cached_stage(stage_func, *inputs, cache_path=None, max_cache_size=1 << 30, logger=None):
+    """
+    Run a pure data engineering stage through a content-addressed disk cache.
+    The cache key combines the stage name, its package source code and the content of every input,
+    so the stage is only recomputed when its code or its data changed.
+
+    Parameters:
+        stage_func (callable): Stage function, e.g. engineer_account.
+        *inputs: Positional inputs of the stage.
+        cache_path (pathlib.Path, optional): Directory of the stage cache. If not provided, the stage is run directly.
+        max_cache_size (int): Size budget of the cache in bytes, least recently used entries are evicted beyond it.
+        logger (logging.Logger, optional): Logger reporting the hit or miss of the stage.
+
+    Returns:
+        Output of the stage.
+    """
+    if cache_path is None:
+        return stage_func(*inputs)
+
+    cache_path = Path(cache_path)
+    cache_path.mkdir(parents=True, exist_ok=True)
+
+    # fingerprint inputs before running the stage, stages may modify their inputs in place
+    sha = hashlib.sha256()
+    sha.update(stage_func.__name__.encode())
+    sha.update(get_source_fingerprint(stage_func).encode())
+    # entries are pickles of pandas and numpy objects, which other versions may not load
+    sha.update(repr((pd.__version__, np.__version__)).encode())
+    for data in inputs:
+        sha.update(get_data_fingerprint(data).encode())
+    entry = cache_path / ("%s-%s.pkl" % (stage_func.__name__, sha.hexdigest()[:32]))
+
+    try:
+        with _eviction_lock:
+            with open(entry, "rb") as f:
+                output = pickle.load(f)
+            # mark the entry as recently used
+            os.utime(entry)
+        if logger is not None:
+            logger.info(f'Stage cache hit: {stage_func.__name__}')
+        return output
+    except FileNotFoundError:
+        pass
+    except (EOFError, pickle.UnpicklingError, AttributeError, ImportError, ValueError) as error:
+        # truncated, corrupt or unreadable entry, recomputed and overwritten like a miss
+        if logger is not None:
+            logger.info(f'Stage cache entry of {stage_func.__name__} is unreadable ({error!r}), removing it')
+        entry.unlink(missing_ok=True)
+
+    if logger is not None:
+        logger.info(f'Stage cache miss: {stage_func.__name__}')
+    output = stage_func(*inputs)
+
+    def write(path):
+        with open(path, "wb") as f:
+            pickle.dump(output, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    # an interrupted run or a concurrent writer of the same entry never leaves a broken entry
+    write_atomic(entry, write)
+
+    with _eviction_lock:
+        evicted = evict_stage_cache(cache_path, max_cache_size)
+    if logger is not None and evicted:
+        logger.info(f'Stage cache evicted {len(evicted)} entries')
+
+    return output
@@ -0,0 +1,58 @@
+from .engineer_data import engineer_zipcode, get_city_centroids
+import pandas as pd
+import numpy as np
+
+
+# zipcode features joined to the billing zip code of every account
+ZIPCODE_FEATURES = ["Lat", "Long", "Decommisioned", "TaxReturnsFiled", "EstimatedPopulation", "TotalWages"]
+# zipcodes have five digits, longer ones are never found
+MAX_ZIPCODE = 99999
+MISSING_POSITION = -1
+
+
+def build_zipcode_index(zipcodes_df):
+    """
+    Build the zipcode lookup index once, so that joining zipcodes is an array gather instead of a merge.
+    a. Dense array mapping every integer zipcode to its row of features, MISSING_POSITION for unknown zipcodes.
+    b. Features of the engineered zipcodes, followed by a row of NaN that MISSING_POSITION points to.
+    c. Mean latitude and longitude of every city.
+
+    Parameters:
+        zipcodes_df (pd.DataFrame): Zipcodes dataframe.
+
+    Returns:
+        dict: Zipcode index with "positions", "features" and "city_centroids".
+    """
+    zipcodes_data = engineer_zipcode(zipcodes_df)
+    zipcodes = zipcodes_data["Zipcode"].to_numpy()
+    in_range = (zipcodes >= 0) & (zipcodes <= MAX_ZIPCODE)
+
+    positions = np.full(MAX_ZIPCODE + 1, MISSING_POSITION, dtype = np.int32)
+    positions[zipcodes[in_range]] = np.flatnonzero(in_range)
+
+    # integer columns become float to hold the NaN row, they are filled and downcast in get_engineered_data
+    features = zipcodes_data[ZIPCODE_FEATURES].astype(np.float32)
+    features = pd.concat([features, pd.DataFrame(np.nan, index = [len(features)], columns = ZIPCODE_FEATURES, dtype = np.float32)])
+    return {"positions": positions, "features": features.reset_index(drop = True), "city_centroids": get_city_centroids(zipcodes_df)}
+
+
+def get_zipcode_features(zipcode_index, zipcodes):
+    """
+    Gather the zipcode features of a column of zipcodes, NaN for unknown and missing zipcodes.
+
+    Parameters:
+        zipcode_index (dict): Index returned by build_zipcode_index.
+        zipcodes (pd.Series): Integer zipcodes, with NaN for missing ones.
+
+    Returns:
+        pd.DataFrame: ZIPCODE_FEATURES of every zipcode, with the index of zipcodes.
+    """
+    index = zipcodes.index
+    zipcodes = zipcodes.to_numpy(dtype = np.float64, na_value = np.nan)
+    known = (zipcodes >= 0) & (zipcodes <= MAX_ZIPCODE)
+    positions = np.full(len(zipcodes), MISSING_POSITION, dtype = np.int32)
+    positions[known] = zipcode_index["positions"][zipcodes[known].astype(np.int64)]
+
+    # MISSING_POSITION takes the trailing row of NaN
+    features = zipcode_index["features"]
+    return pd.DataFrame({column: features[column].to_numpy()[positions] for column in ZIPCODE_FEATURES}, index = index)
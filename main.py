@@ -10,33 +10,106 @@ from optuna.trial import Trial
 import json
 from datasets import *
 from utils import *
+from models import ENGINES, get_engine
 import warnings
 import datetime
+import argparse
 # Ignore all warnings
 warnings.filterwarnings("ignore")
 
 N_TRIAL = 20
+N_WARM_START_TRIALS = 5 # best trials of the first study evaluated first by the study on the selected features
+FT_SELECTED_TRIAL_FRACTION = 0.5 # trials of the warm-started study on the selected features, as a fraction of --n-trials
+FOLD_BACKEND = "thread" # how the cross-validation folds of a trial are trained: "sequential", "thread" or "process"
+# outputs of the stage graph computed for every --target, the stages they need are run
+TARGETS = {
+    "features": ["X_train", "y_train", "X_test"],
+    "study": ["study"],
+    "selected_features": ["selected_features"],
+    "study_ft_selected": ["study_ft_selected"],
+    "submission": ["submission"],
+}
 
 
+def parse_args():
+    """
+    Parse command line arguments of the training pipeline.
+    """
+    parser = argparse.ArgumentParser(description="Train and tune the subscription model, then create the submission")
+    parser.add_argument("--root-path", type=Path, default=Path(os.getcwd()), help="repository root containing data/ and results/")
+    parser.add_argument("--n-trials", type=int, default=N_TRIAL, help="number of Optuna trials of each study")
+    parser.add_argument("--n-trials-ft-selected", type=int, default=None,
+                        help="number of trials of the warm-started study on the selected features, defaults to a fraction of --n-trials")
+    parser.add_argument("--n-warm-start-trials", type=int, default=N_WARM_START_TRIALS,
+                        help="best trials of the first study enqueued in the study on the selected features, "
+                             "at most half of its trials")
+    parser.add_argument("--fold-backend", default=FOLD_BACKEND, choices=FOLD_BACKENDS, help="how the folds of a trial are trained")
+    parser.add_argument("--n-workers", type=int, default=1, help="number of worker processes running Optuna trials")
+    parser.add_argument("--storage", default=None,
+                        help="Optuna storage shared by the workers: database URL or journal file path. "
+                             "Defaults to a journal file in the results directory when --n-workers > 1")
+    parser.add_argument("--study-name", default=None,
+                        help="name of the Optuna study, reuse it with the same --storage to resume an interrupted run")
+    parser.add_argument("--pruner", default="none", choices=PRUNERS, help="Optuna pruner stopping unpromising trials early")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="seed of the sampler of the studies, a repeated run proposes the same parameters and replays them from the trial cache")
+    parser.add_argument("--trial-cache-size", type=float, default=MAX_TRIAL_CACHE_SIZE / (1 << 20),
+                        help="MB of cross-validation results of evaluated parameters kept in data/.cache/trials and reused by later "
+                             "studies on the same data, 0 disables the cache")
+    parser.add_argument("--early-stopping-rounds", type=int, default=None,
+                        help="stop boosting a fold once its validation AUC did not improve for this many rounds")
+    parser.add_argument("--selection-tolerance", type=float, default=0.0,
+                        help="CV AUC a smaller feature subset may lose against the best one during feature selection")
+    parser.add_argument("--incremental", action="store_true",
+                        help="update the per-account subscription state with the rows appended since the last run instead of rebuilding it")
+    parser.add_argument("--stream-chunk-size", type=int, default=None,
+                        help="stream subscriptions.csv and tickets_all.csv in chunks of this many rows instead of loading them whole")
+    parser.add_argument("--profile", default="none", choices=PROFILERS,
+                        help="dump a cProfile (.prof) or pyinstrument (.html) profile of every stage to the profiles/ directory of the run")
+    parser.add_argument("--trace-allocations", action="store_true",
+                        help="track the peak Python allocations of every stage with tracemalloc, slower")
+    parser.add_argument("--ensemble", action="store_true",
+                        help="predict with the fold models of the best trial instead of a refit, and save their out-of-fold and test predictions")
+    parser.add_argument("--stack-runs", nargs="+", default=None,
+                        help="results directories of previous --ensemble runs whose saved predictions are combined with this run's")
+    parser.add_argument("--stack-method", default="blend", choices=STACK_METHODS,
+                        help="rank average of the predictions, or a level-2 model fitted on the out-of-fold predictions")
+    parser.add_argument("--meta-model", default="lightgbm", choices=list(ENGINES), help="backend of the level-2 model of --stack-method stack")
+    parser.add_argument("--headless", action="store_true", help="skip the plots, e.g. on machines without a display or in batch runs")
+    parser.add_argument("--model", default="lightgbm", choices=list(ENGINES), help="gradient boosting backend of the model")
+    parser.add_argument("--benchmark-models", action="store_true",
+                        help="also run a study for every backend on the same features and compare their AUC and wall time")
+    parser.add_argument("--target", default="submission", choices=list(TARGETS),
+                        help="output to compute, only the stages it needs are run")
+    parser.add_argument("--reuse-run", type=Path, default=None,
+                        help="results directory of a previous run whose saved studies and selected features are reused instead of recomputed")
+    args = parser.parse_args()
+    if args.stack_runs and not args.ensemble:
+        parser.error("--stack-runs requires --ensemble, whose predictions are stacked with the saved ones")
+    return args
+
     
-def main():
+def main(args):
     """
     Main function to process data, train models, conduct feature selection, generate predictions, and save results.
 
-    This function performs the following steps:
+    Parameters:
+        args (argparse.Namespace): Command line arguments, see parse_args.
+
+    This function performs the following steps, as stages of a StageGraph only run when --target needs them:
     1. Loads data from CSV files.
     2. Engineers features from loaded data.
-    3. Trains a model using LightGBM with hyperparameter optimization.
+    3. Trains a model using the selected backend with hyperparameter optimization.
     4. Conducts feature selection based on model results.
     5. Retrains the model using selected features.
-    6. Generates predictions for the test data.
+    6. Generates predictions for the test data and saves the final model for score.py.
     7. Saves the submission file, optimization results, selected features, and best hyperparameters.
     """
     
 
     
     # get data path
-    root_path = Path("/home/featurize/work/AIPI520_Kaggle")#os.getcwd())
+    root_path = args.root_path
     data_path = root_path / "data"
     trial_time = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
     output_path = root_path / "results" / trial_time
@@ -48,75 +121,157 @@ def main():
     log_file = output_path / ('train_%s.log' % trial_time)
     logger = common_utils.create_logger(log_file)
     
+    # trials of parallel workers are shared through a storage, a single worker keeps every study of the run in memory
+    storage = args.storage
+    if storage is None and args.n_workers > 1:
+        storage = str(output_path / "optuna_journal.log")
+    study_name = args.study_name or (trial_time if storage is not None else None)
+    if storage is None:
+        storage = optuna.storages.InMemoryStorage()
     
-
-    logger.info(f'********************** Loading Data **********************')
-    # load data
-    accounts_df = pd.read_csv(data_path / "account.csv", encoding="ISO-8859-1") # location info for each patron and donation history
-    zipcodes_df =  pd.read_csv(data_path / "zipcodes.csv") # location and demographic information for zipcodes
-    tickets_df =  pd.read_csv(data_path / "tickets_all.csv")
-    subscriptions_df =  pd.read_csv(data_path / "subscriptions.csv")
-    concerts_df =  pd.read_csv(data_path / "concerts.csv")
-    concerts1415_df = pd.read_csv(data_path / "concerts_2014-15.csv")
-    train_df = pd.read_csv(data_path / "train.csv") # whether the patrons have purchased a 2014-15 subscription or not
-    test_df = pd.read_csv(data_path / "test.csv")
-    submission_df = pd.read_csv(data_path / "sample_submission.csv")
-
-    logger.info(f'********************** Data Engineering **********************')
-    # load engineered data
-    accounts_data = engineer_account(accounts_df)
-    zipcodes_data = engineer_zipcode(zipcodes_df)
-    subscriptions_data = engineer_subscription(subscriptions_df, tickets_df, zipcodes_df, concerts_df, concerts1415_df)
-
-    # get training and testing data
-    X_train, y_train = get_engineered_data(train_df, "train", subscriptions_data, zipcodes_data, accounts_data)
-    X_test, _ =  get_engineered_data(test_df, "test", subscriptions_data, zipcodes_data, accounts_data)
     
-    
-    logger.info(f'********************** Feature Selection with LightGBM **********************')
-    # train model
-    study = train_model_with_optuna(X_train, y_train, n_trials = N_TRIAL)
-    train_optuna_result = study.trials_dataframe()
-    
-    
-    # conduct feature selection
-    feature_importance = feature_selection(study, X_train, y_train, output_path)
 
-    # determine threshold through feature importance dataframe
-    threshold = 7
-    selected_features = feature_importance.iloc[:threshold, 1].values
-    X_train_ft_selected = X_train[selected_features]
-    X_test_ft_selected = X_test[selected_features]
+    # time and memory of every stage, trial and fold are saved to timings.json
+    profiler = StageProfiler(output_path / "profiles", args.profile, args.trace_allocations, logger)
+    set_profiler(profiler)
 
-    
-    logger.info(f'********************** Train the Final Model **********************')
-    # retrain model on data after feature selection
-    study_ft_selected = train_model_with_optuna(X_train_ft_selected, y_train, n_trials = N_TRIAL)
-    train_optuna_ft_selected_result = study_ft_selected.trials_dataframe()
-    print_study(study_ft_selected, logger)
-    
-    logger.info(f'********************** Create Submission & Save Experiment Results **********************')
-    # generate submission result
-    submission = generate_prediction(study_ft_selected, test_df, submission_df, X_train_ft_selected, y_train, X_test_ft_selected)
-    
-    # save result
-    submission.to_csv(output_path / "submission.csv", index = False)
-    train_optuna_result.to_csv(output_path / "train_optuna_result.csv", index = False)
-    train_optuna_ft_selected_result.to_csv("train_optuna_ft_selected_result.csv", index = False)
-    
-    
-    
-    # save best params to json
-    best_params = study_ft_selected.best_trial.params
-    best_params["objective"] = "regression"
-    best_params["seed"] = 42
-    best_params["metric"] = "auc"
-    best_params["boosting_type"] = "gbdt"
-    best_params['is_unbalance'] = True
-    best_params["n_trials"] = N_TRIAL
-    save_json(best_params, output_path / "lightgbm_best_param.json")
+    # results, tables and plots are written in the background while the next stages run
+    artifact_writer = ArtifactWriter(output_path, headless = args.headless, logger = logger)
+
+    # stages only run when the target needs them, independent stages run concurrently
+    # the studies and the selected features are saved to outputs/ and can be reused by a later run with --reuse-run
+    graph = StageGraph(persist_path = output_path / "outputs", reuse_path = args.reuse_run and args.reuse_run / "outputs",
+                       context = {"model": args.model}, logger = logger)
+    cache_path = data_path / ".cache"
+    # parameters evaluated before on the same data return their saved AUC instead of training the folds again
+    trial_cache = TrialCache(cache_path / "trials", int(args.trial_cache_size * (1 << 20))) if args.trial_cache_size > 0 else None
+    study_kwargs = dict(fold_backend = args.fold_backend, n_workers = args.n_workers, storage = storage,
+                        pruner = args.pruner, early_stopping_rounds = args.early_stopping_rounds, trial_cache = trial_cache)
+    # the search space of the warm-started study is the same, so a fraction of the trials is enough
+    n_trials_ft_selected = args.n_trials_ft_selected or max(1, int(args.n_trials * FT_SELECTED_TRIAL_FRACTION))
+
+    def load():
+        logger.info(f'********************** Loading Data **********************')
+        # load data concurrently, csv files are parsed once and then read back from the columnar cache
+        # streamed tables are read chunk by chunk when the subscription table is engineered
+        tables = None if args.stream_chunk_size is None else [name for name in RAW_TABLES if name not in STREAMED_TABLES]
+        return load_data(data_path, cache_path = cache_path, tables = tables, logger = logger)
+
+    # engineered tables, stages are only recomputed when their code or inputs changed
+    graph.add_stage("load_data", load, outputs = ["raw_data"])
+    graph.add_stage("engineer_account", lambda raw_data: get_accounts_data(raw_data, cache_path, logger),
+                    inputs = ["raw_data"], outputs = ["accounts_data"])
+    graph.add_stage("build_zipcode_index", lambda raw_data: get_zipcode_index(raw_data, cache_path, logger),
+                    inputs = ["raw_data"], outputs = ["zipcode_index"])
+    graph.add_stage("engineer_subscription", lambda raw_data, zipcode_index: get_subscriptions_data(raw_data, zipcode_index, cache_path, args.incremental,
+                                                                                                    logger, data_path, args.stream_chunk_size),
+                    inputs = ["raw_data", "zipcode_index"], outputs = ["subscriptions_data"])
+
+    def engineer(raw_data, accounts_data, zipcode_index, subscriptions_data):
+        # get training and testing data, categories are fitted on the training data and reused for the testing data
+        encoders = {}
+        X_train, y_train = get_engineered_data(raw_data["train"], "train", subscriptions_data, zipcode_index, accounts_data, encoders)
+        X_test, _ =  get_engineered_data(raw_data["test"], "test", subscriptions_data, zipcode_index, accounts_data, encoders)
+        log_memory(logger, "X_train", X_train)
+        log_memory(logger, "X_test", X_test)
+        return X_train, y_train, X_test, encoders
+
+    graph.add_stage("get_engineered_data", engineer, inputs = ["raw_data", "accounts_data", "zipcode_index", "subscriptions_data"],
+                    outputs = ["X_train", "y_train", "X_test", "encoders"])
+
+    def benchmark(X_train, y_train):
+        logger.info(f'********************** Benchmark Backends **********************')
+        # compare every backend on the same feature matrix
+        model_benchmark = benchmark_models(X_train, y_train, n_trials = args.n_trials, logger = logger,
+                                           study_name = study_name and study_name + "_benchmark", **study_kwargs)
+        artifact_writer.write_frame(model_benchmark, "model_benchmark")
+        return model_benchmark
+
+    def get_sampler():
+        # every study gets its own sampler, samplers cannot be shared between studies
+        return None if args.seed is None else optuna.samplers.TPESampler(seed = args.seed)
+
+    def train(X_train, y_train):
+        logger.info(f'********************** Feature Selection with {args.model} **********************')
+        study = train_model_with_optuna(X_train, y_train, n_trials = args.n_trials, study_name = study_name,
+                                        model_name = args.model, sampler = get_sampler(), logger = logger, **study_kwargs)
+        artifact_writer.write_frame(study.trials_dataframe(), "train_optuna_result")
+        return study
+
+    def select(study, X_train, y_train):
+        # conduct feature selection, the number of features is the smallest subset with the best CV AUC
+        _, selected_features, _ = feature_selection(study, X_train, y_train, output_path, model_name = args.model,
+                                                    early_stopping_rounds = args.early_stopping_rounds,
+                                                    tolerance = args.selection_tolerance, logger = logger,
+                                                    artifact_writer = artifact_writer)
+        return selected_features
+
+    def train_ft_selected(study, X_train, y_train, selected_features):
+        logger.info(f'********************** Train the Final Model **********************')
+        # retrain model on data after feature selection, warm-started from the best trials of the first study
+        study_ft_selected = train_model_with_optuna(X_train[selected_features], y_train, n_trials = n_trials_ft_selected,
+                                                    study_name = study_name and study_name + "_ft_selected",
+                                                    model_name = args.model, initial_params = get_top_params(study, args.n_warm_start_trials),
+                                                    sampler = get_sampler(), logger = logger, **study_kwargs)
+        artifact_writer.write_frame(study_ft_selected.trials_dataframe(), "train_optuna_ft_selected_result")
+        print_study(study_ft_selected, logger)
+        return study_ft_selected
+
+    # studies use every core for their folds and trials, they run alone
+    graph.add_stage("benchmark_models", benchmark, inputs = ["X_train", "y_train"], outputs = ["model_benchmark"], exclusive = True)
+    graph.add_stage("train_model_with_optuna", train, inputs = ["X_train", "y_train"], outputs = ["study"], persist = True, exclusive = True)
+    graph.add_stage("feature_selection", select, inputs = ["study", "X_train", "y_train"], outputs = ["selected_features"],
+                    persist = True, exclusive = True)
+    graph.add_stage("train_model_with_optuna_ft_selected", train_ft_selected, inputs = ["study", "X_train", "y_train", "selected_features"],
+                    outputs = ["study_ft_selected"], persist = True, exclusive = True)
+
+    def predict(study_ft_selected, raw_data, X_train, y_train, X_test, selected_features, encoders):
+        logger.info(f'********************** Create Submission & Save Experiment Results **********************')
+        train_df, test_df, submission_df = raw_data["train"], raw_data["test"], raw_data["submission"]
+        X_train_ft_selected = X_train[selected_features]
+        X_test_ft_selected = X_test[selected_features]
+        # generate submission result, from a refit on the full data or from the fold models of the best trial
+        if args.ensemble:
+            submission, _ = generate_ensemble_prediction(study_ft_selected, test_df, submission_df, X_train_ft_selected, y_train,
+                                                         X_test_ft_selected, train_df["account.id"], output_path / "predictions",
+                                                         model_name = args.model, model_path = output_path / "model", encoders = encoders,
+                                                         early_stopping_rounds = args.early_stopping_rounds, logger = logger)
+        else:
+            submission = generate_prediction(study_ft_selected, test_df, submission_df, X_train_ft_selected, y_train, X_test_ft_selected,
+                                             model_name = args.model, model_path = output_path / "model", encoders = encoders)
+
+        # combine the predictions of this run with the saved predictions of other runs, e.g. of other backends
+        if args.stack_runs:
+            with stage("stack_predictions"):
+                prediction_paths = [output_path / "predictions"] + [Path(run) / "predictions" for run in args.stack_runs]
+                _, stacked_pred = stack_predictions(prediction_paths, y_train, method = args.stack_method, meta_model = args.meta_model, logger = logger)
+                submission = make_submission(test_df, submission_df, stacked_pred)
+
+        # save result
+        artifact_writer.write_frame(submission, "submission")
+
+        # save best params to json
+        best_params = get_engine(args.model).get_params(study_ft_selected.best_trial.params)
+        best_params["n_trials"] = args.n_trials
+        best_params["n_trials_ft_selected"] = n_trials_ft_selected
+        artifact_writer.write_json(best_params, f"{args.model}_best_param.json")
+        return submission
+
+    graph.add_stage("generate_prediction", predict, inputs = ["study_ft_selected", "raw_data", "X_train", "y_train", "X_test",
+                                                             "selected_features", "encoders"],
+                    outputs = ["submission"], exclusive = True)
+
+    # run the stages of the target, the backends are benchmarked first on request
+    graph.run((["model_benchmark"] if args.benchmark_models else []) + TARGETS[args.target])
+
+    # wait for the pending artifacts, the time left after the last stage
+    with stage("save_results"):
+        artifact_writer.close()
+
+    profiler.save(output_path / "timings.json")
+    set_profiler(None)
     
     logger.info(f'********************** Done **********************')
     
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main(parse_args())
\ No newline at end of file
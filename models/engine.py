@@ -0,0 +1,414 @@
+import json
+from pathlib import Path
+import numpy as np
+import lightgbm
+import xgboost
+import catboost
+from .model import get_model
+
+N_ESTIMATORS = 100 # boosting rounds of every model, the LGBMRegressor default
+
+class ModelEngine:
+    """
+    Common interface of the gradient boosting backends.
+    Cross-validation trains native models on native datasets built once per fold and binning setting,
+    while full-data refits go through get_model and return the sklearn regressor.
+    """
+
+    name = None
+    # name of the parameter controlling how features are binned, datasets are cached per value
+    binning_param = None
+    # whether get_iteration_callback can report the validation AUC after every boosting iteration
+    reports_iterations = False
+    # file name of a saved model, in the native format of the backend
+    model_file = None
+
+    def suggest_params(self, trial):
+        """
+        Sample the tuned parameters of a trial.
+
+        Parameters:
+            trial (optuna.Trial): Optuna trial object.
+
+        Returns:
+            dict: Tuned parameters.
+        """
+        raise NotImplementedError
+
+    def get_params(self, tuned_params, num_threads=0):
+        """
+        Complete tuned parameters with the fixed parameters of the backend.
+
+        Parameters:
+            tuned_params (dict): Parameters sampled by suggest_params, e.g. study.best_params.
+            num_threads (int): Number of threads, 0 uses all cores.
+
+        Returns:
+            dict: Parameters accepted by both the native training API and get_model.
+        """
+        raise NotImplementedError
+
+    def build_datasets(self, X_trn, y_trn, X_val, y_val, params, feature_names=None):
+        """
+        Build the native training and validation datasets of a fold, binned with the same boundaries.
+
+        Returns:
+            tuple: (training dataset, validation dataset).
+        """
+        raise NotImplementedError
+
+    def train(self, params, train_set, valid_set, num_boost_round, early_stopping_rounds=None, callbacks=None):
+        """
+        Train a native model on a fold, evaluating the validation dataset for early stopping and callbacks.
+
+        Returns:
+            Native model.
+        """
+        raise NotImplementedError
+
+    def get_iteration_callback(self, report):
+        """
+        Create a callback calling report(iteration, validation AUC) after every boosting iteration.
+
+        Returns:
+            Native callback, or None if the backend cannot report iterations.
+        """
+        return None
+
+    def fit(self, params, X_train, y_train, num_boost_round=N_ESTIMATORS):
+        """
+        Refit the sklearn regressor of get_model on the full training data.
+
+        Returns:
+            Fitted sklearn regressor.
+        """
+        model = get_model(self.get_sklearn_params(params, num_boost_round), self.name)
+        model.fit(X_train, y_train)
+        return model
+
+    def get_sklearn_params(self, params, num_boost_round):
+        return dict(params, n_estimators=num_boost_round)
+
+    def predict(self, model, X):
+        """
+        Predict with a native model or a fitted sklearn regressor, up to the best iteration when early stopped.
+        """
+        return model.predict(X)
+
+    def save_model(self, model, model_file):
+        """
+        Save a native model or a fitted sklearn regressor in the native format of the backend.
+        """
+        raise NotImplementedError
+
+    def load_model(self, model_file):
+        """
+        Load a model saved by save_model, predict works on it like on the fitted regressor.
+        """
+        raise NotImplementedError
+
+    def importance(self, model, importance_type="split"):
+        """
+        Feature importance of a native model or a fitted sklearn regressor.
+
+        Parameters:
+            model: Fitted model.
+            importance_type (str): "split" (number of splits using the feature) or "gain" (total gain of these splits).
+
+        Returns:
+            np.ndarray: Importance of every feature, in column order.
+        """
+        raise NotImplementedError
+
+
+class LightGBMEngine(ModelEngine):
+
+    name = "lightgbm"
+    binning_param = "max_bin"
+    reports_iterations = True
+    model_file = "model.txt"
+
+    def suggest_params(self, trial):
+        return {
+            'learning_rate': trial.suggest_categorical('learning_rate', [0.00001,0.00005, 0.001,0.0005, 0.01,0.05,0.1,0.5,1]),
+            'lambda_l1': trial.suggest_float('lambda_l1', 1e-8, 10.0),
+            'lambda_l2': trial.suggest_float('lambda_l2', 1e-8, 10.0),
+
+            'max_bin': trial.suggest_int('max_bin', 2, 100),
+            'max_depth': trial.suggest_int('max_depth', 2, 100),
+            'min_data_in_leaf': trial.suggest_int('min_data_in_leaf', 2, 100),
+            'min_child_samples': trial.suggest_int('min_child_samples', 2, 100),
+            'num_leaves': trial.suggest_int('num_leaves', 2, 100),
+
+            'feature_fraction': trial.suggest_float('feature_fraction', 0.1, 1.0),
+            'bagging_fraction': trial.suggest_float('bagging_fraction', 0.1, 1.0),
+            'bagging_freq': trial.suggest_int('bagging_freq', 0, 15),
+            'min_child_samples': trial.suggest_int('min_child_samples', 1, 100),
+        }
+
+    def get_params(self, tuned_params, num_threads=0):
+        return {
+            "objective": "regression",
+            "metric": "auc",
+            "verbosity": -1,
+            "boosting_type": "gbdt",
+            "seed": 42,
+            'is_unbalance': True,
+            "num_threads": num_threads,
+            **tuned_params,
+        }
+
+    def build_datasets(self, X_trn, y_trn, X_val, y_val, params, feature_names=None):
+        # feature_pre_filter is disabled since min_data_in_leaf changes between the trials reusing a dataset
+        dataset_params = {"max_bin": params["max_bin"], "feature_pre_filter": False, "verbosity": -1}
+        train_set = lightgbm.Dataset(X_trn, y_trn, feature_name=feature_names or "auto", params=dataset_params).construct()
+        valid_set = lightgbm.Dataset(X_val, y_val, reference=train_set, params=dataset_params).construct()
+        return train_set, valid_set
+
+    def train(self, params, train_set, valid_set, num_boost_round, early_stopping_rounds=None, callbacks=None):
+        callbacks = list(callbacks or [])
+        if early_stopping_rounds:
+            callbacks.append(lightgbm.early_stopping(early_stopping_rounds, first_metric_only=True, verbose=False))
+        return lightgbm.train(params, train_set, num_boost_round=num_boost_round,
+                              valid_sets=[valid_set] if callbacks else None, callbacks=callbacks)
+
+    def get_iteration_callback(self, report):
+        def callback(env):
+            for _, metric, value, _ in env.evaluation_result_list:
+                if metric == "auc":
+                    report(env.iteration, value)
+        return callback
+
+    def predict(self, model, X):
+        if isinstance(model, lightgbm.Booster):
+            return model.predict(X, num_iteration=model.best_iteration or None)
+        return model.predict(X)
+
+    def save_model(self, model, model_file):
+        booster = model if isinstance(model, lightgbm.Booster) else model.booster_
+        booster.save_model(str(model_file))
+
+    def load_model(self, model_file):
+        return lightgbm.Booster(model_file=str(model_file))
+
+    def importance(self, model, importance_type="split"):
+        booster = model if isinstance(model, lightgbm.Booster) else model.booster_
+        return booster.feature_importance(importance_type=importance_type)
+
+
+class XGBoostEngine(ModelEngine):
+
+    name = "xgboost"
+    binning_param = "max_bin"
+    reports_iterations = True
+    model_file = "model.json"
+
+    def suggest_params(self, trial):
+        return {
+            'learning_rate': trial.suggest_categorical('learning_rate', [0.00001,0.00005, 0.001,0.0005, 0.01,0.05,0.1,0.5,1]),
+            'reg_alpha': trial.suggest_float('reg_alpha', 1e-8, 10.0),
+            'reg_lambda': trial.suggest_float('reg_lambda', 1e-8, 10.0),
+
+            'max_bin': trial.suggest_int('max_bin', 16, 256),
+            'max_depth': trial.suggest_int('max_depth', 2, 12),
+            'min_child_weight': trial.suggest_float('min_child_weight', 1e-3, 20.0, log=True),
+            'gamma': trial.suggest_float('gamma', 1e-8, 1.0, log=True),
+
+            'subsample': trial.suggest_float('subsample', 0.1, 1.0),
+            'colsample_bytree': trial.suggest_float('colsample_bytree', 0.1, 1.0),
+        }
+
+    def get_params(self, tuned_params, num_threads=0):
+        # hist is the fastest CPU tree method and the one QuantileDMatrix is built for
+        return {
+            "objective": "reg:squarederror",
+            "eval_metric": "auc",
+            "tree_method": "hist",
+            "seed": 42,
+            "verbosity": 0,
+            "nthread": num_threads or None,
+            **tuned_params,
+        }
+
+    def build_datasets(self, X_trn, y_trn, X_val, y_val, params, feature_names=None):
+        train_set = xgboost.QuantileDMatrix(X_trn, y_trn, max_bin=params["max_bin"], feature_names=feature_names)
+        valid_set = xgboost.QuantileDMatrix(X_val, y_val, ref=train_set, max_bin=params["max_bin"], feature_names=feature_names)
+        return train_set, valid_set
+
+    def train(self, params, train_set, valid_set, num_boost_round, early_stopping_rounds=None, callbacks=None):
+        callbacks = list(callbacks or [])
+        evals = [(valid_set, "valid")] if callbacks or early_stopping_rounds else ()
+        return xgboost.train(params, train_set, num_boost_round=num_boost_round, evals=evals,
+                             early_stopping_rounds=early_stopping_rounds or None, callbacks=callbacks, verbose_eval=False)
+
+    def get_iteration_callback(self, report):
+        class IterationCallback(xgboost.callback.TrainingCallback):
+            def after_iteration(self, model, epoch, evals_log):
+                report(epoch, evals_log["valid"]["auc"][-1])
+                return False
+        return IterationCallback()
+
+    def get_sklearn_params(self, params, num_boost_round):
+        params = dict(params, n_estimators=num_boost_round)
+        params["n_jobs"] = params.pop("nthread")
+        return params
+
+    def predict(self, model, X):
+        if isinstance(model, xgboost.Booster):
+            # best_iteration only exists when the model was early stopped
+            iteration_range = (0, model.best_iteration + 1) if "best_iteration" in model.attributes() else (0, 0)
+            return model.inplace_predict(X, iteration_range=iteration_range)
+        return model.predict(X)
+
+    def save_model(self, model, model_file):
+        booster = model if isinstance(model, xgboost.Booster) else model.get_booster()
+        booster.save_model(str(model_file))
+
+    def load_model(self, model_file):
+        booster = xgboost.Booster()
+        booster.load_model(str(model_file))
+        return booster
+
+    def importance(self, model, importance_type="split"):
+        booster = model if isinstance(model, xgboost.Booster) else model.get_booster()
+        scores = booster.get_score(importance_type={"split": "weight", "gain": "total_gain"}[importance_type])
+        feature_names = booster.feature_names or ["f%d" % i for i in range(booster.num_features())]
+        return np.array([scores.get(feature, 0) for feature in feature_names])
+
+
+class CatBoostEngine(ModelEngine):
+
+    name = "catboost"
+    binning_param = "border_count"
+    reports_iterations = False
+    model_file = "model.cbm"
+
+    def suggest_params(self, trial):
+        return {
+            'learning_rate': trial.suggest_categorical('learning_rate', [0.00001,0.00005, 0.001,0.0005, 0.01,0.05,0.1,0.5,1]),
+            'l2_leaf_reg': trial.suggest_float('l2_leaf_reg', 1e-3, 10.0, log=True),
+
+            'border_count': trial.suggest_int('border_count', 16, 254),
+            'depth': trial.suggest_int('depth', 2, 10),
+            'min_data_in_leaf': trial.suggest_int('min_data_in_leaf', 1, 100),
+
+            'rsm': trial.suggest_float('rsm', 0.1, 1.0),
+            'subsample': trial.suggest_float('subsample', 0.1, 1.0),
+        }
+
+    def get_params(self, tuned_params, num_threads=0):
+        return {
+            "loss_function": "RMSE",
+            "eval_metric": "AUC",
+            "bootstrap_type": "Bernoulli",
+            # Depthwise honours min_data_in_leaf, the default symmetric trees ignore it
+            "grow_policy": "Depthwise",
+            "random_seed": 42,
+            "verbose": False,
+            "allow_writing_files": False,
+            "thread_count": num_threads or -1,
+            **tuned_params,
+        }
+
+    def build_datasets(self, X_trn, y_trn, X_val, y_val, params, feature_names=None):
+        # quantize the training pool once, the validation pool is binned with its borders when training
+        train_set = catboost.Pool(X_trn, y_trn, feature_names=feature_names)
+        train_set.quantize(border_count=params["border_count"])
+        valid_set = catboost.Pool(X_val, y_val, feature_names=feature_names)
+        return train_set, valid_set
+
+    def train(self, params, train_set, valid_set, num_boost_round, early_stopping_rounds=None, callbacks=None):
+        # border_count is already applied by the quantized pool
+        params = {key: value for key, value in params.items() if key != "border_count"}
+        model = get_model(dict(params, iterations=num_boost_round), self.name)
+        model.fit(train_set, eval_set=valid_set, early_stopping_rounds=early_stopping_rounds or None, use_best_model=bool(early_stopping_rounds))
+        return model
+
+    def get_sklearn_params(self, params, num_boost_round):
+        return dict(params, iterations=num_boost_round)
+
+    def save_model(self, model, model_file):
+        model.save_model(str(model_file))
+
+    def load_model(self, model_file):
+        return catboost.CatBoostRegressor().load_model(str(model_file))
+
+    def importance(self, model, importance_type="split"):
+        # catboost has no split counts, PredictionValuesChange is used for both importance types
+        return model.get_feature_importance(type="PredictionValuesChange")
+
+
+ENGINES = {engine.name: engine for engine in [LightGBMEngine(), XGBoostEngine(), CatBoostEngine()]}
+
+
+class FoldEnsemble:
+    """
+    Models of the cross-validation folds of a trial, predicting the mean of their predictions.
+    Engines predict with it like with a fitted sklearn regressor.
+    """
+
+    def __init__(self, engine, models):
+        self.engine = engine
+        self.models = list(models)
+
+    def predict(self, X):
+        return np.mean([self.engine.predict(model, X) for model in self.models], axis=0)
+
+
+def get_engine(model_name):
+    """
+    Return the engine of a backend.
+
+    Parameters:
+        model_name (str): Name of the backend ("lightgbm", "catboost", or "xgboost").
+
+    Returns:
+        ModelEngine: Engine of the backend.
+    """
+    if model_name not in ENGINES:
+        raise ValueError(f"model_name must be one of {list(ENGINES)}, got {model_name}")
+    return ENGINES[model_name]
+
+
+def save_model(model, model_name, feature_names, model_path):
+    """
+    Save a fitted model with what is needed to score new data: its backend and the feature columns it was trained on.
+
+    Parameters:
+        model: Native model, fitted sklearn regressor or FoldEnsemble, whose fold models are saved one file each.
+        model_name (str): Backend of the model ("lightgbm", "catboost", or "xgboost").
+        feature_names (list): Feature columns of the model, in training order.
+        model_path (pathlib.Path): Directory of the saved model.
+    """
+    engine = get_engine(model_name)
+    model_path = Path(model_path)
+    model_path.mkdir(parents=True, exist_ok=True)
+    model_info = {"model_name": model_name, "feature_names": list(feature_names)}
+    if isinstance(model, FoldEnsemble):
+        for fold, fold_model in enumerate(model.models):
+            engine.save_model(fold_model, model_path / ("fold_%d_%s" % (fold, engine.model_file)))
+        model_info["n_folds"] = len(model.models)
+    else:
+        engine.save_model(model, model_path / engine.model_file)
+    with open(model_path / "model_info.json", "w") as f:
+        json.dump(model_info, f)
+
+
+def load_model(model_path):
+    """
+    Load a model saved by save_model.
+
+    Parameters:
+        model_path (pathlib.Path): Directory of the saved model.
+
+    Returns:
+        tuple: (engine, native model or FoldEnsemble, model info with model_name and feature_names).
+    """
+    model_path = Path(model_path)
+    with open(model_path / "model_info.json") as f:
+        model_info = json.load(f)
+    engine = get_engine(model_info["model_name"])
+    if "n_folds" in model_info:
+        fold_models = [engine.load_model(model_path / ("fold_%d_%s" % (fold, engine.model_file))) for fold in range(model_info["n_folds"])]
+        return engine, FoldEnsemble(engine, fold_models), model_info
+    return engine, engine.load_model(model_path / engine.model_file), model_info
@@ -0,0 +1,46 @@
+import os
+from pathlib import Path
+from datasets import *
+from utils import *
+import warnings
+import argparse
+# Ignore all warnings
+warnings.filterwarnings("ignore")
+
+CHUNK_SIZE = 10000
+
+
+def parse_args():
+    """
+    Parse command line arguments of the scorer.
+    """
+    parser = argparse.ArgumentParser(description="Score account ids with a model saved by main.py")
+    parser.add_argument("--model-path", type=Path, required=True, help="model directory of a run, e.g. results/<run>/model")
+    parser.add_argument("--root-path", type=Path, default=Path(os.getcwd()), help="repository root containing data/")
+    parser.add_argument("--input", default="-", help="csv file of account ids (ID or account.id column), - for stdin")
+    parser.add_argument("--output", default="-", help="csv file of the predictions, - for stdout")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="number of accounts scored at a time")
+    parser.add_argument("--incremental", action="store_true", help="update the subscription state with new rows first, see main.py")
+    parser.add_argument("--stream-chunk-size", type=int, default=None, help="stream the subscriptions and tickets in chunks, see main.py")
+    return parser.parse_args()
+
+
+def main(args):
+    """
+    Build the engineered tables of the raw data once, then score the streamed account ids chunk by chunk.
+
+    Parameters:
+        args (argparse.Namespace): Command line arguments, see parse_args.
+    """
+    # log to stderr only, stdout may carry the predictions
+    logger = common_utils.create_logger()
+    data_path = args.root_path / "data"
+    tables = None if args.stream_chunk_size is None else [name for name in RAW_TABLES if name not in STREAMED_TABLES]
+    raw_data = load_data(data_path, cache_path = data_path / ".cache", tables = tables, logger = logger)
+    feature_tables = get_feature_tables(raw_data, cache_path = data_path / ".cache", incremental = args.incremental, logger = logger,
+                                        data_path = data_path, chunk_size = args.stream_chunk_size)
+    score_stream(args.model_path, feature_tables, args.input, args.output, chunk_size = args.chunk_size, logger = logger)
+
+
+if __name__ == "__main__":
+    main(parse_args())
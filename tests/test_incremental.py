@@ -0,0 +1,93 @@
+"""
+The incremental and chunked subscription pipelines must match engineer_subscription on the whole tables exactly.
+Run with: python -m pytest tests
+"""
+import logging
+import numpy as np
+import pandas as pd
+import pytest
+import sys
+sys.path.append(".")
+from benchmarks.synthetic import make_ids, make_zipcodes, make_concerts, make_subscriptions, make_tickets
+from datasets import (get_city_centroids, engineer_subscription, engineer_subscription_incremental, engineer_subscription_chunked,
+                      create_feature_state, update_feature_state, get_state_sub_info, load_feature_state)
+
+N_SUBSCRIPTIONS = 3000
+N_TICKETS = 600
+# uneven row counts of the appended batches, some batches only bring subscriptions or only tickets
+SUBSCRIPTION_BATCHES = [1200, 0, 700, 300, 800]
+TICKET_BATCHES = [100, 250, 0, 150, 100]
+
+
+@pytest.fixture(scope="module")
+def tables():
+    """
+    Small synthetic tables, accounts both subscribe and buy tickets so that the two tables update the same accounts.
+    """
+    rng = np.random.default_rng(0)
+    concerts, concerts1415 = make_concerts(rng)
+    account_ids = make_ids("test", 400)
+    return {
+        "subscriptions": make_subscriptions(rng, account_ids[:300], N_SUBSCRIPTIONS),
+        "tickets": make_tickets(rng, account_ids[200:], N_TICKETS),
+        "city_centroids": get_city_centroids(make_zipcodes(rng, 2000)),
+        "concerts": concerts,
+        "concerts1415": concerts1415,
+    }
+
+
+def get_batch_ends(batches):
+    return np.cumsum(batches)
+
+
+def get_expected(tables, n_subscriptions, n_tickets):
+    return engineer_subscription(tables["subscriptions"].iloc[:n_subscriptions], tables["tickets"].iloc[:n_tickets],
+                                 tables["city_centroids"], tables["concerts"], tables["concerts1415"])
+
+
+def test_update_feature_state_matches_full_rebuild(tables):
+    state = create_feature_state(tables["city_centroids"], tables["concerts"], tables["concerts1415"])
+    n_subscriptions, n_tickets = 0, 0
+    for subscription_end, ticket_end in zip(get_batch_ends(SUBSCRIPTION_BATCHES), get_batch_ends(TICKET_BATCHES)):
+        update_feature_state(state, tables["subscriptions"].iloc[n_subscriptions:subscription_end],
+                             tables["tickets"].iloc[n_tickets:ticket_end])
+        n_subscriptions, n_tickets = subscription_end, ticket_end
+        pd.testing.assert_frame_equal(get_state_sub_info(state), get_expected(tables, n_subscriptions, n_tickets), check_exact=True)
+
+
+def test_incremental_state_round_trip(tables, tmp_path, caplog):
+    state_path = tmp_path / "subscription_state.pkl"
+    logger = logging.getLogger("test_incremental")
+    lookups = tables["city_centroids"], tables["concerts"], tables["concerts1415"]
+    with caplog.at_level(logging.INFO, logger="test_incremental"):
+        for subscription_end, ticket_end in zip(get_batch_ends(SUBSCRIPTION_BATCHES), get_batch_ends(TICKET_BATCHES)):
+            sub_info = engineer_subscription_incremental(state_path, tables["subscriptions"].iloc[:subscription_end],
+                                                         tables["tickets"].iloc[:ticket_end], *lookups, logger=logger)
+            pd.testing.assert_frame_equal(sub_info, get_expected(tables, subscription_end, ticket_end), check_exact=True)
+
+            # the saved state is loaded back by the next batch
+            state = load_feature_state(state_path)
+            assert (state["n_subscriptions"], state["n_tickets"]) == (subscription_end, ticket_end)
+    # the state is only built by the first batch, the other ones fold their new rows into the saved state
+    assert sum(record.getMessage() == "Feature state rebuilt from scratch" for record in caplog.records) == 1
+
+
+def test_incremental_state_rebuilt_when_seen_rows_change(tables, tmp_path):
+    state_path = tmp_path / "subscription_state.pkl"
+    lookups = tables["city_centroids"], tables["concerts"], tables["concerts1415"]
+    engineer_subscription_incremental(state_path, tables["subscriptions"].iloc[:1000], tables["tickets"].iloc[:200], *lookups)
+
+    subscriptions = tables["subscriptions"].copy()
+    subscriptions.loc[0, "no.seats"] += 1
+    sub_info = engineer_subscription_incremental(state_path, subscriptions, tables["tickets"], *lookups)
+    pd.testing.assert_frame_equal(sub_info, engineer_subscription(subscriptions, tables["tickets"], *lookups), check_exact=True)
+
+
+@pytest.mark.parametrize("chunk_size", [250, 1000, N_SUBSCRIPTIONS])
+def test_chunked_matches_full_rebuild(tables, chunk_size):
+    def get_chunks(df):
+        return (df.iloc[start:start + chunk_size] for start in range(0, len(df), chunk_size))
+
+    sub_info = engineer_subscription_chunked(get_chunks(tables["subscriptions"]), get_chunks(tables["tickets"]),
+                                             tables["city_centroids"], tables["concerts"], tables["concerts1415"])
+    pd.testing.assert_frame_equal(sub_info, get_expected(tables, N_SUBSCRIPTIONS, N_TICKETS), check_exact=True)
@@ -1,4 +1,10 @@
 from .feature_selection import *
 from .test import *
 from .train import *
-from .common_utils import *
\ No newline at end of file
+from .common_utils import *
+from .profiling import *
+from .artifacts import *
+from .ensemble import *
+from .metrics import *
+from .stage_graph import *
+from .trial_cache import *
\ No newline at end of file
@@ -0,0 +1,113 @@
+from concurrent.futures import ThreadPoolExecutor
+import atexit
+import json
+import threading
+from pathlib import Path
+from datasets.stage_cache import write_atomic
+from .profiling import timer
+
+# binary format written next to every csv file, compact and typed
+BINARY_FORMAT = "parquet"
+
+
+class ArtifactWriter:
+    """
+    Write the artifacts of a run (tables, json files and plots) on a background thread, so that the next stage starts
+    while they are serialized and rendered.
+    a. Every file is written atomically, tables as csv and as BINARY_FORMAT.
+    b. close waits for every pending artifact, then writes artifacts.json listing them, complete once every artifact was
+       written. A writer that was not closed, e.g. after a failed stage, is flushed when the interpreter exits and its
+       artifacts.json is not complete.
+    c. In headless mode, plots are skipped.
+    Submitted data must not be modified afterwards, it is written as it is when the writer gets to it.
+    """
+
+    def __init__(self, output_path, headless=False, background=True, logger=None):
+        """
+        Parameters:
+            output_path (pathlib.Path): Directory of the artifacts.
+            headless (bool): Skip plots.
+            background (bool): Write on a background thread, otherwise artifacts are written when submitted.
+            logger (logging.Logger, optional): Logger reporting failed artifacts.
+        """
+        self.output_path = Path(output_path)
+        self.headless = headless
+        self.logger = logger
+        self.artifacts = []
+        self._futures = []
+        self._lock = threading.Lock()
+        # a single worker writes artifacts in submission order, and keeps matplotlib on one thread
+        self._executor = ThreadPoolExecutor(max_workers = 1, thread_name_prefix = "artifact-writer") if background else None
+        if background:
+            atexit.register(self.close, raise_errors = False, at_exit = True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # artifacts submitted before a failure are still flushed, without hiding the failure
+        self.close(raise_errors = exc_type is None)
+
+    def _submit(self, name, write):
+        def run():
+            with timer("artifacts/" + name):
+                write_atomic(self.output_path / name, write)
+            with self._lock:
+                self.artifacts.append(name)
+        if self._executor is None:
+            run()
+        else:
+            self._futures.append(self._executor.submit(run))
+
+    def write_frame(self, df, name, binary=True):
+        """
+        Write a DataFrame as name.csv and, unless binary is False, as name.parquet.
+        """
+        self._submit(name + ".csv", lambda path: df.to_csv(path, index = False))
+        if binary:
+            self._submit(name + "." + BINARY_FORMAT, lambda path: df.to_parquet(path, index = False))
+
+    def write_json(self, data, name):
+        """
+        Write json serializable data as name.
+        """
+        def write(path):
+            with open(path, "w") as f:
+                json.dump(data, f)
+        self._submit(name, write)
+
+    def plot(self, plot_func, name, *args):
+        """
+        Render a figure with plot_func(figure, *args) and save it as name, skipped in headless mode.
+        Figures are created without pyplot, so rendering off the main thread leaves its global state alone.
+        """
+        if self.headless:
+            return
+        def write(path):
+            from matplotlib.figure import Figure
+            figure = Figure()
+            plot_func(figure, *args)
+            # the temporary file has no image extension
+            figure.savefig(path, format = Path(name).suffix[1:])
+        self._submit(name, write)
+
+    def close(self, raise_errors=True, at_exit=False):
+        """
+        Wait for every pending artifact and write artifacts.json. The first error of an artifact is raised after all
+        the others were written.
+        """
+        errors = []
+        for future in self._futures:
+            error = future.exception()
+            if error is not None:
+                errors.append(error)
+                if self.logger is not None:
+                    self.logger.error(f"failed to write an artifact: {error!r}")
+        self._futures = []
+        if self._executor is not None:
+            self._executor.shutdown()
+            atexit.unregister(self.close)
+        write_atomic(self.output_path / "artifacts.json",
+                     lambda path: path.write_text(json.dumps({"artifacts": sorted(self.artifacts), "complete": not errors and not at_exit}, indent = 2)))
+        if errors and raise_errors:
+            raise errors[0]
@@ -42,9 +42,26 @@ def load_json(filename):
 
 def print_study(study, logger):
     logger.info(f'Number of finished trials: {len(study.trials)} ')
+    print_pruning(study, logger)
     logger.info('Best trial:')
     trial = study.best_trial
     logger.info(f'  Value: {trial.value}')
     logger.info(f'  Params: ')
     for key, value in trial.params.items():
-        logger.info(f'    {key}: {value}')
\ No newline at end of file
+        logger.info(f'    {key}: {value}')
+
+
+def print_pruning(study, logger):
+    """
+    Log how many trials were pruned and the wall-clock time pruning saved,
+    estimated from the mean duration of the trials that ran to completion.
+    """
+    complete = [trial.duration.total_seconds() for trial in study.trials if trial.state.name == "COMPLETE" and trial.duration]
+    pruned = [trial.duration.total_seconds() for trial in study.trials if trial.state.name == "PRUNED" and trial.duration]
+    if not pruned:
+        return
+    logger.info(f'Pruned trials: {len(pruned)} ')
+    if complete:
+        saved = len(pruned) * sum(complete) / len(complete) - sum(pruned)
+        logger.info(f'  Mean duration of complete / pruned trials: {sum(complete) / len(complete):.2f}s / {sum(pruned) / len(pruned):.2f}s')
+        logger.info(f'  Estimated wall-clock time saved by pruning: {saved:.2f}s')
@@ -0,0 +1,204 @@
+from models import get_engine, get_model, save_model, FoldEnsemble, N_ESTIMATORS
+from datasets import save_category_encoders
+from .train import get_folds, get_dataset_key, get_fold_datasets
+from .profiling import timer
+from .artifacts import write_atomic
+from .metrics import batched_roc_auc, get_validation_masks
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+from scipy.stats import rankdata
+
+STACK_METHODS = ("blend", "stack")
+# small level-2 models, they only combine a handful of prediction columns
+META_MODEL_PARAMS = {
+    "lightgbm": {"n_estimators": 100, "learning_rate": 0.05, "num_leaves": 4, "min_child_samples": 50, "verbosity": -1},
+    "xgboost": {"n_estimators": 100, "learning_rate": 0.05, "max_depth": 2},
+    "catboost": {"iterations": 100, "learning_rate": 0.05, "depth": 2, "verbose": 0},
+}
+
+
+def get_ids_fingerprint(ids):
+    """
+    Fingerprint of an ordered column of account ids, predictions of several runs are only combined on the same rows.
+    """
+    return hashlib.sha1("\n".join(map(str, ids)).encode()).hexdigest()
+
+
+def fit_cv_ensemble(params, X_train, y_train, X_test, folds=None, model_name="lightgbm", n_fold_jobs=None, early_stopping_rounds=None):
+    """
+    Fit the model of every cross-validation fold with fixed parameters, e.g. those of the best trial, concurrently.
+    The folds and binned datasets are the ones of the study, so the fold models are the ones of the trial.
+
+    Parameters:
+        params (dict): Model parameters, see engine.get_params.
+        X_train (pd.DataFrame): Training feature dataset.
+        y_train (pd.Series): Training target variable.
+        X_test (pd.DataFrame): Testing feature dataset.
+        folds (list, optional): (train indices, validation indices) of each fold, computed from y_train if not provided.
+        model_name (str): Backend of the model ("lightgbm", "catboost", or "xgboost").
+        n_fold_jobs (int, optional): Number of folds trained concurrently, defaults to one per fold bounded by the cpu count.
+        early_stopping_rounds (int, optional): Stop boosting a fold once its validation AUC did not improve for this many rounds.
+
+    Returns:
+        tuple: (FoldEnsemble of the fold models, out-of-fold predictions, test predictions of every fold as columns).
+    """
+    engine = get_engine(model_name)
+    folds = get_folds(y_train) if folds is None else folds
+    feature_names = list(X_train.columns)
+    X_values, y_values = X_train.values.astype(np.float64), y_train.values.astype(np.float64)
+    dataset_key = get_dataset_key(X_values, feature_names)
+
+    def fit(fold, trn_idx, val_idx):
+        with timer("ensemble/fold"):
+            train_set, valid_set = get_fold_datasets(engine, X_values, y_values, fold, trn_idx, val_idx, params, dataset_key, feature_names)
+            model = engine.train(params, train_set, valid_set, N_ESTIMATORS, early_stopping_rounds)
+            # testing data is predicted as the scorer does, from the DataFrame
+            return model, engine.predict(model, X_values[val_idx]), engine.predict(model, X_test[feature_names])
+
+    n_fold_jobs = n_fold_jobs or min(len(folds), os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers = n_fold_jobs) as executor:
+        results = list(executor.map(lambda fold: fit(fold[0], *fold[1]), enumerate(folds)))
+
+    oof_pred = np.zeros(len(y_values))
+    for (_, val_idx), (_, val_pred, _) in zip(folds, results):
+        oof_pred[val_idx] = val_pred
+    test_pred = np.column_stack([test_pred for _, _, test_pred in results])
+    return FoldEnsemble(engine, [model for model, _, _ in results]), oof_pred, test_pred
+
+
+def save_predictions(prediction_path, model_name, oof_pred, test_pred, train_ids, test_ids, oof_auc):
+    """
+    Save the out-of-fold and test predictions of a model as .npy arrays, memory-mapped when loaded,
+    with a json file of their AUC and the fingerprints of their rows.
+
+    Parameters:
+        prediction_path (pathlib.Path): Directory of the predictions.
+        model_name (str): Backend of the model, the name of its files.
+        oof_pred (np.ndarray): Out-of-fold predictions of the training accounts.
+        test_pred (np.ndarray): Test predictions, one column per fold.
+        train_ids (pd.Series): account.id of the training rows.
+        test_ids (pd.Series): ID of the testing rows.
+        oof_auc (float): AUC of the out-of-fold predictions.
+    """
+    prediction_path = Path(prediction_path)
+    prediction_path.mkdir(parents = True, exist_ok = True)
+    for name, pred in [("oof", oof_pred), ("test", test_pred)]:
+        def write(path):
+            array = np.lib.format.open_memmap(path, mode = "w+", dtype = np.float64, shape = pred.shape)
+            array[:] = pred
+            array.flush()
+        write_atomic(prediction_path / ("%s_%s.npy" % (name, model_name)), write)
+    info = {"model_name": model_name, "oof_auc": oof_auc, "n_folds": test_pred.shape[1],
+            "train_ids": get_ids_fingerprint(train_ids), "test_ids": get_ids_fingerprint(test_ids)}
+    write_atomic(prediction_path / ("%s.json" % model_name), lambda path: path.write_text(json.dumps(info)))
+
+
+def load_predictions(prediction_path):
+    """
+    Load every model saved by save_predictions in a directory, with memory-mapped arrays.
+
+    Returns:
+        list: (info, out-of-fold predictions, test predictions) of every model.
+    """
+    predictions = []
+    for info_file in sorted(Path(prediction_path).glob("*.json")):
+        info = json.loads(info_file.read_text())
+        predictions.append((info, np.load(info_file.with_name("oof_%s.npy" % info["model_name"]), mmap_mode = "r"),
+                            np.load(info_file.with_name("test_%s.npy" % info["model_name"]), mmap_mode = "r")))
+    return predictions
+
+
+def stack_predictions(prediction_paths, y_train, method="blend", meta_model="lightgbm", folds=None, logger=None):
+    """
+    Combine the saved predictions of several models, e.g. the runs of every backend, without retraining them.
+    a. blend: mean of the normalized ranks of the predictions, the AUC only depends on ranks.
+    b. stack: level-2 model of get_model fitted on the out-of-fold predictions. Its own out-of-fold AUC is
+       measured on the folds, then it is refitted on all of them and predicts the mean test predictions of every model.
+
+    Parameters:
+        prediction_paths (list): Prediction directories of save_predictions.
+        y_train (pd.Series): Training target variable, in the order of the saved predictions.
+        method (str): One of STACK_METHODS.
+        meta_model (str): Backend of the level-2 model of the stack method, see META_MODEL_PARAMS.
+        folds (list, optional): (train indices, validation indices) of each fold, computed from y_train if not provided.
+        logger (logging.Logger, optional): Logger reporting the AUC of every model and of their combination.
+
+    Returns:
+        tuple: (out-of-fold AUC of the combination, test predictions).
+    """
+    if method not in STACK_METHODS:
+        raise ValueError(f"method must be one of {STACK_METHODS}, got {method}")
+    predictions = [prediction for prediction_path in prediction_paths for prediction in load_predictions(prediction_path)]
+    if not predictions:
+        raise ValueError(f"no saved predictions in {list(map(str, prediction_paths))}")
+    for info, _, _ in predictions:
+        if (info["train_ids"], info["test_ids"]) != (predictions[0][0]["train_ids"], predictions[0][0]["test_ids"]):
+            raise ValueError(f"predictions of {info['model_name']} were made on other accounts")
+        if logger is not None:
+            logger.info(f"{info['model_name']}: out-of-fold AUC {info['oof_auc']:.5f}")
+
+    y_values = np.asarray(y_train)
+    oof_matrix = np.column_stack([oof_pred for _, oof_pred, _ in predictions])
+    test_matrix = np.column_stack([np.mean(test_pred, axis = 1) for _, _, test_pred in predictions])
+
+    if method == "blend":
+        oof_stacked = np.mean([rankdata(column) / len(column) for column in oof_matrix.T], axis = 0)
+        test_stacked = np.mean([rankdata(column) / len(column) for column in test_matrix.T], axis = 0)
+    else:
+        folds = get_folds(y_values) if folds is None else folds
+        oof_stacked = np.zeros(len(y_values))
+        for trn_idx, val_idx in folds:
+            model = get_model(META_MODEL_PARAMS[meta_model], meta_model).fit(oof_matrix[trn_idx], y_values[trn_idx])
+            oof_stacked[val_idx] = model.predict(oof_matrix[val_idx])
+        test_stacked = get_model(META_MODEL_PARAMS[meta_model], meta_model).fit(oof_matrix, y_values).predict(test_matrix)
+
+    oof_auc = batched_roc_auc(y_values, oof_stacked)
+    if logger is not None:
+        logger.info(f"{method} of {len(predictions)} models: out-of-fold AUC {oof_auc:.5f}")
+    return oof_auc, test_stacked
+
+
+def generate_ensemble_prediction(study, test_df, submission_df, X_train, y_train, X_test, train_ids, prediction_path,
+                                 model_name="lightgbm", model_path=None, encoders=None, early_stopping_rounds=None, logger=None):
+    """
+    CV-ensemble alternative to generate_prediction, without a refit on the full data.
+    a. fit the fold models of the best trial of the study, see fit_cv_ensemble
+    b. save their out-of-fold and test predictions, see save_predictions
+    c. generate final predictions, the mean of the fold models
+    d. save the fold models and the categories encoding their features for the scorer, if model_path is given
+
+    Returns:
+        tuple: (submission DataFrame, out-of-fold AUC).
+    """
+    # folds run concurrently, the cores are split between them
+    engine = get_engine(model_name)
+    folds = get_folds(y_train)
+    n_fold_jobs = min(len(folds), os.cpu_count() or 1)
+    params = engine.get_params(study.best_params, max(1, (os.cpu_count() or 1) // n_fold_jobs))
+    ensemble, oof_pred, test_pred = fit_cv_ensemble(params, X_train, y_train, X_test, folds, model_name, n_fold_jobs, early_stopping_rounds)
+    oof_auc = batched_roc_auc(y_train.values, oof_pred)
+    if logger is not None:
+        # the mean fold AUC is the value of the trial, the out-of-fold AUC pools the folds
+        fold_auc = batched_roc_auc(y_train.values, oof_pred, get_validation_masks(folds, len(oof_pred))).mean()
+        logger.info(f"CV ensemble of {test_pred.shape[1]} folds: mean fold AUC {fold_auc:.5f}, out-of-fold AUC {oof_auc:.5f}")
+    save_predictions(prediction_path, model_name, oof_pred, test_pred, train_ids, test_df["ID"], oof_auc)
+
+    if model_path is not None:
+        save_model(ensemble, model_name, X_train.columns, model_path)
+        if encoders is not None:
+            save_category_encoders(encoders, model_path / "encoders.json")
+
+    return make_submission(test_df, submission_df, test_pred.mean(axis = 1)), oof_auc
+
+
+def make_submission(test_df, submission_df, pred):
+    """
+    Merge predictions of the testing accounts into the submission file.
+    """
+    pred_df = pd.concat([test_df, pd.DataFrame({"Predicted": pred})], axis = 1)
+    return pd.merge(submission_df.iloc[:,0], pred_df, how = "inner", on = "ID")
@@ -1,50 +1,185 @@
-from sklearn.metrics import roc_auc_score
-from lightgbm import LGBMRegressor
-import matplotlib.pyplot as plt
 from models import *
+from .train import get_folds, get_dataset_key, get_fold_datasets, fit_fold
+from .profiling import stage
+from .metrics import batched_roc_auc, bootstrap_roc_auc, get_validation_masks
+from .artifacts import ArtifactWriter
+from concurrent.futures import ThreadPoolExecutor
+import os
 import seaborn as sns
+import numpy as np
 import pandas as pd
-    
-def feature_selection(study, X_train, y_train, output_path):
-    
+
+N_PERMUTATION_REPEATS = 3 # shuffles of every feature on every validation split
+SUBSET_PATIENCE = 5 # subset sizes evaluated without improvement before the search stops
+SUBSET_BOOTSTRAP = 200 # resamples of the confidence intervals of the out-of-fold AUC of the subsets
+
+
+def get_fold_importance(params, X_train, y_train, fold, trn_idx, val_idx, early_stopping_rounds=None, dataset_key=None,
+                        feature_names=None, model_name="lightgbm", n_repeats=N_PERMUTATION_REPEATS):
+    """
+    Fit one cross-validation fold and measure the gain and permutation importance of every feature on it.
+    The permutation importance is the drop of the validation AUC when the values of a feature are shuffled.
+
+    Parameters:
+        params (dict): Model parameters.
+        X_train (np.ndarray): Training features.
+        y_train (np.ndarray): Training target.
+        fold (int): Index of the fold.
+        trn_idx (np.ndarray): Training indices of the fold.
+        val_idx (np.ndarray): Validation indices of the fold.
+        early_stopping_rounds (int, optional): Stop boosting once the validation AUC did not improve for this many rounds.
+        dataset_key (str, optional): Fingerprint of the features, reusing the datasets of the fold cached by the study.
+        feature_names (list, optional): Names of the feature columns.
+        model_name (str): Backend of the model.
+        n_repeats (int): Number of shuffles of every feature.
+
+    Returns:
+        tuple: (gain importance, permutation importance) of every feature, in column order.
+    """
+    engine = get_engine(model_name)
+    train_set, valid_set = get_fold_datasets(engine, X_train, y_train, fold, trn_idx, val_idx, params, dataset_key, feature_names)
+    model = engine.train(params, train_set, valid_set, N_ESTIMATORS, early_stopping_rounds)
+
+    # gain is normalized per fold, so that every fold weighs the same
+    gain = np.asarray(engine.importance(model, "gain"), dtype = np.float64)
+    gain = gain / gain.sum() if gain.sum() > 0 else gain
+
+    X_val, y_val = X_train[val_idx], y_train[val_idx]
+    rng = np.random.default_rng(fold)
+    pred = [engine.predict(model, X_val)]
+    for column in range(X_val.shape[1]):
+        # the repeats of a feature are predicted in a single call on stacked copies of the validation split
+        X_permuted = np.tile(X_val, (n_repeats, 1))
+        X_permuted[:, column] = np.concatenate([rng.permutation(X_val[:, column]) for _ in range(n_repeats)])
+        pred.append(engine.predict(model, X_permuted).reshape(n_repeats, len(val_idx)))
+
+    # the AUC of the unpermuted and of every permuted prediction, scored at once on the labels of the split
+    auc = batched_roc_auc(y_val, np.vstack(pred))
+    permutation = auc[0] - auc[1:].reshape(X_val.shape[1], n_repeats).mean(axis = 1)
+    return gain, permutation
+
+
+def cross_validate(params, X_train, y_train, folds, fold_executor, early_stopping_rounds=None, dataset_key=None,
+                   feature_names=None, model_name="lightgbm"):
+    """
+    Out-of-fold predictions of fixed parameters, with the folds trained concurrently on the fold executor.
+    """
+    futures = [fold_executor.submit(fit_fold, params, X_train, y_train, fold_, trn_idx, val_idx, early_stopping_rounds, None,
+                                    dataset_key, feature_names, model_name) for fold_, (trn_idx, val_idx) in enumerate(folds)]
+    oof_pred = np.zeros(len(y_train))
+    for (_, val_idx), future in zip(folds, futures):
+        oof_pred[val_idx] = future.result()
+    return oof_pred
+
+
+def select_subset_size(subset_scores, tolerance=0.0):
+    """
+    Smallest number of features whose CV AUC is within tolerance of the best evaluated one.
+    """
+    best_auc = subset_scores["auc"].max()
+    return int(subset_scores.loc[subset_scores["auc"] >= best_auc - tolerance, "n_features"].min())
+
+
+def plot_feature_importance(figure, final_importance):
+    """
+    Bar plot of the importance of every feature, drawn on a matplotlib figure.
+    """
+    figure.set_size_inches(14, 25)
+    sns.barplot(x="importance", y="feature", data=final_importance, ax=figure.subplots())
+    figure.tight_layout()
+
+
+def feature_selection(study, X_train, y_train, output_path, model_name="lightgbm", n_fold_jobs=None, early_stopping_rounds=None,
+                      n_repeats=N_PERMUTATION_REPEATS, patience=SUBSET_PATIENCE, tolerance=0.0, logger=None, artifact_writer=None):
     """
     Perform feature selection using the optimal model parameters obtained from Optuna.
+    a. Rank features by their permutation importance across the cross-validation folds, then by their gain importance.
+       Folds are trained concurrently on the binned datasets cached by the study.
+    b. Evaluate the CV AUC of the best parameters on the top ranked features, adding one feature at a time,
+       until patience sizes in a row did not improve the best AUC.
+    c. Keep the smallest subset within tolerance of the best AUC.
 
     Parameters:
         study (optuna.study.Study): Optuna study object containing optimization results.
         X_train (pd.DataFrame): Training feature dataset.
         y_train (pd.Series): Training target variable.
         output_path (pathlib.Path): Path to save the feature importance results.
+        model_name (str): Backend of the model ("lightgbm", "catboost", or "xgboost").
+        n_fold_jobs (int, optional): Number of folds trained concurrently, defaults to one per fold bounded by the cpu count.
+        early_stopping_rounds (int, optional): Stop boosting a fold once its validation AUC did not improve for this many rounds.
+        n_repeats (int): Number of shuffles of every feature for its permutation importance.
+        patience (int): Number of subset sizes evaluated without improvement before the search stops.
+        tolerance (float): CV AUC a smaller subset may lose against the best one.
+        logger (logging.Logger, optional): Logger reporting the selected subset.
+        artifact_writer (ArtifactWriter, optional): Writer of the importance tables and plot, they are written
+            synchronously to output_path without one.
 
     Returns:
-        final_importance (pd.DataFrame): DataFrame containing feature names and their importance scores.
-    """
-    
-    # get optimal hyperparameters
-    params = study.best_params   
-    params["objective"] = "regression"
-    params["seed"] = 42
-    params["metric"] = "auc"
-    params["boosting_type"] = "gbdt"
-    params['is_unbalance'] = True
-    
-    # retrain model on training datset 
-    model = get_model(params, "lightgbm") 
-    model.fit(X_train,y_train)
-    
-    # save feature_importance dataframe
-    feature_importance_df = pd.DataFrame()
-    feature_importance_df["feature"] = X_train.columns
-    feature_importance_df["importance"] = model.booster_.feature_importance()
-    final_importance = feature_importance_df.sort_values(by="importance", ascending=False)    
-    final_importance.reset_index(inplace=True)
-    final_importance.to_csv(output_path / "feature_importance.csv", index = False)
-    
+        tuple: (final_importance, selected_features, subset_scores), the DataFrame of the feature names and their
+            importance scores, the list of selected features, and the DataFrame of the CV AUC of every evaluated subset size.
+    """
+
+    artifact_writer = artifact_writer or ArtifactWriter(output_path, background = False)
+
+    # same folds, values and fingerprint as the study, so that its binned fold datasets are reused
+    engine = get_engine(model_name)
+    folds = get_folds(y_train)
+    n_fold_jobs = n_fold_jobs or min(len(folds), os.cpu_count() or 1)
+    params = engine.get_params(study.best_params, max(1, (os.cpu_count() or 1) // n_fold_jobs))
+    feature_names = list(X_train.columns)
+    X_values, y_values = X_train.values.astype(np.float64), y_train.values.astype(np.float64)
+    dataset_key = get_dataset_key(X_values, feature_names)
+
+    with ThreadPoolExecutor(max_workers = n_fold_jobs) as fold_executor:
+        with stage("importance"):
+            futures = [fold_executor.submit(get_fold_importance, params, X_values, y_values, fold_, trn_idx, val_idx, early_stopping_rounds,
+                                            dataset_key, feature_names, model_name, n_repeats) for fold_, (trn_idx, val_idx) in enumerate(folds)]
+            gain, permutation = zip(*[future.result() for future in futures])
+
+        # save feature_importance dataframe
+        feature_importance_df = pd.DataFrame()
+        feature_importance_df["feature"] = feature_names
+        feature_importance_df["importance"] = np.mean(permutation, axis = 0)
+        feature_importance_df["importance_std"] = np.std(permutation, axis = 0)
+        feature_importance_df["gain"] = np.mean(gain, axis = 0)
+        final_importance = feature_importance_df.sort_values(by=["importance", "gain"], ascending=False)
+        final_importance.reset_index(inplace=True)
+        artifact_writer.write_frame(final_importance, "feature_importance")
+
+        # grow the subset one ranked feature at a time with the best parameters, instead of a study per size
+        with stage("subset_sizes"):
+            order = final_importance["index"].values
+            validation_masks = get_validation_masks(folds, len(y_values))
+            subset_scores, subset_pred = [], []
+            for n_features in range(1, len(order) + 1):
+                X_subset = np.ascontiguousarray(X_values[:, order[:n_features]])
+                subset_names = [feature_names[column] for column in order[:n_features]]
+                # the fingerprint of the selected subset is the one of the next study, which reuses its datasets
+                oof_pred = cross_validate(params, X_subset, y_values, folds, fold_executor, early_stopping_rounds,
+                                          get_dataset_key(X_subset, subset_names), subset_names, model_name)
+                # mean fold AUC as in the objective, every fold scored from a single sort
+                auc = batched_roc_auc(y_values, oof_pred, validation_masks).mean()
+                subset_scores.append({"n_features": n_features, "auc": auc})
+                subset_pred.append(oof_pred)
+                if logger is not None:
+                    logger.info(f"top {n_features} features: CV AUC {auc:.5f}")
+                best_size = max(subset_scores, key = lambda score: score["auc"])["n_features"]
+                if n_features - best_size >= patience:
+                    break
+
+    # bootstrap intervals of the out-of-fold AUC of every subset, on the same resamples so that subsets compare
+    subset_scores = pd.DataFrame(subset_scores)
+    subset_scores["oof_auc"], subset_scores["oof_auc_lower"], subset_scores["oof_auc_upper"] = bootstrap_roc_auc(
+        y_values, np.vstack(subset_pred), n_bootstrap = SUBSET_BOOTSTRAP)
+    artifact_writer.write_frame(subset_scores, "feature_subsets")
+    threshold = select_subset_size(subset_scores, tolerance)
+    selected_features = list(final_importance["feature"].values[:threshold])
+    if logger is not None:
+        selected = subset_scores.iloc[threshold - 1]
+        logger.info(f"selected {threshold} features: {selected_features}, out-of-fold AUC {selected['oof_auc']:.5f} "
+                    f"(95% CI {selected['oof_auc_lower']:.5f}-{selected['oof_auc_upper']:.5f})")
+
     # show feature importance through bar plot
-    plt.figure(figsize=(14,25))
-    sns.barplot(x="importance",y="feature",data=final_importance)
-    plt.tight_layout()
-    plt.savefig(output_path / "feature_importance.png")
-    
-    return final_importance
+    artifact_writer.plot(plot_feature_importance, "feature_importance.png", final_importance)
 
+    return final_importance, selected_features, subset_scores
@@ -0,0 +1,121 @@
+import numpy as np
+
+N_BOOTSTRAP = 1000
+BOOTSTRAP_BATCH_SIZE = 100 # resamples scored at a time, bounds the memory to this many copies of the weights
+
+
+def sort_scores(y_true, y_score):
+    """
+    Sort every row of a prediction matrix once, for any number of AUC evaluations on the same labels and rows.
+
+    Parameters:
+        y_true (np.ndarray): Binary labels of the rows.
+        y_score (np.ndarray): Predictions, one row per model (or one vector for a single model).
+
+    Returns:
+        tuple: (order of the rows of every model, labels in that order, whether each sorted score starts a group of tied scores).
+    """
+    y_score = np.atleast_2d(np.asarray(y_score, dtype = np.float64))
+    order = np.argsort(y_score, axis = 1, kind = "stable")
+    sorted_scores = np.take_along_axis(y_score, order, axis = 1)
+    new_group = np.ones(sorted_scores.shape, dtype = bool)
+    new_group[:, 1:] = sorted_scores[:, 1:] != sorted_scores[:, :-1]
+    return order, np.asarray(y_true).astype(bool)[order], new_group
+
+
+def sorted_roc_auc(labels, new_group, weights):
+    """
+    Weighted Mann-Whitney AUC of sorted scores: the weight of (positive, negative) pairs ranked in the right order,
+    plus half of the tied ones, over the weight of all pairs. Weights of 0 and 1 select rows, multinomial counts resample them.
+
+    Parameters:
+        labels (np.ndarray): Labels in sorted order, see sort_scores, broadcast against weights.
+        new_group (np.ndarray): Starts of the groups of tied scores, see sort_scores.
+        weights (np.ndarray): Weights of the rows in sorted order, with any leading dimensions.
+
+    Returns:
+        np.ndarray: AUC for every leading index of weights, NaN without positive or negative weight.
+    """
+    positive = np.where(labels, weights, 0)
+    negative = np.where(labels, 0, weights)
+    negative_cum = np.cumsum(negative, axis = -1)
+    # weight of negatives below the group of tied scores of every row, and up to its end
+    below = np.maximum.accumulate(np.where(new_group, negative_cum - negative, 0), axis = -1)
+    group_end = np.ones(new_group.shape, dtype = bool)
+    group_end[..., :-1] = new_group[..., 1:]
+    up_to_end = np.flip(np.minimum.accumulate(np.flip(np.where(group_end, negative_cum, np.inf), axis = -1), axis = -1), axis = -1)
+    pairs = np.sum(positive * (below + 0.5 * (up_to_end - below)), axis = -1)
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        return pairs / (positive.sum(axis = -1) * negative.sum(axis = -1))
+
+
+def batched_roc_auc(y_true, y_score, masks=None):
+    """
+    ROC AUC of many models on the same labels, vectorized instead of one roc_auc_score call per model.
+    Equal to sklearn.metrics.roc_auc_score, tied scores count as half.
+
+    Parameters:
+        y_true (np.ndarray): Binary labels of the rows.
+        y_score (np.ndarray): Predictions, one row per model (or one vector for a single model).
+        masks (np.ndarray, optional): Boolean rows of the subsets to score, e.g. the validation split of every fold.
+            The AUC of every model on every subset is computed from a single sort.
+
+    Returns:
+        np.ndarray: AUC of every model (models x subsets with masks), a float for a single vector without masks.
+    """
+    single = np.ndim(y_score) == 1
+    order, labels, new_group = sort_scores(y_true, y_score)
+    if masks is None:
+        auc = sorted_roc_auc(labels, new_group, np.ones(labels.shape))
+        return float(auc[0]) if single else auc
+    masks = np.atleast_2d(masks)
+    # weights of every subset in the sorted order of every model: models x subsets x rows
+    weights = masks[:, order].transpose(1, 0, 2).astype(np.float64)
+    auc = sorted_roc_auc(labels[:, None, :], new_group[:, None, :], weights)
+    return auc[0] if single else auc
+
+
+def get_validation_masks(folds, n_rows):
+    """
+    Boolean masks of the validation rows of every fold, to score all folds with batched_roc_auc.
+    """
+    masks = np.zeros((len(folds), n_rows), dtype = bool)
+    for fold, (_, val_idx) in enumerate(folds):
+        masks[fold, val_idx] = True
+    return masks
+
+
+def bootstrap_roc_auc(y_true, y_score, n_bootstrap=N_BOOTSTRAP, alpha=0.05, seed=0):
+    """
+    AUC of many models with percentile bootstrap confidence intervals. Resamples are multinomial weights of the rows,
+    scored on the single sort of every model. The same resamples are used for every model, so intervals are paired.
+
+    Parameters:
+        y_true (np.ndarray): Binary labels of the rows.
+        y_score (np.ndarray): Predictions, one row per model (or one vector for a single model).
+        n_bootstrap (int): Number of resamples.
+        alpha (float): The interval covers 1 - alpha.
+        seed (int): Seed of the resamples.
+
+    Returns:
+        tuple: (AUC, lower bound, upper bound), arrays of one value per model, floats for a single vector.
+    """
+    single = np.ndim(y_score) == 1
+    order, labels, new_group = sort_scores(y_true, y_score)
+    n_rows = labels.shape[1]
+    auc = sorted_roc_auc(labels, new_group, np.ones(labels.shape))
+
+    rng = np.random.default_rng(seed)
+    bootstrap_auc = np.empty((labels.shape[0], n_bootstrap))
+    for start in range(0, n_bootstrap, BOOTSTRAP_BATCH_SIZE):
+        # multinomial counts of n_rows draws with replacement, counted with a single bincount
+        n_batch = min(BOOTSTRAP_BATCH_SIZE, n_bootstrap - start)
+        draws = rng.integers(0, n_rows, (n_batch, n_rows)) + np.arange(n_batch)[:, None] * n_rows
+        counts = np.bincount(draws.ravel(), minlength = n_batch * n_rows).reshape(n_batch, n_rows)
+        for model, model_order in enumerate(order):
+            bootstrap_auc[model, start:start + len(counts)] = sorted_roc_auc(labels[model], new_group[model], counts[:, model_order])
+
+    lower, upper = np.nanquantile(bootstrap_auc, [alpha / 2, 1 - alpha / 2], axis = 1)
+    if single:
+        return float(auc[0]), float(lower[0]), float(upper[0])
+    return auc, lower, upper
@@ -0,0 +1,235 @@
+import contextlib
+import cProfile
+import functools
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+from datasets.stage_cache import write_atomic
+
+PROFILERS = ("none", "cprofile", "pyinstrument")
+
+# profiler of the running pipeline, stages and timers are no-ops without one
+_active_profiler = None
+
+
+def get_rss_mb():
+    """
+    Current resident set size of the process in MB, None where /proc is not available.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1 << 20)
+    except (OSError, ValueError):
+        return None
+
+
+def get_peak_rss_mb():
+    """
+    Peak resident set size of the process since it started, in MB.
+    """
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss / (1 << 20) if sys.platform == "darwin" else peak_rss / 1024
+
+
+def get_git_commit(path):
+    """
+    Commit of the repository containing path, None outside a git repository.
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd = path, capture_output = True, text = True, check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class StageProfiler:
+    """
+    Instrumentation of the pipeline stages, saved as timings.json to compare runs across commits.
+    a. stage: wall and cpu time, RSS and peak RSS of a stage, optionally its peak Python allocations
+       and a cProfile or pyinstrument dump. Stages can be nested, only outermost stages are dumped.
+       Stages of different threads are nested separately, the cpu time and allocations of concurrent stages include each other's.
+    b. timer: thread-safe wall time of code run many times, such as trials and folds, aggregated per name.
+    """
+
+    def __init__(self, profile_path=None, profiler="none", trace_allocations=False, logger=None):
+        """
+        Parameters:
+            profile_path (pathlib.Path, optional): Directory of the profile dumps, required unless profiler is "none".
+            profiler (str): Profile dumped for every outermost stage, one of PROFILERS.
+            trace_allocations (bool): Track the peak Python allocations of every stage with tracemalloc, which slows the run down.
+            logger (logging.Logger, optional): Logger reporting every finished stage.
+        """
+        if profiler not in PROFILERS:
+            raise ValueError(f"unknown profiler {profiler}, expected one of {PROFILERS}")
+        if profiler == "pyinstrument":
+            # optional dependency, only needed for its dumps: fail before the run rather than after the first stage
+            import pyinstrument
+        if profiler != "none" and profile_path is None:
+            raise ValueError("profile_path is required to dump profiles")
+        self.profile_path = None if profile_path is None else Path(profile_path)
+        self.profiler = profiler
+        self.trace_allocations = trace_allocations
+        self.logger = logger
+        self.stages = []
+        self.timers = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @property
+    def _stack(self):
+        # stages running in the current thread, outermost first
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        Measure a stage of the pipeline, nested stages are named after their parents, e.g. "train/feature_selection".
+        """
+        parent = self._stack[-1] if self._stack else None
+        record = {"name": name if parent is None else parent["name"] + "/" + name, "rss_start_mb": get_rss_mb(), "child_allocation_peak": 0}
+        if self.trace_allocations:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            # peak of the parent so far, before this stage resets it
+            if parent is not None:
+                parent["child_allocation_peak"] = max(parent["child_allocation_peak"], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        dump = self._start_dump() if parent is None and self.profiler != "none" else None
+
+        self._stack.append(record)
+        start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        finally:
+            record["wall_time"] = time.perf_counter() - start
+            record["cpu_time"] = time.process_time() - cpu_start
+            self._stack.pop()
+            if dump is not None:
+                record["profile"] = self._stop_dump(dump, record["name"])
+            record["rss_end_mb"] = get_rss_mb()
+            record["peak_rss_mb"] = get_peak_rss_mb()
+            child_allocation_peak = record.pop("child_allocation_peak")
+            if self.trace_allocations:
+                allocation_peak = max(tracemalloc.get_traced_memory()[1], child_allocation_peak)
+                record["allocation_peak_mb"] = allocation_peak / (1 << 20)
+                if parent is not None:
+                    parent["child_allocation_peak"] = max(parent["child_allocation_peak"], allocation_peak)
+                tracemalloc.reset_peak()
+            with self._lock:
+                self.stages.append(record)
+            if self.logger is not None:
+                self.logger.info(f'Stage {record["name"]}: {record["wall_time"]:.2f}s wall, {record["cpu_time"]:.2f}s cpu, '
+                                 f'peak RSS {record["peak_rss_mb"]:.0f} MB')
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        """
+        Add the wall time of a block to the count, total and max of its name, safe to use from several threads.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                timer = self.timers.setdefault(name, {"count": 0, "total_time": 0.0, "max_time": 0.0})
+                timer["count"] += 1
+                timer["total_time"] += elapsed
+                timer["max_time"] = max(timer["max_time"], elapsed)
+
+    def _start_dump(self):
+        if self.profiler == "cprofile":
+            profile = cProfile.Profile()
+            profile.enable()
+        else:
+            import pyinstrument
+            profile = pyinstrument.Profiler()
+            profile.start()
+        return profile
+
+    def _stop_dump(self, profile, name):
+        self.profile_path.mkdir(parents = True, exist_ok = True)
+        file_name = name.replace("/", "_")
+        if self.profiler == "cprofile":
+            profile.disable()
+            profile_file = self.profile_path / (file_name + ".prof")
+            profile.dump_stats(profile_file)
+        else:
+            profile.stop()
+            profile_file = self.profile_path / (file_name + ".html")
+            profile_file.write_text(profile.output_html())
+        return str(profile_file)
+
+    def summary(self):
+        """
+        Machine-readable results: the environment of the run, every stage in the order it finished, and the timers.
+        """
+        timers = {name: dict(timer, mean_time = timer["total_time"] / timer["count"]) for name, timer in self.timers.items()}
+        return {
+            "git_commit": get_git_commit(Path(__file__).parent),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "argv": sys.argv,
+            "peak_rss_mb": get_peak_rss_mb(),
+            "stages": self.stages,
+            "timers": timers,
+        }
+
+    def save(self, timings_file):
+        """
+        Save the summary as json, through a unique temporary file so that an interrupted run never leaves a broken file.
+        """
+        summary = self.summary()
+        write_atomic(timings_file, lambda path: path.write_text(json.dumps(summary, indent = 2)))
+
+
+def set_profiler(profiler):
+    """
+    Make a StageProfiler the one stage and timer report to, None to disable them.
+    """
+    global _active_profiler
+    _active_profiler = profiler
+
+
+def get_profiler():
+    """
+    StageProfiler stage and timer report to, None if profiling is disabled.
+    """
+    return _active_profiler
+
+
+def stage(name):
+    """
+    Context manager measuring a stage with the active profiler, does nothing without one.
+    """
+    return contextlib.nullcontext() if _active_profiler is None else _active_profiler.stage(name)
+
+
+def timer(name):
+    """
+    Context manager timing a block with the active profiler, does nothing without one.
+    """
+    return contextlib.nullcontext() if _active_profiler is None else _active_profiler.timer(name)
+
+
+def profiled(name=None):
+    """
+    Decorator measuring every call of a function as a stage of the active profiler, named after the function by default.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name or func.__name__):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,161 @@
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from pathlib import Path
+import pickle
+from .artifacts import write_atomic
+from .profiling import stage
+
+MAX_STAGE_JOBS = 4 # independent stages run at a time, exclusive stages always run alone
+
+
+class StageGraph:
+    """
+    Lazy dependency graph of the stages of the pipeline.
+    a. Stages declare the names of their inputs and outputs, run only computes the stages its targets need.
+    b. Stages whose inputs are ready run concurrently on a thread pool. Exclusive stages, e.g. studies that use every
+       core themselves, run alone on the calling thread.
+    c. Outputs of persisted stages are saved to persist_path. They are loaded from reuse_path instead of running their
+       stage when they were saved there with the same context, e.g. the model backend.
+    Every stage is measured as a stage of the active profiler, named after it.
+    """
+
+    def __init__(self, persist_path=None, reuse_path=None, context=None, max_workers=MAX_STAGE_JOBS, logger=None):
+        """
+        Parameters:
+            persist_path (pathlib.Path, optional): Directory the outputs of persisted stages are saved to.
+            reuse_path (pathlib.Path, optional): Directory of the outputs saved by a previous run, reused when needed.
+            context (dict, optional): Json serializable settings the persisted outputs depend on, outputs saved
+                with another context are not reused.
+            max_workers (int): Number of independent stages run at a time.
+            logger (logging.Logger, optional): Logger reporting the planned stages and the reused outputs.
+        """
+        self.persist_path = None if persist_path is None else Path(persist_path)
+        self.reuse_path = None if reuse_path is None else Path(reuse_path)
+        self.context = context or {}
+        self.max_workers = max_workers
+        self.logger = logger
+        self.stages = {}
+        self.producers = {}
+        self.values = {}
+
+    def add_stage(self, name, func, inputs=(), outputs=None, persist=False, exclusive=False):
+        """
+        Declare a stage.
+
+        Parameters:
+            name (str): Name of the stage.
+            func (callable): Function called with the values of the inputs as keyword arguments, returning the value
+                of its single output or a tuple of the values of its outputs.
+            inputs (list): Names of the outputs of other stages the stage takes.
+            outputs (list, optional): Names of its outputs, the name of the stage if not provided.
+            persist (bool): Save its outputs to persist_path, and reuse them from reuse_path.
+            exclusive (bool): Run the stage alone.
+        """
+        if name in self.stages:
+            raise ValueError(f"stage {name} is already declared")
+        outputs = [name] if outputs is None else list(outputs)
+        for output in outputs:
+            if output in self.producers:
+                raise ValueError(f"output {output} of stage {name} is already produced by stage {self.producers[output]}")
+            self.producers[output] = name
+        self.stages[name] = {"func": func, "inputs": list(inputs), "outputs": outputs, "persist": persist, "exclusive": exclusive}
+
+    def _load_output(self, output):
+        """
+        Load an output saved to reuse_path, returns whether it was reused.
+        """
+        output_file = None if self.reuse_path is None else self.reuse_path / (output + ".pkl")
+        if output_file is None or not self.stages[self.producers[output]]["persist"] or not output_file.exists():
+            return False
+        with open(output_file, "rb") as f:
+            context, value = pickle.load(f)
+        if context != self.context:
+            if self.logger is not None:
+                self.logger.info(f'Not reusing {output} of {output_file}: saved with {context}, not {self.context}')
+            return False
+        self.values[output] = value
+        if self.logger is not None:
+            self.logger.info(f'Reused {output} from {output_file}')
+        return True
+
+    def get_plan(self, targets):
+        """
+        Stages to run for the targets, every stage after the stages it takes inputs from.
+        Outputs that are already computed or reused are not recomputed, and neither are the stages only they need.
+
+        Parameters:
+            targets (list): Names of the outputs to compute.
+
+        Returns:
+            list: Names of the stages to run.
+        """
+        plan, visiting = [], set()
+
+        def visit(output):
+            if output not in self.producers:
+                raise KeyError(f"no stage produces {output}")
+            if output in self.values or self._load_output(output):
+                return
+            name = self.producers[output]
+            if name in plan:
+                return
+            if name in visiting:
+                raise ValueError(f"stage {name} depends on its own outputs")
+            visiting.add(name)
+            for input_name in self.stages[name]["inputs"]:
+                visit(input_name)
+            visiting.remove(name)
+            plan.append(name)
+
+        for target in targets:
+            visit(target)
+        return plan
+
+    def _run_stage(self, name):
+        stage_info = self.stages[name]
+        with stage(name):
+            result = stage_info["func"](**{input_name: self.values[input_name] for input_name in stage_info["inputs"]})
+        values = [result] if len(stage_info["outputs"]) == 1 else list(result)
+        if len(values) != len(stage_info["outputs"]):
+            raise ValueError(f"stage {name} returned {len(values)} values for its outputs {stage_info['outputs']}")
+        for output, value in zip(stage_info["outputs"], values):
+            if stage_info["persist"] and self.persist_path is not None:
+                self.persist_path.mkdir(parents = True, exist_ok = True)
+                write_atomic(self.persist_path / (output + ".pkl"),
+                             lambda path: path.write_bytes(pickle.dumps((self.context, value), protocol = pickle.HIGHEST_PROTOCOL)))
+            self.values[output] = value
+
+    def run(self, targets):
+        """
+        Run the stages the targets need, see get_plan. A failed stage is raised once the running stages finished,
+        the stages that did not start yet are not run.
+
+        Parameters:
+            targets (list): Names of the outputs to compute.
+
+        Returns:
+            dict: Value of every target.
+        """
+        pending = self.get_plan(targets)
+        if self.logger is not None:
+            self.logger.info(f'Stages to run for {list(targets)}: {pending}')
+
+        running = {}
+        with ThreadPoolExecutor(max_workers = self.max_workers, thread_name_prefix = "stage") as executor:
+            while pending or running:
+                ready = [name for name in pending if all(input_name in self.values for input_name in self.stages[name]["inputs"])]
+                exclusive = [name for name in ready if self.stages[name]["exclusive"]]
+                if not exclusive or running:
+                    for name in ready:
+                        if not self.stages[name]["exclusive"]:
+                            pending.remove(name)
+                            running[executor.submit(self._run_stage, name)] = name
+                if not running and exclusive:
+                    pending.remove(exclusive[0])
+                    self._run_stage(exclusive[0])
+                    continue
+                done, _ = wait(running, return_when = FIRST_COMPLETED)
+                for future in done:
+                    del running[future]
+                    future.result()
+
+        return {target: self.values[target] for target in targets}
@@ -1,37 +1,133 @@
-from lightgbm import LGBMRegressor
+from models.engine import get_engine, save_model, load_model
+from datasets import get_engineered_data, save_category_encoders, load_category_encoders
+import sys
+from pathlib import Path
+import numpy as np
 import pandas as pd
 from sklearn.model_selection import StratifiedKFold
 
 
-def generate_prediction(study, test_df, submission_df, X_train, y_train, X_test):
+def generate_prediction(study, test_df, submission_df, X_train, y_train, X_test, model_name="lightgbm", model_path=None, encoders=None):
 
     """
     a. get optimal hyperparameters from optuna trials
     b. retrain model on full data
     c. generate final predictions
-    """ 
-    
-    
+    d. save the fitted model and the categories encoding its features for the scorer, if model_path is given
+    """
+
+
     # get optimal hyperparameters
-    params=study.best_params   
-    params["objective"] = "regression"
-    params["seed"] = 42
-    params["metric"] = "auc"
-    params["boosting_type"] = "gbdt"
-    params['is_unbalance'] = True
-    
-    
+    engine = get_engine(model_name)
+    params = engine.get_params(study.best_params)
+
+
     # retrain model on training datset
-    model = LGBMRegressor(**params)  
-    model.fit(X_train,y_train)
+    model = engine.fit(params, X_train, y_train)
+    if model_path is not None:
+        save_model(model, model_name, X_train.columns, model_path)
+        if encoders is not None:
+            save_category_encoders(encoders, model_path / "encoders.json")
 
     # get probabilistic label
     pred = model.predict(X_test)
     pred_df = pd.concat([test_df, pd.DataFrame({"Predicted": pred})], axis = 1)
-    
+
     # merge to submission file
-    submission_df = pd.read_csv("/home/featurize/work/AIPI520_kaggle/sample_submission.csv")
     submission_df = pd.merge(submission_df.iloc[:,0], pred_df, how = "inner", on = "ID")
-    submission_df.to_csv("submission.csv", index = False)
-    
-    return submission_df
\ No newline at end of file
+
+    return submission_df
+
+
+def index_feature_tables(accounts_data, zipcode_index, subscriptions_data):
+    """
+    Index the engineered tables by account.id once, so that each chunk of accounts only takes its own rows.
+
+    Returns:
+        tuple: Indexed (accounts_data, zipcode_index, subscriptions_data), the zipcode index is kept whole.
+    """
+    return accounts_data.set_index("account.id"), zipcode_index, subscriptions_data.set_index("account.id")
+
+
+def score_accounts(account_ids, engine, model, feature_names, feature_tables, encoders=None):
+    """
+    Score accounts with a saved model, building their features with get_engineered_data.
+
+    Parameters:
+        account_ids (pd.Series): account.id of the accounts to score.
+        engine (ModelEngine): Engine of the model backend.
+        model: Native model returned by load_model.
+        feature_names (list): Feature columns of the model.
+        feature_tables (tuple): Tables returned by index_feature_tables.
+        encoders (dict, optional): Categories fitted on the training data, saved next to the model.
+
+    Returns:
+        pd.DataFrame: ID and Predicted for every account, in input order.
+    """
+    accounts_data, zipcode_index, subscriptions_data = feature_tables
+
+    # rows of the chunk only: the left joins of get_engineered_data give the same result on them
+    tables = []
+    for table in [accounts_data, subscriptions_data]:
+        positions = table.index.get_indexer(account_ids)
+        tables.append(table.iloc[np.unique(positions[positions >= 0])].reset_index())
+
+    ids_df = pd.DataFrame({"ID": account_ids.values})
+    X, _ = get_engineered_data(ids_df, "test", tables[1], zipcode_index, tables[0], encoders)
+    return pd.DataFrame({"ID": ids_df["ID"].values, "Predicted": engine.predict(model, X[feature_names])})
+
+
+def read_account_ids(input_file, chunk_size):
+    """
+    Read account ids in chunks from a csv file, or from stdin if input_file is "-".
+    The id column is "ID" or "account.id", otherwise the first column.
+
+    Parameters:
+        input_file (str or pathlib.Path): csv file of account ids.
+        chunk_size (int): Number of ids per chunk.
+
+    Yields:
+        pd.Series: account.id of a chunk.
+    """
+    reader = pd.read_csv(sys.stdin if str(input_file) == "-" else input_file, chunksize = chunk_size, dtype = str)
+    for chunk in reader:
+        column = next((column for column in ["ID", "account.id"] if column in chunk.columns), chunk.columns[0])
+        yield chunk[column]
+
+
+def score_stream(model_path, feature_tables, input_file, output_file, chunk_size=10000, logger=None):
+    """
+    Score account ids streamed from a file or stdin with a saved model, one chunk at a time.
+    Memory is bounded by the chunk size and the engineered tables, whatever the number of ids.
+
+    Parameters:
+        model_path (pathlib.Path): Directory of the model saved by generate_prediction.
+        feature_tables (tuple): (accounts_data, zipcode_index, subscriptions_data), see datasets.get_feature_tables.
+        input_file (str or pathlib.Path): csv file of account ids, "-" for stdin.
+        output_file (str or pathlib.Path): csv file of the ID and Predicted columns, "-" for stdout.
+        chunk_size (int): Number of accounts scored at a time.
+        logger (logging.Logger, optional): Logger reporting the number of scored accounts.
+
+    Returns:
+        int: Number of scored accounts.
+    """
+    engine, model, model_info = load_model(model_path)
+    # models saved without categories encode each chunk on its own
+    encoders = load_category_encoders(Path(model_path) / "encoders.json")
+    feature_tables = index_feature_tables(*feature_tables)
+
+    n_scored = 0
+    output = sys.stdout if str(output_file) == "-" else open(output_file, "w", newline = "")
+    try:
+        for account_ids in read_account_ids(input_file, chunk_size):
+            predictions = score_accounts(account_ids, engine, model, model_info["feature_names"], feature_tables,
+                                         None if encoders is None else dict(encoders))
+            predictions.to_csv(output, index = False, header = n_scored == 0)
+            n_scored += len(predictions)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    if logger is not None:
+        logger.info(f'Scored {n_scored} accounts with the {model_info["model_name"]} model of {model_path}')
+    return n_scored
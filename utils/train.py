@@ -1,76 +1,537 @@
 
-from models.model import get_model
+from models.engine import get_engine, ENGINES, N_ESTIMATORS
+from .profiling import timer
+from .metrics import batched_roc_auc
 from sklearn.model_selection import StratifiedKFold
-from sklearn.metrics import roc_auc_score
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait
+import collections
+import contextlib
+import functools
+import hashlib
+import multiprocessing
+import os
+import tempfile
+import time
+import threading
 import numpy as np
+import pandas as pd
 import optuna
+from optuna.study import MaxTrialsCallback
+from optuna.trial import TrialState
 import sys
 sys.path.append("..")
 
-def objective(trial, X_train, y_train):
+FOLD_BACKENDS = ("sequential", "thread", "process")
+PRUNERS = ("none", "median", "hyperband", "successive_halving")
+N_FOLDS = 5
+PRUNING_WARMUP_ITERATIONS = N_ESTIMATORS // 5 # boosting iterations of every fold before it can be pruned mid-fold
+MAX_WARM_START_FRACTION = 0.5 # share of the trials of a study that may replay initial parameters, the others are sampled
+MAX_CACHED_DATASETS = 256 # binned fold datasets kept per process, least recently used ones are dropped beyond it
+
+# binned native datasets per (backend, dataset key, fold, binning), one cache per process
+_dataset_cache = collections.OrderedDict()
+_dataset_cache_lock = threading.Lock()
+
+def objective(trial, X_train, y_train, folds=None, fold_executor=None, num_threads=0, early_stopping_rounds=None, report_iterations=False,
+              dataset_key=None, feature_names=None, model_name="lightgbm", trial_cache=None):
     """
     Objective function for hyperparameter optimization using Optuna with model.
 
     Parameters:
         trial (optuna.Trial): Optuna trial object.
-        X_train (pd.DataFrame): Training feature dataset.
-        y_train (pd.Series): Training target variable.
+        X_train (pd.DataFrame, np.ndarray or str): Training features, or the path of a shared array.
+        y_train (pd.Series, np.ndarray or str): Training target, or the path of a shared array.
+        folds (list, optional): (train indices, validation indices) of each fold. Computed from y_train if not provided.
+        fold_executor (concurrent.futures.Executor, optional): Executor training the folds concurrently.
+        num_threads (int): Model threads per fold, 0 uses all cores.
+        early_stopping_rounds (int, optional): Stop boosting a fold once its validation AUC did not improve for this many rounds.
+        report_iterations (bool): Report the validation AUC of every boosting iteration, to prune trials within a fold.
+            Not available with a process pool or catboost, whose folds are only reported once finished.
+        dataset_key (str, optional): Fingerprint of the features, reusing the binned native datasets across trials.
+        feature_names (list, optional): Names of the feature columns.
+        model_name (str): Backend of the model ("lightgbm", "catboost", or "xgboost"), see models.engine.
+        trial_cache (TrialCache, optional): Cache of the study, see TrialCache.for_study. Parameters evaluated before
+            replay their saved fold AUCs instead of training the folds, and are marked with the "cached" user attribute.
+            Replayed trials are never pruned.
 
     Returns:
         float: Mean AUC score for 5-fold cross-validation.
     """
 
     # paramter to be optimized
-    model_params = {
-        "objective": "regression",
-        "metric": "auc",
-        "verbosity": -1,
-        "boosting_type": "gbdt",                
-        "seed": 42,
-        'is_unbalance': True, 
-
-        'learning_rate': trial.suggest_categorical('learning_rate', [0.00001,0.00005, 0.001,0.0005, 0.01,0.05,0.1,0.5,1]),
-        'lambda_l1': trial.suggest_float('lambda_l1', 1e-8, 10.0),
-        'lambda_l2': trial.suggest_float('lambda_l2', 1e-8, 10.0),
-
-        'max_bin': trial.suggest_int('max_bin', 2, 100),
-        'max_depth': trial.suggest_int('max_depth', 2, 100),
-        'min_data_in_leaf': trial.suggest_int('min_data_in_leaf', 2, 100),
-        'min_child_samples': trial.suggest_int('min_child_samples', 2, 100),
-        'num_leaves': trial.suggest_int('num_leaves', 2, 100),
-        
-        'feature_fraction': trial.suggest_float('feature_fraction', 0.1, 1.0),
-        'bagging_fraction': trial.suggest_float('bagging_fraction', 0.1, 1.0),
-        'bagging_freq': trial.suggest_int('bagging_freq', 0, 15),
-        'min_child_samples': trial.suggest_int('min_child_samples', 1, 100),
-    }
+    engine = get_engine(model_name)
+    tuned_params = engine.suggest_params(trial)
+    model_params = engine.get_params(tuned_params, num_threads)
 
-    nfolds = 5
-    fold_pred = np.zeros(len(X_train))
+    # parameters evaluated before return their saved fold AUCs, the per-iteration AUCs are not saved
+    # the running mean after every fold is still reported, so that the pruner compares trained trials with them at
+    # those steps, but a replayed trial is never pruned: it costs nothing and its result is already complete
+    fold_auc = None if trial_cache is None else trial_cache.get(tuned_params)
+    if fold_auc is not None:
+        trial.set_user_attr("cached", True)
+        for fold_ in range(len(fold_auc)):
+            trial.report(np.mean(fold_auc[:fold_ + 1]), get_pruning_step(fold_, N_ESTIMATORS))
+        return np.mean(fold_auc)
+
+    # train folds in parallel, threads are split between the concurrent folds
+    if isinstance(X_train, pd.DataFrame):
+        feature_names = list(X_train.columns)
+        X_train, y_train = X_train.values.astype(np.float64), y_train.values.astype(np.float64)
+    y_values = load_shared_array(y_train) if isinstance(y_train, str) else np.asarray(y_train)
+    if folds is None:
+        folds = get_folds(y_values)
+    fold_pred = np.zeros(len(y_values))
     AUC = []
-    
-    
-    # utilize StratifiedKFold to avoid class-imbalance problem
-    folds = StratifiedKFold(n_splits=nfolds)
 
-    for fold_, (trn_idx, val_idx) in enumerate(folds.split(X_train.values,y_train.values)):
-        print("fold n°{}".format(fold_))
-        
-        #fit training data
-        model = get_model(model_params, "lightgbm") 
-        model.fit(X_train.iloc[trn_idx],y_train.iloc[trn_idx])
-        
-        #get prediction on validation data
-        fold_pred[val_idx] = model.predict(X_train.iloc[val_idx])
-        AUC.append(roc_auc_score(y_train.iloc[val_idx].values, fold_pred[val_idx]))
+    # folds trained in this process report their validation AUC after every boosting iteration
+    stop_event = threading.Event()
+    def get_callbacks(fold_):
+        if not report_iterations or not engine.reports_iterations or isinstance(fold_executor, ProcessPoolExecutor):
+            return None
+        return [get_pruning_callback(engine, trial, fold_, stop_event)]
+
+    if fold_executor is None:
+        # run lazily, so that a pruned trial skips its remaining folds
+        fold_results = (fit_fold(model_params, X_train, y_train, fold_, trn_idx, val_idx, early_stopping_rounds, get_callbacks(fold_), dataset_key, feature_names, model_name)
+                        for fold_, (trn_idx, val_idx) in enumerate(folds))
+    else:
+        futures = [fold_executor.submit(fit_fold, model_params, X_train, y_train, fold_, trn_idx, val_idx, early_stopping_rounds, get_callbacks(fold_), dataset_key, feature_names, model_name)
+                   for fold_, (trn_idx, val_idx) in enumerate(folds)]
+        fold_results = (future.result() for future in futures)
+
+    try:
+        for fold_, ((trn_idx, val_idx), pred) in enumerate(zip(folds, fold_results)):
+            print("fold n°{}".format(fold_))
+            
+            #get prediction on validation data
+            fold_pred[val_idx] = pred
+            AUC.append(batched_roc_auc(y_values[val_idx], fold_pred[val_idx]))
+
+            # report the running mean AUC after each fold
+            trial.report(np.mean(AUC), get_pruning_step(fold_, N_ESTIMATORS))
+            if trial.should_prune():
+                raise optuna.TrialPruned(f"pruned after fold {fold_}")
+    except optuna.TrialPruned:
+        # stop folds still running before the next trial starts
+        stop_event.set()
+        if fold_executor is not None:
+            for future in futures:
+                future.cancel()
+            wait(futures)
+        raise
     
+    # only complete trials are cached, pruned ones did not train every fold
+    if trial_cache is not None:
+        trial.set_user_attr("evicted", len(trial_cache.put(tuned_params, AUC)))
+
     #return mean AUC for 5-fold cross-validation
     print("AUC score: {:<8.5f}".format(np.mean(AUC)))
     return np.mean(AUC)
-    
-def train_model_with_optuna(X_train, y_train, n_trials):
-    
-    study = optuna.create_study(direction='minimize')
-    study.optimize(lambda trial: objective(trial, X_train, y_train), n_trials=n_trials)
-    
+
+
+def get_pruning_step(fold, iteration):
+    """
+    Map a fold and boosting iteration to the step of an Optuna intermediate value.
+    Every fold owns N_ESTIMATORS + 1 steps: one per boosting iteration, then one for the running mean AUC
+    reported once the fold is done (iteration = N_ESTIMATORS).
+    """
+    return fold * (N_ESTIMATORS + 1) + iteration
+
+
+def get_pruning_callback(engine, trial, fold, stop_event):
+    """
+    Create a native callback reporting the validation AUC of every boosting iteration to the trial.
+
+    Parameters:
+        engine (models.engine.ModelEngine): Engine of the backend.
+        trial (optuna.Trial): Optuna trial object.
+        fold (int): Index of the fold.
+        stop_event (threading.Event): Set once the trial is pruned, so that concurrent folds stop as well.
+
+    Returns:
+        Native callback raising optuna.TrialPruned when the trial should be pruned, from PRUNING_WARMUP_ITERATIONS on.
+    """
+    def report(iteration, value):
+        if stop_event.is_set():
+            raise optuna.TrialPruned()
+        trial.report(value, get_pruning_step(fold, iteration))
+        # the AUC of the first trees of a fold is mostly noise
+        if iteration >= PRUNING_WARMUP_ITERATIONS and trial.should_prune():
+            stop_event.set()
+            raise optuna.TrialPruned(f"pruned at fold {fold}, iteration {iteration}")
+    return engine.get_iteration_callback(report)
+
+
+def get_pruner(pruner):
+    """
+    Create the Optuna pruner of a study.
+
+    Parameters:
+        pruner (str): One of PRUNERS.
+
+    Returns:
+        optuna.pruners.BasePruner: Pruner.
+    """
+    # the AUC of the first trees says little about the final CV AUC, trials are pruned at the earliest on the AUC of their first fold
+    min_steps = get_pruning_step(0, N_ESTIMATORS)
+    if pruner == "none":
+        return optuna.pruners.NopPruner()
+    if pruner == "median":
+        return optuna.pruners.MedianPruner(n_startup_trials=5, n_warmup_steps=min_steps)
+    if pruner == "hyperband":
+        return optuna.pruners.HyperbandPruner(min_resource=min_steps, max_resource=get_pruning_step(N_FOLDS, 0))
+    if pruner == "successive_halving":
+        return optuna.pruners.SuccessiveHalvingPruner(min_resource=min_steps)
+    raise ValueError(f"pruner must be one of {PRUNERS}, got {pruner}")
+
+
+def get_folds(y_train, nfolds=N_FOLDS):
+    """
+    Compute the StratifiedKFold train/validation indices once, so that every trial of a study reuses them.
+
+    Parameters:
+        y_train (pd.Series or np.ndarray): Training target variable.
+        nfolds (int): Number of folds.
+
+    Returns:
+        list: (train indices, validation indices) of each fold.
+    """
+    # utilize StratifiedKFold to avoid class-imbalance problem
+    folds = StratifiedKFold(n_splits=nfolds)
+    return list(folds.split(np.zeros(len(y_train)), np.asarray(y_train)))
+
+
+def share_array(array, shared_path):
+    """
+    Save an array as .npy so that worker processes memory-map it instead of receiving a pickled copy.
+
+    Parameters:
+        array (np.ndarray): Array to share.
+        shared_path (str): Path of the .npy file.
+
+    Returns:
+        str: Path of the .npy file, to be passed to the workers.
+    """
+    np.save(shared_path, np.ascontiguousarray(array))
+    return str(shared_path)
+
+
+@functools.lru_cache(maxsize=None)
+def load_shared_array(shared_path):
+    """
+    Memory-map an array shared through share_array, once per process.
+    """
+    return np.load(shared_path, mmap_mode="r")
+
+
+def get_dataset_key(X_train, feature_names):
+    """
+    Fingerprint a feature matrix, so that cached native datasets are only reused for the same data and features.
+
+    Parameters:
+        X_train (np.ndarray): Training features.
+        feature_names (list): Names of the feature columns.
+
+    Returns:
+        str: Hex digest of the features.
+    """
+    sha = hashlib.sha1()
+    sha.update(repr((X_train.shape, list(feature_names))).encode())
+    sha.update(np.ascontiguousarray(X_train).tobytes())
+    return sha.hexdigest()
+
+
+def get_fold_datasets(engine, X_train, y_train, fold, trn_idx, val_idx, params, dataset_key=None, feature_names=None):
+    """
+    Get the native datasets of a fold, built once per (backend, data, fold, binning) and reused across trials.
+    The validation dataset is binned with the boundaries of the training one.
+
+    Parameters:
+        engine (models.engine.ModelEngine): Engine of the backend.
+        X_train (np.ndarray): Training features.
+        y_train (np.ndarray): Training target.
+        fold (int): Index of the fold.
+        trn_idx (np.ndarray): Training indices of the fold.
+        val_idx (np.ndarray): Validation indices of the fold.
+        params (dict): Model parameters, whose engine.binning_param is part of the cache key.
+        dataset_key (str, optional): Fingerprint of the features, see get_dataset_key. If not provided, datasets are not cached.
+        feature_names (list, optional): Names of the feature columns.
+
+    Returns:
+        tuple: (training dataset, validation dataset).
+    """
+    key = (engine.name, dataset_key, fold, params[engine.binning_param])
+    if dataset_key is not None:
+        with _dataset_cache_lock:
+            if key in _dataset_cache:
+                _dataset_cache.move_to_end(key)
+                return _dataset_cache[key]
+
+    datasets = engine.build_datasets(X_train[trn_idx], y_train[trn_idx], X_train[val_idx], y_train[val_idx], params, feature_names)
+
+    if dataset_key is not None:
+        with _dataset_cache_lock:
+            _dataset_cache[key] = datasets
+            while len(_dataset_cache) > MAX_CACHED_DATASETS:
+                _dataset_cache.popitem(last=False)
+    return datasets
+
+
+def fit_fold(model_params, X_train, y_train, fold, trn_idx, val_idx, early_stopping_rounds=None, callbacks=None,
+             dataset_key=None, feature_names=None, model_name="lightgbm"):
+    """
+    Fit one cross-validation fold and predict its validation split.
+
+    Parameters:
+        model_params (dict): Model parameters.
+        X_train (np.ndarray or str): Training features, or the path of a shared array.
+        y_train (np.ndarray or str): Training target, or the path of a shared array.
+        fold (int): Index of the fold.
+        trn_idx (np.ndarray): Training indices of the fold.
+        val_idx (np.ndarray): Validation indices of the fold.
+        early_stopping_rounds (int, optional): Stop boosting once the validation AUC did not improve for this many rounds.
+        callbacks (list, optional): Additional native callbacks.
+        dataset_key (str, optional): Fingerprint of the features, reusing the cached datasets of the fold.
+        feature_names (list, optional): Names of the feature columns.
+        model_name (str): Backend of the model.
+
+    Returns:
+        np.ndarray: Predictions on the validation split.
+    """
+    if isinstance(X_train, str):
+        X_train = load_shared_array(X_train)
+    if isinstance(y_train, str):
+        y_train = load_shared_array(y_train)
+
+    #fit training data, evaluated on the validation split for early stopping and pruning
+    # folds trained in worker processes of the process backend are not timed
+    engine = get_engine(model_name)
+    with timer("fold/datasets"):
+        train_set, valid_set = get_fold_datasets(engine, X_train, y_train, fold, trn_idx, val_idx, model_params, dataset_key, feature_names)
+    with timer("fold/train"):
+        model = engine.train(model_params, train_set, valid_set, N_ESTIMATORS, early_stopping_rounds, callbacks)
+
+    with timer("fold/predict"):
+        return engine.predict(model, X_train[val_idx])
+
+
+def get_storage(storage):
+    """
+    Create the Optuna storage shared by the workers of a study.
+
+    Parameters:
+        storage (str or optuna.storages.BaseStorage, optional): Database URL (e.g. "sqlite:///optuna.db"), path of a journal file
+            or storage object. Journal files can live on a shared file system to run workers on several machines.
+
+    Returns:
+        Storage accepted by optuna.create_study, None for an in-memory study.
+    """
+    # storage objects are shared as they are, e.g. an in-memory storage holding every study of a run
+    if storage is None or isinstance(storage, optuna.storages.BaseStorage) or "://" in storage:
+        return storage
+    try:
+        from optuna.storages.journal import JournalFileBackend
+    except ImportError:
+        # optuna < 4.0
+        from optuna.storages import JournalFileStorage as JournalFileBackend
+    return optuna.storages.JournalStorage(JournalFileBackend(str(storage)))
+
+
+def get_finished_trials(study):
+    """
+    Return the trials of a study that do not need to run again when the study is resumed.
+    """
+    return study.get_trials(deepcopy=False, states=(TrialState.COMPLETE, TrialState.PRUNED))
+
+
+def get_top_params(study, k):
+    """
+    Parameters of the k best complete trials of a study, best first, to warm-start another study over the same search space.
+    """
+    trials = study.get_trials(deepcopy=False, states=(TrialState.COMPLETE,))
+    return [trial.params for trial in sorted(trials, key=lambda trial: trial.value, reverse=True)[:k]]
+
+
+def optimize_study(study, X_train, y_train, n_trials, fold_backend, n_fold_jobs, objective_kwargs, max_worker_trials=None):
+    """
+    Run trials of a study in the current process until it holds n_trials finished trials.
+
+    Parameters:
+        study (optuna.study.Study): Study to optimize.
+        X_train (np.ndarray or str): Training features, or the path of a shared array.
+        y_train (np.ndarray or str): Training target, or the path of a shared array.
+        n_trials (int): Number of finished trials the study should hold, counted across all workers.
+        fold_backend (str): How folds of a trial are trained: "sequential", "thread" or "process".
+        n_fold_jobs (int): Number of folds trained concurrently.
+        objective_kwargs (dict): Keyword arguments of objective shared by all trials (folds, num_threads, ...).
+        max_worker_trials (int, optional): Maximum number of trials run by this worker.
+    """
+    n_remaining = n_trials - len(get_finished_trials(study))
+    if max_worker_trials is not None:
+        n_remaining = min(n_remaining, max_worker_trials)
+    if n_remaining <= 0:
+        return
+
+    with contextlib.ExitStack() as stack:
+        fold_executor = None
+        if fold_backend == "thread":
+            fold_executor = stack.enter_context(ThreadPoolExecutor(max_workers=n_fold_jobs))
+        elif fold_backend == "process":
+            if not isinstance(X_train, str):
+                shared_dir = stack.enter_context(tempfile.TemporaryDirectory())
+                X_train = share_array(X_train, os.path.join(shared_dir, "X_train.npy"))
+                y_train = share_array(y_train, os.path.join(shared_dir, "y_train.npy"))
+            # spawn, forking after LightGBM initialized OpenMP can deadlock the workers
+            fold_executor = stack.enter_context(ProcessPoolExecutor(max_workers=n_fold_jobs, mp_context=multiprocessing.get_context("spawn")))
+
+        # other workers add trials to the same storage, stop once the study holds n_trials finished trials
+        max_trials = MaxTrialsCallback(n_trials, states=(TrialState.COMPLETE, TrialState.PRUNED))
+        def timed_objective(trial):
+            with timer("trial"):
+                return objective(trial, X_train, y_train, fold_executor=fold_executor, **objective_kwargs)
+        study.optimize(timed_objective, n_trials=n_remaining, callbacks=[max_trials])
+
+
+def run_study_worker(study_name, storage, pruner, X_train, y_train, n_trials, fold_backend, n_fold_jobs, objective_kwargs, max_worker_trials):
+    """
+    Worker process of a parallel study: load the study from the shared storage and run trials until it is finished.
+    Arguments are the ones of optimize_study, with the study given by its name, storage and pruner.
+    """
+    optuna.logging.set_verbosity(optuna.logging.WARNING)
+    study = optuna.load_study(study_name=study_name, storage=get_storage(storage), pruner=get_pruner(pruner))
+    optimize_study(study, X_train, y_train, n_trials, fold_backend, n_fold_jobs, objective_kwargs, max_worker_trials)
+
+
+def train_model_with_optuna(X_train, y_train, n_trials, fold_backend="thread", n_fold_jobs=None,
+                            n_workers=1, storage=None, study_name=None, pruner="none", early_stopping_rounds=None,
+                            model_name="lightgbm", initial_params=None, sampler=None, trial_cache=None, logger=None):
+    """
+    Run an Optuna study over the parameters of a backend, see models.engine.
+    Folds are computed once per study and the feature matrix is converted to numpy once, outside the trials.
+    With a storage, the study is resumed from the trials already finished in it, and trials can run in several
+    worker processes, or on several machines pointing at the same storage and study name.
+
+    Parameters:
+        X_train (pd.DataFrame): Training feature dataset.
+        y_train (pd.Series): Training target variable.
+        n_trials (int): Number of finished (complete or pruned) trials the study should hold.
+        fold_backend (str): How folds of a trial are trained: "sequential", "thread" or "process".
+            Process workers memory-map the data from temporary .npy files instead of receiving pickled copies.
+        n_fold_jobs (int, optional): Number of folds trained concurrently. Defaults to one per fold, bounded by the cpu count.
+        n_workers (int): Number of worker processes running trials concurrently, requires a storage when above 1.
+        storage (str or optuna.storages.BaseStorage, optional): Database URL or journal file path shared by the workers, see get_storage.
+        study_name (str, optional): Name of the study in the storage.
+        pruner (str): Pruner stopping unpromising trials, one of PRUNERS. The AUC is reported after every fold and,
+            unless folds run in a process pool, after every boosting iteration.
+        early_stopping_rounds (int, optional): Stop boosting a fold once its validation AUC did not improve for this many rounds.
+        model_name (str): Backend of the model ("lightgbm", "catboost", or "xgboost").
+        initial_params (list, optional): Tuned parameters evaluated by the first trials of a new study, e.g. the best
+            parameters of a previous study, to warm-start it. At most MAX_WARM_START_FRACTION of n_trials (and at least
+            one trial) replay them, so that the sampler still explores.
+        sampler (optuna.samplers.BaseSampler, optional): Sampler of the study, a new one for every study since samplers such
+            as TPE cannot be shared between studies. Defaults to the Optuna default sampler. Workers of other processes use
+            their own default sampler.
+        trial_cache (TrialCache, optional): Persistent cache of evaluated parameters, trials of parameters evaluated
+            before on the same data, folds and backend return their saved AUC instead of training the folds.
+        logger (logging.Logger, optional): Logger reporting the trial cache hits of the study.
+
+    Returns:
+        optuna.study.Study: Finished study.
+    """
+    if fold_backend not in FOLD_BACKENDS:
+        raise ValueError(f"fold_backend must be one of {FOLD_BACKENDS}, got {fold_backend}")
+    if n_workers > 1 and (storage is None or isinstance(storage, optuna.storages.InMemoryStorage)):
+        raise ValueError("running trials in several workers requires a storage shared by the workers")
+
+    folds = get_folds(y_train)
+    n_cpus = os.cpu_count() or 1
+    n_fold_jobs = 1 if fold_backend == "sequential" else (n_fold_jobs or min(len(folds), max(1, n_cpus // n_workers)))
+    # split the cores between workers and concurrent folds to avoid oversubscription
+    num_threads = max(1, n_cpus // (n_workers * n_fold_jobs))
+    objective_kwargs = {
+        "folds": folds,
+        "num_threads": num_threads,
+        "early_stopping_rounds": early_stopping_rounds,
+        "report_iterations": pruner != "none",
+        "model_name": model_name,
+    }
+
+    # convert from pandas once, the binned datasets of every fold and binning setting are then reused across trials
+    X_values = X_train.values.astype(np.float64)
+    y_values = y_train.values.astype(np.float64)
+    objective_kwargs["feature_names"] = list(X_train.columns)
+    objective_kwargs["dataset_key"] = get_dataset_key(X_values, X_train.columns)
+    if trial_cache is not None:
+        objective_kwargs["trial_cache"] = trial_cache.for_study(objective_kwargs["dataset_key"], y_values, folds, model_name, early_stopping_rounds)
+
+    study = optuna.create_study(direction='maximize', storage=get_storage(storage), study_name=study_name,
+                                sampler=sampler, pruner=get_pruner(pruner), load_if_exists=True)
+    # a resumed study already ran them, and trials beyond n_trials would never run
+    n_previous_trials = len(study.trials)
+    if not study.trials and initial_params:
+        n_warm_start_trials = min(len(initial_params), max(1, int(n_trials * MAX_WARM_START_FRACTION)))
+        if logger is not None and n_warm_start_trials < len(initial_params):
+            logger.info(f'Warm start: {n_warm_start_trials} of {len(initial_params)} initial parameters enqueued, '
+                        f'the other {n_trials - n_warm_start_trials} of {n_trials} trials are sampled')
+        for params in initial_params[:n_warm_start_trials]:
+            study.enqueue_trial(params)
+
+    if n_workers == 1:
+        optimize_study(study, X_values, y_values, n_trials, fold_backend, n_fold_jobs, objective_kwargs)
+    elif n_trials > len(get_finished_trials(study)):
+        # split the remaining trials between workers, the trial callback still caps the study when other machines join
+        max_worker_trials = -(-(n_trials - len(get_finished_trials(study))) // n_workers)
+
+        # workers memory-map the data instead of receiving pickled copies
+        with tempfile.TemporaryDirectory() as shared_dir:
+            X_shared = share_array(X_values, os.path.join(shared_dir, "X_train.npy"))
+            y_shared = share_array(y_values, os.path.join(shared_dir, "y_train.npy"))
+            with ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+                futures = [executor.submit(run_study_worker, study.study_name, storage, pruner, X_shared, y_shared,
+                                           n_trials, fold_backend, n_fold_jobs, objective_kwargs, max_worker_trials) for _ in range(n_workers)]
+                for future in futures:
+                    future.result()
+
+    if trial_cache is not None and logger is not None:
+        log_trial_cache_stats(study, n_previous_trials, objective_kwargs["trial_cache"], logger)
     return study
+
+
+def log_trial_cache_stats(study, n_previous_trials, trial_cache, logger):
+    """
+    Log the trial cache hits of the trials a study ran since it held n_previous_trials, counted across all its workers.
+    """
+    trials = [trial for trial in get_finished_trials(study) if trial.number >= n_previous_trials]
+    hits = sum(1 for trial in trials if trial.user_attrs.get("cached"))
+    evicted = sum(trial.user_attrs.get("evicted", 0) for trial in trials)
+    n_entries, cache_size = trial_cache.get_size()
+    logger.info(f'Trial cache: {hits} hits, {len(trials) - hits} misses ({hits / max(1, len(trials)):.0%} of {len(trials)} trials), '
+                f'{evicted} evicted, {n_entries} entries ({cache_size / (1 << 20):.2f} MB of {trial_cache.max_cache_size / (1 << 20):.2f} MB)')
+
+
+def benchmark_models(X_train, y_train, n_trials, logger=None, model_names=None, **study_kwargs):
+    """
+    Run the same study for several backends on the same feature matrix and compare their CV AUC and wall-clock time.
+
+    Parameters:
+        X_train (pd.DataFrame): Training feature dataset.
+        y_train (pd.Series): Training target variable.
+        n_trials (int): Number of trials of each study.
+        logger (logging.Logger, optional): Logger reporting the result of each backend.
+        model_names (list, optional): Backends to compare, defaults to all engines.
+        **study_kwargs: Other arguments of train_model_with_optuna, study_name gets the backend name appended.
+
+    Returns:
+        pd.DataFrame: Best CV AUC, number of trials and wall-clock time of each backend.
+    """
+    results = []
+    study_name = study_kwargs.pop("study_name", None)
+    for model_name in model_names or list(ENGINES):
+        start = time.perf_counter()
+        study = train_model_with_optuna(X_train, y_train, n_trials, model_name=model_name, logger=logger,
+                                        study_name=study_name and f"{study_name}_{model_name}", **study_kwargs)
+        wall_time = time.perf_counter() - start
+        results.append({"model": model_name, "best_auc": study.best_value, "n_trials": len(study.trials), "wall_time": wall_time})
+        if logger is not None:
+            logger.info(f'  {model_name}: best AUC {study.best_value:.5f}, {len(study.trials)} trials in {wall_time:.2f}s')
+    return pd.DataFrame(results)
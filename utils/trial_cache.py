@@ -0,0 +1,133 @@
+from datasets.stage_cache import evict_stage_cache, get_source_fingerprint
+from models.engine import get_engine, N_ESTIMATORS
+from importlib import metadata
+from pathlib import Path
+import hashlib
+import json
+import numpy as np
+from .artifacts import write_atomic
+
+MAX_TRIAL_CACHE_SIZE = 16 << 20 # bytes of cached trial results, about 50000 trials
+TRIAL_CACHE_SCAN_INTERVAL = 100 # puts between scans of the cache size, which other workers also write to
+TRIAL_CACHE_EVICTION_TARGET = 0.9 # fraction of the size budget left after an eviction, so that evictions are rare
+
+
+def normalize_params(params):
+    """
+    Canonical json of tuned parameters: sorted keys, numpy scalars as python values and floats rounded to 12
+    significant digits, so that the same configuration always gives the same key.
+    """
+    def normalize(value):
+        value = value.item() if isinstance(value, np.generic) else value
+        return float("%.12g" % value) if isinstance(value, float) else value
+    return json.dumps({name: normalize(value) for name, value in params.items()}, sort_keys = True)
+
+
+class TrialCache:
+    """
+    Persistent cache of the fold AUCs of evaluated hyperparameters, shared by the studies of every run on the same data.
+    a. The key of a trial combines the study key (features and their names, labels, folds, backend and its version,
+       early stopping, and the source of the models package and of the training code) with its normalized parameters.
+    b. Every entry is a small json file written atomically, so that the worker processes of a study share the cache.
+    c. Entries are touched on every hit, and least recently used ones are evicted beyond max_cache_size bytes. The size
+       of the cache is kept running and only rescanned every TRIAL_CACHE_SCAN_INTERVAL puts, so that a put does not
+       list the whole cache.
+    The cache is picklable, process workers receive it with the arguments of the objective.
+    """
+
+    def __init__(self, cache_path, max_cache_size=MAX_TRIAL_CACHE_SIZE, study_key=None):
+        """
+        Parameters:
+            cache_path (pathlib.Path): Directory of the cached trials.
+            max_cache_size (int): Size budget of the cache in bytes.
+            study_key (str, optional): Key of the study, see for_study.
+        """
+        self.cache_path = Path(cache_path)
+        self.max_cache_size = max_cache_size
+        self.study_key = study_key
+        # running size of the cache in bytes, None until the first put scans it
+        self._cache_size = None
+        self._n_puts = 0
+
+    def for_study(self, dataset_key, y_train, folds, model_name, early_stopping_rounds=None):
+        """
+        Cache of the trials of a study, whose results only depend on their parameters.
+        The number of model threads is left out of the key on purpose: it only changes the order in which the backends
+        sum their histograms and gradients, so fold AUCs agree up to rounding, and runs with other --n-workers or fold
+        backends still share the cache.
+
+        Parameters:
+            dataset_key (str): Fingerprint of the features and their names, see get_dataset_key.
+            y_train (np.ndarray): Training target.
+            folds (list): (train indices, validation indices) of each fold.
+            model_name (str): Backend of the model.
+            early_stopping_rounds (int, optional): Early stopping of the folds.
+
+        Returns:
+            TrialCache: Cache in the same directory, keyed by the study.
+        """
+        sha = hashlib.sha256()
+        sha.update(repr((dataset_key, model_name, metadata.version(model_name), early_stopping_rounds, N_ESTIMATORS)).encode())
+        sha.update(np.ascontiguousarray(y_train, dtype = np.float64).tobytes())
+        for _, val_idx in folds:
+            sha.update(np.ascontiguousarray(val_idx, dtype = np.int64).tobytes())
+        sha.update(get_source_fingerprint(get_engine).encode())
+        sha.update(Path(__file__).with_name("train.py").read_bytes())
+        return TrialCache(self.cache_path, self.max_cache_size, sha.hexdigest())
+
+    def _get_entry(self, params):
+        key = hashlib.sha256((self.study_key + normalize_params(params)).encode()).hexdigest()[:32]
+        return self.cache_path / (key + ".json")
+
+    def get(self, params):
+        """
+        Fold AUCs of parameters evaluated before, None if they were not.
+        """
+        entry = self._get_entry(params)
+        try:
+            fold_auc = json.loads(entry.read_text())["fold_auc"]
+            # mark the entry as recently used
+            entry.touch()
+        except (FileNotFoundError, ValueError, KeyError):
+            # missing, evicted meanwhile, or written by an older version
+            return None
+        return fold_auc
+
+    def put(self, params, fold_auc):
+        """
+        Save the fold AUCs of evaluated parameters. Once the size budget is exceeded, least recently used entries are
+        evicted down to TRIAL_CACHE_EVICTION_TARGET of the budget.
+
+        Returns:
+            list: Names of the evicted entries.
+        """
+        self.cache_path.mkdir(parents = True, exist_ok = True)
+        entry = self._get_entry(params)
+        record = {"params": json.loads(normalize_params(params)), "fold_auc": [float(auc) for auc in fold_auc]}
+        text = json.dumps(record)
+        write_atomic(entry, lambda path: path.write_text(text))
+
+        self._n_puts += 1
+        if self._cache_size is None or self._n_puts % TRIAL_CACHE_SCAN_INTERVAL == 0:
+            self._cache_size = self.get_size()[1]
+        else:
+            self._cache_size += len(text)
+        if self._cache_size <= self.max_cache_size:
+            return []
+        eviction_size = int(self.max_cache_size * TRIAL_CACHE_EVICTION_TARGET)
+        evicted = evict_stage_cache(self.cache_path, eviction_size, "*.json")
+        # the cache now fits into the eviction size, up to entries other workers wrote meanwhile
+        self._cache_size = eviction_size
+        return evicted
+
+    def get_size(self):
+        """
+        Number of entries and size in bytes of the cache.
+        """
+        sizes = []
+        for entry in self.cache_path.glob("*.json"):
+            try:
+                sizes.append(entry.stat().st_size)
+            except FileNotFoundError:
+                pass
+        return len(sizes), sum(sizes)